@@ -0,0 +1,100 @@
+import json
+import os
+
+import numpy as np
+
+
+class FeatureStore:
+    """On-disk store of extracted feature vectors, memory-mapped on read.
+
+    Features are appended as chunk files (`chunk_00000.npy`, ...) and an
+    `index.json` maps each key to its (chunk, row). A key identifies one
+    extracted image: its path, modification time and augmentation seed, so
+    an edited file or a different seed is simply a new key. Reads go
+    through `np.load(mmap_mode='r')`, so only the rows actually used are
+    paged in.
+    """
+
+    INDEX_FILE = 'index.json'
+
+    def __init__(self, directory, dim=1280):
+        self.directory = directory
+        self.dim = dim
+        os.makedirs(directory, exist_ok=True)
+        self._chunks = []
+        self._entries = {}
+        self._mmaps = {}
+        self._load_index()
+
+    @staticmethod
+    def make_key(path, seed=None):
+        """Key for an image file: absolute path, mtime and augmentation seed"""
+        path = os.path.abspath(path)
+        mtime = os.stat(path).st_mtime_ns
+        return f"{path}|{mtime}|{'noaug' if seed is None else seed}"
+
+    def _index_path(self):
+        return os.path.join(self.directory, self.INDEX_FILE)
+
+    def _load_index(self):
+        path = self._index_path()
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            index = json.load(f)
+        if index.get('dim') != self.dim:
+            print(f"WARNING: feature store at {self.directory} has dim {index.get('dim')}, "
+                  f"expected {self.dim}; ignoring it")
+            return
+        self._chunks = index['chunks']
+        self._entries = {key: tuple(loc) for key, loc in index['entries'].items()}
+
+    def _save_index(self):
+        tmp_path = self._index_path() + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'dim': self.dim, 'chunks': self._chunks, 'entries': self._entries}, f)
+        os.replace(tmp_path, self._index_path())
+
+    def _chunk(self, chunk_idx):
+        if chunk_idx not in self._mmaps:
+            path = os.path.join(self.directory, self._chunks[chunk_idx])
+            self._mmaps[chunk_idx] = np.load(path, mmap_mode='r')
+        return self._mmaps[chunk_idx]
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def keys(self):
+        """Return all stored keys"""
+        return list(self._entries)
+
+    def missing(self, keys):
+        """Return the keys that have no stored features"""
+        return [key for key in keys if key not in self._entries]
+
+    def get_many(self, keys):
+        """Return an (N, dim) float32 array of stored features for keys"""
+        out = np.empty((len(keys), self.dim), dtype=np.float32)
+        for i, key in enumerate(keys):
+            chunk_idx, row = self._entries[key]
+            out[i] = self._chunk(chunk_idx)[row]
+        return out
+
+    def append(self, keys, features):
+        """Store features for keys as a new chunk and persist the index"""
+        if not keys:
+            return
+        features = np.asarray(features, dtype=np.float32)
+        if features.shape != (len(keys), self.dim):
+            raise ValueError(f"Expected features of shape {(len(keys), self.dim)}, got {features.shape}")
+
+        chunk_idx = len(self._chunks)
+        name = f"chunk_{chunk_idx:05d}.npy"
+        np.save(os.path.join(self.directory, name), features)
+        self._chunks.append(name)
+        for row, key in enumerate(keys):
+            self._entries[key] = (chunk_idx, row)
+        self._save_index()
@@ -75,6 +75,10 @@
 # #########################################################################################
 
 import os
+import argparse
+import shutil
+import tempfile
+import time
 import numpy as np
 import tensorflow as tf
 from tensorflow.keras.preprocessing.image import ImageDataGenerator, load_img, img_to_array
@@ -82,9 +86,11 @@ from tensorflow.keras.applications import ResNet50, VGG19
 from tensorflow.keras.applications.resnet50 import preprocess_input as resnet_preprocess
 from tensorflow.keras.applications.vgg19 import preprocess_input as vgg_preprocess
 from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import Dense, GlobalAveragePooling2D
+from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, RandomFlip, RandomRotation, RandomZoom
 from tensorflow.keras.optimizers import Adam
+from tensorflow.keras.callbacks import Callback
 from sklearn.metrics import classification_report, accuracy_score
+from feature_store import FeatureStore
 
 # Paths
 base_dir = r"C:\Users\admin\OneDrive\Desktop\Ai Agent Project\Cotton Disease"  # Update as needed
@@ -98,6 +104,28 @@ BATCH_SIZE = 32
 NUM_CLASSES = 4
 EPOCHS = 10
 
+# Input pipeline: 'tfdata' decodes and augments in parallel with tf.data,
+# 'generator' uses the original ImageDataGenerator. The tf.data pipeline
+# caches the decoded, resized images of each split in DECODED_CACHE_DIR on
+# the first pass, before any backbone-specific preprocessing, so later
+# epochs and the second backbone read them instead of decoding again.
+# Delete the directory after changing the dataset.
+INPUT_PIPELINE = os.environ.get('INPUT_PIPELINE', 'tfdata')
+DECODED_CACHE_DIR = os.environ.get('DECODED_CACHE_DIR') or os.path.join(base_dir, 'decoded_cache')
+SHUFFLE_BUFFER = 1000
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.ppm', '.tif', '.tiff')
+AUTOTUNE = tf.data.AUTOTUNE
+
+# Training mode: 'end_to_end' runs the frozen backbone on every image in
+# every epoch, 'cached_features' runs it once per image, stores the pooled
+# activations in a FeatureStore under FEATURE_CACHE_DIR/<model name> and
+# trains only the Dense head on them. FEATURE_AUGMENT_VARIANTS augmented
+# copies of every training image are also cached; each epoch then sees a
+# random one of the copies (or the original) of each image.
+TRAINING_MODE = os.environ.get('TRAINING_MODE', 'end_to_end')
+FEATURE_CACHE_DIR = os.environ.get('FEATURE_CACHE_DIR') or os.path.join(base_dir, 'feature_cache')
+FEATURE_AUGMENT_VARIANTS = int(os.environ.get('FEATURE_AUGMENT_VARIANTS', '0'))
+
 # Data generators
 def create_generators(preprocess_func):
     train_datagen = ImageDataGenerator(preprocessing_function=preprocess_func, horizontal_flip=True, rotation_range=20, zoom_range=0.2)
@@ -109,6 +137,163 @@ def create_generators(preprocess_func):
 
     return train_gen, val_gen, test_gen
 
+# tf.data pipeline
+def list_split(directory):
+    """Image paths, class indices and class names of a split, ordered like flow_from_directory"""
+    class_labels = sorted(d for d in os.listdir(directory) if os.path.isdir(os.path.join(directory, d)))
+    paths, labels = [], []
+    for label, name in enumerate(class_labels):
+        for root, _, files in sorted(os.walk(os.path.join(directory, name))):
+            for file in sorted(files):
+                if file.lower().endswith(IMAGE_EXTENSIONS):
+                    paths.append(os.path.join(root, file))
+                    labels.append(label)
+    return paths, np.array(labels, dtype=np.int32), class_labels
+
+def decode_file(path, label):
+    """Read, decode and resize one image to uint8 RGB, as load_img does"""
+    image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    image = tf.image.resize(image, IMAGE_SIZE, method='nearest')
+    return tf.cast(image, tf.uint8), tf.one_hot(label, NUM_CLASSES)
+
+# Same augmentation as the training ImageDataGenerator
+augmentation = Sequential([
+    RandomFlip('horizontal'),
+    RandomRotation(20 / 360, fill_mode='nearest'),
+    RandomZoom((-0.2, 0.2), (-0.2, 0.2), fill_mode='nearest')
+])
+
+def decoded_dataset(split_dir, split):
+    """Decoded images of a split, cached on disk after the first full pass"""
+    paths, labels, class_labels = list_split(split_dir)
+    os.makedirs(DECODED_CACHE_DIR, exist_ok=True)
+    ds = tf.data.Dataset.from_tensor_slices((paths, labels))
+    ds = ds.map(decode_file, num_parallel_calls=AUTOTUNE, deterministic=True)
+    ds = ds.cache(os.path.join(DECODED_CACHE_DIR, f"{split}_{IMAGE_SIZE[0]}x{IMAGE_SIZE[1]}"))
+    return ds, labels, class_labels
+
+def augment_batch(images, labels):
+    return augmentation(tf.cast(images, tf.float32), training=True), labels
+
+def create_datasets(preprocess_func):
+    """tf.data equivalents of create_generators: (train, val, test, test labels, class labels)"""
+    def preprocess(images, labels):
+        return preprocess_func(tf.cast(images, tf.float32)), labels
+
+    def prefetch_preprocessed(ds):
+        return ds.map(preprocess, num_parallel_calls=AUTOTUNE).prefetch(AUTOTUNE)
+
+    train_ds, _, class_labels = decoded_dataset(train_dir, 'train')
+    val_ds, _, _ = decoded_dataset(val_dir, 'val')
+    test_ds, test_labels, _ = decoded_dataset(test_dir, 'test')
+
+    train_ds = train_ds.shuffle(SHUFFLE_BUFFER, reshuffle_each_iteration=True).batch(BATCH_SIZE)
+    train_ds = train_ds.map(augment_batch, num_parallel_calls=AUTOTUNE)
+    train_ds = prefetch_preprocessed(train_ds)
+    val_ds = prefetch_preprocessed(val_ds.batch(BATCH_SIZE))
+    test_ds = prefetch_preprocessed(test_ds.batch(BATCH_SIZE))
+    return train_ds, val_ds, test_ds, test_labels, class_labels
+
+class EpochThroughput(Callback):
+    """Prints and records the training images per second of every epoch"""
+
+    def __init__(self, n_images):
+        super().__init__()
+        self.n_images = n_images
+        self.images_per_second = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        rate = self.n_images / (time.perf_counter() - self.start)
+        self.images_per_second.append(rate)
+        print(f"Epoch {epoch + 1}: {rate:.1f} images/s (including validation)")
+
+def input_throughput(batches, n_images):
+    """Images per second of one pass over an input pipeline, without any model"""
+    start = time.perf_counter()
+    for _ in batches:
+        pass
+    return n_images / (time.perf_counter() - start)
+
+def compare_pipelines(preprocess_func=resnet_preprocess, epochs=2):
+    """Time training-set epochs of the generator and tf.data pipelines"""
+    n_images = len(list_split(train_dir)[0])
+    train_gen = create_generators(preprocess_func)[0]
+    train_ds = create_datasets(preprocess_func)[0]
+    print(f"\nInput throughput over {n_images} training images (images/s):")
+    print(f"{'epoch':>5} {'generator':>10} {'tf.data':>10}")
+    for epoch in range(epochs):
+        # One epoch of the generator is len(train_gen) batches; it never ends by itself
+        generator_rate = input_throughput((train_gen[i] for i in range(len(train_gen))), n_images)
+        tfdata_rate = input_throughput(train_ds, n_images)
+        # The first tf.data epoch decodes and fills the cache, later ones read it
+        print(f"{epoch + 1:>5} {generator_rate:>10.1f} {tfdata_rate:>10.1f}")
+
+# Cached backbone features
+def cache_features(store, extractor, preprocess_func, split_dir, split, variants=0):
+    """Pooled backbone features of a split, running the backbone only for images not in the store.
+
+    Returns (features of shape (1 + variants, N, dim), class indices,
+    class labels). Row 0 holds the plain images, row v the augmented copy
+    number v - 1.
+    """
+    paths, labels, class_labels = list_split(split_dir)
+    images = decoded_dataset(split_dir, split)[0].batch(BATCH_SIZE)
+    features = []
+    for variant in [None] + list(range(variants)):
+        keys = [FeatureStore.make_key(p, variant) for p in paths]
+        missing = set(store.missing(keys))
+        if missing:
+            print(f"Extracting {len(missing)} {split} features ({'plain' if variant is None else f'augmented copy {variant}'})...")
+            batches = images if variant is None else images.map(augment_batch, num_parallel_calls=AUTOTUNE)
+            batches = batches.map(lambda x, y: (preprocess_func(tf.cast(x, tf.float32)), y),
+                                  num_parallel_calls=AUTOTUNE).prefetch(AUTOTUNE)
+            # The whole split is read so the decoded-image cache is completed
+            start = 0
+            for x, _ in batches:
+                batch_features = extractor.predict_on_batch(x)
+                batch_keys = keys[start:start + len(batch_features)]
+                new = [i for i, key in enumerate(batch_keys) if key in missing]
+                store.append([batch_keys[i] for i in new], batch_features[new])
+                start += len(batch_features)
+        features.append(store.get_many(keys))
+    return np.stack(features), labels, class_labels
+
+class CachedFeatureSequence(tf.keras.utils.Sequence):
+    """Shuffled batches of cached features; each epoch uses a random variant of every image"""
+
+    def __init__(self, features, labels):
+        super().__init__()
+        self.features = features
+        self.labels = tf.keras.utils.to_categorical(labels, NUM_CLASSES)
+        self.rng = np.random.default_rng()
+        self.on_epoch_end()
+
+    def __len__(self):
+        return -(-self.features.shape[1] // BATCH_SIZE)
+
+    def on_epoch_end(self):
+        n_variants, n_images = self.features.shape[:2]
+        self.order = self.rng.permutation(n_images)
+        self.variant = self.rng.integers(0, n_variants, n_images)
+
+    def __getitem__(self, index):
+        rows = self.order[index * BATCH_SIZE:(index + 1) * BATCH_SIZE]
+        return self.features[self.variant[rows], rows], self.labels[rows]
+
+class TimeToAccuracy(Callback):
+    """Records (seconds since `start`, validation accuracy) after every epoch"""
+
+    def __init__(self, start):
+        super().__init__()
+        self.start = start
+        self.history = []
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.history.append((time.perf_counter() - self.start, (logs or {}).get('val_accuracy')))
+
 # Model builder
 def build_model(base_model):
     model = Sequential([
@@ -119,31 +304,98 @@ def build_model(base_model):
     ])
     return model
 
-# Train + evaluate function
-def train_and_evaluate(model_name, base_model_class, preprocess_func):
-    print(f"\nTraining {model_name}...")
-    train_gen, val_gen, test_gen = create_generators(preprocess_func)
+def split_model(model):
+    """Feature extractor (backbone + pooling) and Dense head sharing the layers of a build_model model"""
+    extractor = Sequential(model.layers[:2])
+    head = Sequential([tf.keras.Input(shape=extractor.output_shape[1:])] + model.layers[2:])
+    return extractor, head
 
+# Train + evaluate function
+def train_and_evaluate(model_name, base_model_class, preprocess_func, mode=None, callbacks=(), feature_dir=None):
+    mode = mode or TRAINING_MODE
+    print(f"\nTraining {model_name} ({mode}, {INPUT_PIPELINE} input pipeline)...")
     base_model = base_model_class(weights='imagenet', include_top=False, input_shape=(224, 224, 3))
     base_model.trainable = False
 
     model = build_model(base_model)
     model.compile(optimizer=Adam(), loss='categorical_crossentropy', metrics=['accuracy'])
 
-    model.fit(train_gen, validation_data=val_gen, epochs=EPOCHS)
+    if mode == 'cached_features':
+        # The head layers are shared with `model`, so training the head trains the full model
+        extractor, head = split_model(model)
+        head.compile(optimizer=Adam(), loss='categorical_crossentropy', metrics=['accuracy'])
+        store = FeatureStore(feature_dir or os.path.join(FEATURE_CACHE_DIR, model_name),
+                             dim=extractor.output_shape[-1])
+        train_features, train_labels, class_labels = cache_features(
+            store, extractor, preprocess_func, train_dir, 'train', FEATURE_AUGMENT_VARIANTS
+        )
+        val_features, val_labels, _ = cache_features(store, extractor, preprocess_func, val_dir, 'val')
+        test_features, true_classes, _ = cache_features(store, extractor, preprocess_func, test_dir, 'test')
+
+        throughput = EpochThroughput(train_features.shape[1])
+        head.fit(CachedFeatureSequence(train_features, train_labels),
+                 validation_data=(val_features[0], tf.keras.utils.to_categorical(val_labels, NUM_CLASSES)),
+                 epochs=EPOCHS, callbacks=[throughput, *callbacks])
+
+        print(f"\nEvaluating {model_name} on test data...")
+        predictions = head.predict(test_features[0], batch_size=BATCH_SIZE)
+    else:
+        if INPUT_PIPELINE == 'generator':
+            train_data, val_data, test_data = create_generators(preprocess_func)
+            true_classes = test_data.classes
+            class_labels = list(test_data.class_indices.keys())
+            n_train = train_data.samples
+        else:
+            train_data, val_data, test_data, true_classes, class_labels = create_datasets(preprocess_func)
+            n_train = len(list_split(train_dir)[0])
 
-    print(f"\nEvaluating {model_name} on test data...")
-    predictions = model.predict(test_gen)
+        throughput = EpochThroughput(n_train)
+        model.fit(train_data, validation_data=val_data, epochs=EPOCHS, callbacks=[throughput, *callbacks])
+
+        print(f"\nEvaluating {model_name} on test data...")
+        predictions = model.predict(test_data)
     predicted_classes = np.argmax(predictions, axis=1)
-    true_classes = test_gen.classes
-    class_labels = list(test_gen.class_indices.keys())
 
     acc = accuracy_score(true_classes, predicted_classes)
     print(f"{model_name} Test Accuracy: {acc:.4f}")
     print(classification_report(true_classes, predicted_classes, target_names=class_labels))
+    print(f"{model_name} training throughput: {np.mean(throughput.images_per_second):.1f} images/s per epoch")
 
     return model, class_labels, preprocess_func
 
+def benchmark_head_training(model_name="ResNet50", base_model_class=ResNet50, preprocess_func=resnet_preprocess):
+    """Compare time-to-accuracy of end-to-end and cached-feature head training.
+
+    The decoded-image cache is filled first so neither run pays for
+    decoding. The cached-feature run starts from an empty feature store,
+    so its times include extracting every feature once.
+    """
+    for split_dir, split in ((train_dir, 'train'), (val_dir, 'val'), (test_dir, 'test')):
+        for _ in decoded_dataset(split_dir, split)[0]:
+            pass
+
+    histories = {}
+    feature_dir = tempfile.mkdtemp(prefix='feature_cache_')
+    try:
+        for mode in ('end_to_end', 'cached_features'):
+            timer = TimeToAccuracy(time.perf_counter())
+            train_and_evaluate(model_name, base_model_class, preprocess_func, mode=mode,
+                               callbacks=[timer], feature_dir=feature_dir)
+            histories[mode] = timer.history
+    finally:
+        shutil.rmtree(feature_dir, ignore_errors=True)
+
+    print(f"\n{model_name} validation accuracy by elapsed time:")
+    print(f"{'epoch':>5} {'end_to_end':>20} {'cached_features':>20}")
+    for epoch, ((t1, a1), (t2, a2)) in enumerate(zip(histories['end_to_end'], histories['cached_features'])):
+        print(f"{epoch + 1:>5} {t1:>9.1f}s {a1:>9.4f} {t2:>9.1f}s {a2:>9.4f}")
+
+    # Time until each run first reaches the best accuracy both runs reach
+    target = min(max(a for _, a in history) for history in histories.values())
+    for mode, history in histories.items():
+        seconds = next(t for t, a in history if a >= target)
+        print(f"{mode}: {seconds:.1f}s to {target:.4f} validation accuracy")
+
 # Predict single image
 def predict_image(model, img_path, preprocess_func, class_labels):
     img = load_img(img_path, target_size=(224, 224))  # Load and resize
@@ -158,11 +410,23 @@ def predict_image(model, img_path, preprocess_func, class_labels):
     print(f"Predicted class: {predicted_label}")
     return predicted_label
 
-# Train and evaluate both models
-resnet_model, resnet_labels, resnet_prep = train_and_evaluate("ResNet50", ResNet50, resnet_preprocess)
-vgg_model, vgg_labels, vgg_prep = train_and_evaluate("VGG19", VGG19, vgg_preprocess)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fine-tune ResNet50 and VGG19 heads on the cotton disease dataset")
+    parser.add_argument('--compare-pipelines', action='store_true',
+                        help='only time training epochs of the generator and tf.data input pipelines')
+    parser.add_argument('--benchmark-head', action='store_true',
+                        help='only compare time-to-accuracy of end-to-end and cached-feature training on ResNet50')
+    args = parser.parse_args()
+    if args.compare_pipelines:
+        compare_pipelines()
+    elif args.benchmark_head:
+        benchmark_head_training()
+    else:
+        # Train and evaluate both models; the second reuses the decoded image cache of the first
+        resnet_model, resnet_labels, resnet_prep = train_and_evaluate("ResNet50", ResNet50, resnet_preprocess)
+        vgg_model, vgg_labels, vgg_prep = train_and_evaluate("VGG19", VGG19, vgg_preprocess)
 
-# Predict on a new image (update this path)
-sample_image_path = r"C:\Users\admin\OneDrive\Desktop\Ai Agent Project\cotton_test.jpeg"
-predict_image(resnet_model, sample_image_path, resnet_prep, resnet_labels)
-predict_image(vgg_model, sample_image_path, vgg_prep, vgg_labels)
+        # Predict on a new image (update this path)
+        sample_image_path = r"C:\Users\admin\OneDrive\Desktop\Ai Agent Project\cotton_test.jpeg"
+        predict_image(resnet_model, sample_image_path, resnet_prep, resnet_labels)
+        predict_image(vgg_model, sample_image_path, vgg_prep, vgg_labels)
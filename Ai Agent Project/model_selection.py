@@ -0,0 +1,134 @@
+"""Cross-validated model selection over cached feature vectors.
+
+Every (candidate, fold) pair is one task for a joblib process pool that
+spans all cores. The feature matrix is written once to a .npy file in a
+scratch directory and memory-mapped by the workers, so they all read the
+same page-cache copy; a worker only holds the fold it is fitting. Estimators
+should be single-threaded (n_jobs=1), the pool provides the parallelism.
+
+The model fitted on the first fold of every candidate is kept in the
+scratch directory. Its size is its pickled size, and its prediction latency
+is measured once the pool has finished, one model at a time, so busy
+workers do not skew it. select() then picks the most accurate candidate
+that fits a per-image latency budget.
+"""
+import itertools
+import os
+import pickle
+import tempfile
+import time
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.model_selection import StratifiedKFold
+
+
+def expand_grid(families):
+    """List (family, params, estimator) for every parameter combination of every family.
+
+    `families` maps a family name to (estimator, {parameter: [values]}).
+    """
+    candidates = []
+    for family, (estimator, grid) in families.items():
+        names = sorted(grid)
+        for values in itertools.product(*(grid[name] for name in names)):
+            params = dict(zip(names, values))
+            candidates.append((family, params, clone(estimator).set_params(**params)))
+    return candidates
+
+
+def classification_latency(model, X, images=50):
+    """Milliseconds per image to classify feature vectors one at a time and as one batch"""
+    sample = X[:images]
+    model.predict_proba(sample[:1])
+    start = time.perf_counter()
+    for i in range(len(sample)):
+        model.predict_proba(sample[i:i + 1])
+    single_ms = (time.perf_counter() - start) / len(sample) * 1000
+    start = time.perf_counter()
+    model.predict_proba(X)
+    batch_ms = (time.perf_counter() - start) / len(X) * 1000
+    return single_ms, batch_ms
+
+
+def _fit_fold(index, estimator, X_path, y, train, test, model_path):
+    """Worker: fit a candidate on one fold; returns (candidate index, accuracy, fit seconds, model bytes)"""
+    X = np.load(X_path, mmap_mode='r')
+    model = clone(estimator)
+    start = time.perf_counter()
+    model.fit(X[train], y[train])
+    fit_seconds = time.perf_counter() - start
+    accuracy = float(np.mean(model.predict(X[test]) == y[test]))
+    data = pickle.dumps(model, protocol=4)
+    if model_path is not None:
+        with open(model_path, 'wb') as f:
+            f.write(data)
+    return index, accuracy, fit_seconds, len(data)
+
+
+def cross_validate(candidates, X, y, folds=5, n_jobs=-1, random_state=42, timing_images=50):
+    """Cross-validate candidates from expand_grid in parallel.
+
+    Returns one dict per candidate with its mean and standard deviation of
+    fold accuracy, mean fit seconds, pickled model bytes and milliseconds
+    per image for single-image and batch prediction.
+    """
+    y = np.asarray(y)
+    splits = list(StratifiedKFold(folds, shuffle=True, random_state=random_state).split(np.zeros(len(y)), y))
+    with tempfile.TemporaryDirectory(prefix='model-selection-') as scratch:
+        X_path = os.path.join(scratch, 'X.npy')
+        np.save(X_path, np.ascontiguousarray(X))
+        model_paths = [os.path.join(scratch, f"model-{i}.pkl") for i in range(len(candidates))]
+        tasks = [
+            delayed(_fit_fold)(i, estimator, X_path, y, train, test, model_paths[i] if fold == 0 else None)
+            for i, (_, _, estimator) in enumerate(candidates)
+            for fold, (train, test) in enumerate(splits)
+        ]
+        results = Parallel(n_jobs=n_jobs)(tasks)
+
+        rows = []
+        X = np.load(X_path, mmap_mode='r')
+        X_timing = np.asarray(X[splits[0][1]])
+        for i, (family, params, _) in enumerate(candidates):
+            accuracies = [r[1] for r in results if r[0] == i]
+            with open(model_paths[i], 'rb') as f:
+                model = pickle.load(f)
+            single_ms, batch_ms = classification_latency(model, X_timing, timing_images)
+            rows.append({
+                'family': family,
+                'params': params,
+                'accuracy': float(np.mean(accuracies)),
+                'accuracy_std': float(np.std(accuracies)),
+                'fit_seconds': float(np.mean([r[2] for r in results if r[0] == i])),
+                'model_bytes': next(r[3] for r in results if r[0] == i),
+                'single_ms': single_ms,
+                'batch_ms': batch_ms
+            })
+            del model
+    return rows
+
+
+def select(rows, latency_budget_ms):
+    """Return (row, within budget) for the most accurate candidate within the latency budget.
+
+    The budget applies to single-image prediction, as the server sees it.
+    Equal accuracies go to the faster candidate. When no candidate fits,
+    the fastest one is returned.
+    """
+    within = [row for row in rows if row['single_ms'] <= latency_budget_ms]
+    if not within:
+        return min(rows, key=lambda row: row['single_ms']), False
+    return max(within, key=lambda row: (round(row['accuracy'], 4), -row['single_ms'])), True
+
+
+def print_selection(rows, best, latency_budget_ms):
+    """Print every candidate, most accurate first, marking the selected one"""
+    print(f"{'candidate':<52} {'cv acc':>13} {'fit s':>7} {'model MB':>9} {'ms/img 1':>9} {'ms/img batch':>13}")
+    for row in sorted(rows, key=lambda row: -row['accuracy']):
+        params = ', '.join(f"{k.split('__')[-1]}={v}" for k, v in row['params'].items())
+        name = f"{row['family']} ({params})"
+        marker = '  <- selected' if row is best else (
+            '  over budget' if row['single_ms'] > latency_budget_ms else '')
+        print(f"{name:<52} {row['accuracy']:>7.4f}±{row['accuracy_std']:.3f} {row['fit_seconds']:>7.1f} "
+              f"{row['model_bytes'] / 1e6:>9.2f} {row['single_ms']:>9.3f} {row['batch_ms']:>13.4f}{marker}")
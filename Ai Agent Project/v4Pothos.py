@@ -1,11 +1,17 @@
 import os
+import sys
+import argparse
 import cv2
 import numpy as np
 import joblib
 import matplotlib.pyplot as plt
-from sklearn.ensemble import RandomForestClassifier
+from sklearn.ensemble import RandomForestClassifier, ExtraTreesClassifier
 from sklearn.svm import SVC
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import train_test_split, cross_val_predict
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.base import clone
 from sklearn.metrics import (
     confusion_matrix,
     ConfusionMatrixDisplay,
@@ -14,188 +20,268 @@ from sklearn.metrics import (
 )
 from tqdm import tqdm
 import random
-from tensorflow.keras.applications import MobileNetV2
-from tensorflow.keras.applications.mobilenet_v2 import preprocess_input
-from tensorflow.keras.preprocessing import image as keras_image
 import pickle
+import json
+import hashlib
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from feature_store import FeatureStore
+from model_selection import classification_latency, cross_validate, expand_grid, print_selection, select
+
+# Preprocessing is shared with app.py in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from preprocessing import IMAGE_SIZE, preprocess_image
+from registry import ModelRegistry
+from cascade import FEATURE_VERSION, calibrate_threshold, cheap_features, tradeoff
+from projection import Projection, ProjectedClassifier
 
 # Settings - UPDATE THIS PATH TO YOUR DATASET LOCATION
 DATASET_DIR = r"C:\Users\Ahmed Abd El Rahman\Desktop\Ai Agent Project\MoneyPlant\MoneyPlant"
 CATEGORIES = ["Healthy", "Manganese Toxicity", "Bacterial wilt disease"]
-IMAGE_SIZE = (128, 128)
 MAX_IMAGES_PER_CLASS = 1500
 AUGMENT = True
+# Augmentation is seeded per image from this value, so cached features can be reused
+AUGMENT_SEED = 42
+
+# Directory for saved models and the extracted feature store
+SAVE_DIR = r"C:\Users\Ahmed Abd El Rahman\Desktop\Ai Agent Project"
+FEATURE_STORE_DIR = os.path.join(SAVE_DIR, "feature_store")
+# Every trained model is also published as a new version in this registry;
+# the first one becomes active, later ones are activated with registry.py
+REGISTRY_DIR = os.environ.get("REGISTRY_DIR") or os.path.join(SAVE_DIR, "registry")
+
+# Model selection: every parameter combination of every family in
+# SELECTION_GRID is cross-validated with SELECTION_FOLDS folds on the
+# training split, in parallel on NUM_WORKERS processes (model_selection.py).
+# The most accurate candidate whose single-image prediction stays within
+# LATENCY_BUDGET_MS is trained on the whole split and saved; the best
+# candidate of every other family is saved as a secondary model. The
+# results are written to SELECTION_REPORT_PATH. python v4Pothos.py --select
+# runs the selection alone on the cached features of the last run's split.
+SELECTION_FOLDS = 5
+LATENCY_BUDGET_MS = float(os.environ.get("LATENCY_BUDGET_MS", "25"))
+SELECTION_GRID = {
+    "Random Forest": (RandomForestClassifier(random_state=42, n_jobs=1),
+                      {"n_estimators": [100, 200, 400], "max_features": ["sqrt", 0.1]}),
+    "Extra Trees": (ExtraTreesClassifier(random_state=42, n_jobs=1),
+                    {"n_estimators": [200, 400]}),
+    "SVM (RBF Kernel)": (SVC(kernel='rbf', gamma='scale', probability=True, random_state=42),
+                         {"C": [1, 10, 100]}),
+    "Logistic Regression": (make_pipeline(StandardScaler(), LogisticRegression(max_iter=2000)),
+                            {"logisticregression__C": [0.01, 0.1, 1.0]})
+}
+SELECTION_REPORT_PATH = os.path.join(SAVE_DIR, "model_selection.json")
+
+# Incremental training (python v4Pothos.py --incremental) starts from the
+# model and train/test split recorded here by the previous run. Images added
+# since then are split by a hash of their path, a Random Forest grows
+# GROW_TREES more trees with warm_start, other models are refit from the
+# cached features.
+TRAINING_MANIFEST = os.path.join(SAVE_DIR, "training_manifest.json")
+GROW_TREES = 50
+TEST_FRACTION = 0.2
+
+# Inference cascade (python v4Pothos.py --cascade): a logistic regression on
+# cheap colour features (cascade.py) is trained on the last run's training
+# split. Its confidence threshold is calibrated on out-of-fold predictions
+# so that the images it answers alone are CASCADE_TARGET_ACCURACY accurate;
+# the rest go to the full model. Serve it with CASCADE_MODEL in app.py.
+CASCADE_MODEL_PATH = os.path.join(SAVE_DIR, "cascade_model.joblib")
+CASCADE_TARGET_ACCURACY = 0.98
+CASCADE_TIMING_IMAGES = 50
 
-# Load MobileNetV2 model
-print("Loading MobileNetV2...")
-feature_model = MobileNetV2(weights='imagenet', include_top=False, pooling='avg', input_shape=(128, 128, 3))
-
-def basic_preprocessing(img):
-    img = cv2.resize(img, IMAGE_SIZE)
-    img = cv2.GaussianBlur(img, (3, 3), 0)
-    ycrcb = cv2.cvtColor(img, cv2.COLOR_BGR2YCrCb)
-    ycrcb[:, :, 0] = cv2.equalizeHist(ycrcb[:, :, 0])
-    img = cv2.cvtColor(ycrcb, cv2.COLOR_YCrCb2BGR)
-    img = cv2.normalize(img.astype("float32"), None, 0, 1, cv2.NORM_MINMAX)
-    return img
-
-def augment_image(image):
-    angle = random.randint(-20, 20)
+# Feature projection: with PROJECTION_DIM above 0 (or --projection-dim) the
+# models are trained on the MobileNetV2 features reduced by PCA to that many
+# float16 dimensions (projection.py). The projection is fitted on the
+# training split and saved in the model file, so app.py applies it before
+# classification. --projection-report compares PROJECTION_REPORT_DIMS with
+# the raw features on the last run's split and writes PROJECTION_REPORT_PATH.
+PROJECTION_DIM = int(os.environ.get("PROJECTION_DIM", "0"))
+PROJECTION_REPORT_DIMS = [16, 32, 64, 128, 256]
+PROJECTION_REPORT_PATH = os.path.join(SAVE_DIR, "projection_report.json")
+PROJECTION_TIMING_IMAGES = 50
+
+# Feature extraction pipeline: decode/preprocess workers feed batched MobileNetV2,
+# with at most EXTRACT_BATCHES_AHEAD batches of images submitted ahead of it
+NUM_WORKERS = os.cpu_count() or 1
+EXTRACT_BATCH_SIZE = 64
+EXTRACT_BATCHES_AHEAD = 4
+
+def augment_image(image, rng=random):
+    angle = rng.randint(-20, 20)
     h, w = image.shape[:2]
     M = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1)
     image = cv2.warpAffine(image, M, (w, h))
     hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    hsv[..., 2] = cv2.add(hsv[..., 2], random.randint(-20, 20))
+    hsv[..., 2] = cv2.add(hsv[..., 2], rng.randint(-20, 20))
     image = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
     return image
 
-def load_data():
-    X, y = [], []
-    
+def load_and_preprocess(task):
+    """Worker: read one image and turn it into a MobileNetV2 input, or None if unreadable"""
+    img_path, seed = task
+    img = cv2.imread(img_path)
+    if img is None or img.shape[0] == 0 or img.shape[1] == 0:
+        return None
+    try:
+        if seed is None:
+            return preprocess_image(img)
+        rng = random.Random(f"{seed}:{img_path}")
+        return preprocess_image(img, augment=lambda x: augment_image(x, rng))
+    except Exception as e:
+        print(f"Error processing {os.path.basename(img_path)}: {e}")
+        return None
+
+def extract_features(paths, seed, feature_model, store):
+    """Extract features for paths that are not in the store yet.
+
+    Images are decoded and preprocessed by a process pool and fed to
+    MobileNetV2 in batches of EXTRACT_BATCH_SIZE; only a few batches are
+    submitted to the pool ahead of the model. Each batch is appended to
+    the feature store as soon as it is extracted, so an interrupted run keeps
+    its progress. Unreadable images are skipped.
+    """
+    keys = [FeatureStore.make_key(p, seed) for p in paths]
+    todo = [(p, k) for p, k in zip(paths, keys) if k not in store]
+    if not todo:
+        return
+    print(f"Extracting features for {len(todo)} images with {NUM_WORKERS} workers...")
+
+    batch, batch_keys = [], []
+
+    def flush():
+        features = feature_model.predict(np.stack(batch), verbose=0)
+        store.append(batch_keys, features)
+        batch.clear()
+        batch_keys.clear()
+
+    def collect(entry):
+        key, future = entry
+        img = future.result()
+        progress.update()
+        if img is None:
+            return
+        batch.append(img)
+        batch_keys.append(key)
+        if len(batch) == EXTRACT_BATCH_SIZE:
+            flush()
+
+    # At most a few batches are preprocessed ahead of MobileNetV2, so decoded
+    # images never pile up in memory
+    in_flight = deque()
+    max_in_flight = EXTRACT_BATCH_SIZE * EXTRACT_BATCHES_AHEAD
+    with ProcessPoolExecutor(max_workers=NUM_WORKERS) as pool, \
+            tqdm(total=len(todo), desc="Extracting") as progress:
+        for path, key in todo:
+            in_flight.append((key, pool.submit(load_and_preprocess, (path, seed))))
+            if len(in_flight) >= max_in_flight:
+                collect(in_flight.popleft())
+        while in_flight:
+            collect(in_flight.popleft())
+        if batch:
+            flush()
+
+def load_cheap_features(path):
+    """Worker: cascade first-stage features of one image, or None if unreadable"""
+    img = cv2.imread(path)
+    if img is None or img.shape[0] == 0 or img.shape[1] == 0:
+        return None
+    return cheap_features(img)
+
+def list_dataset():
+    """Return (image paths, class indices) of the dataset, or (None, None) if it is missing"""
     # Check if dataset directory exists
     if not os.path.exists(DATASET_DIR):
         print(f"ERROR: Dataset directory not found: {DATASET_DIR}")
         print("Please update DATASET_DIR to the correct path on your laptop")
         return None, None
-    
+
+    paths, labels = [], []
     for idx, category in enumerate(CATEGORIES):
         folder = os.path.join(DATASET_DIR, category)
         if not os.path.exists(folder):
             print(f"WARNING: Category folder not found: {folder}")
             continue
-            
+
         images = os.listdir(folder)[:MAX_IMAGES_PER_CLASS]
         print(f"Found {len(images)} images in {category}")
-        
-        for img_name in tqdm(images, desc=f"Loading {category}"):
-            img_path = os.path.join(folder, img_name)
-            img = cv2.imread(img_path)
-            if img is None or img.shape[0] == 0 or img.shape[1] == 0:
-                continue
-            try:
-                img = basic_preprocessing(img)
-                if AUGMENT:
-                    img = augment_image(img)
-                img = cv2.resize(img, IMAGE_SIZE)
-                img = keras_image.img_to_array(img)
-                img = np.expand_dims(img, axis=0)
-                img = preprocess_input(img)
-                features = feature_model.predict(img, verbose=0).flatten()
-                X.append(features)
-                y.append(idx)
-            except Exception as e:
-                print(f"Error processing {img_name}: {e}")
-                continue
-    
-    return np.array(X), np.array(y)
-
-# Load dataset
-print("Loading dataset...")
-X, y = load_data()
-
-if X is None or len(X) == 0:
-    print("ERROR: No data loaded. Please check your dataset path.")
-    exit()
-
-print(f"Loaded {len(X)} images")
-
-# Split data
-X_train, X_test, y_train, y_test = train_test_split(X, y, stratify=y, test_size=0.2, random_state=42)
-
-# Models to compare
-models = {
-    "Random Forest": RandomForestClassifier(n_estimators=200, random_state=42),
-    "SVM (RBF Kernel)": SVC(kernel='rbf', C=10, gamma='scale', probability=True)
-}
+        paths.extend(os.path.join(folder, img_name) for img_name in images)
+        labels.extend([idx] * len(images))
+    return paths, labels
 
-accuracies = {}
+def load_features(paths, labels, seed, store):
+    """Return (X, y, keys) for the images that have features in the store"""
+    # Images that could not be read have no features and are dropped
+    keys = [FeatureStore.make_key(p, seed) for p in paths]
+    kept = [i for i, key in enumerate(keys) if key in store]
+    print(f"Loaded {len(kept)} feature vectors from {store.directory}")
+    X = store.get_many([keys[i] for i in kept])
+    y = np.array([labels[i] for i in kept])
+    return X, y, [keys[i] for i in kept]
 
-# Evaluate each model
-for name, model in models.items():
-    print(f"\n=== {name} ===")
-    model.fit(X_train, y_train)
-    y_pred = model.predict(X_test)
-    acc = accuracy_score(y_test, y_pred)
-    accuracies[name] = acc
-    print(f"Accuracy: {acc:.4f}")
-
-    # Confusion Matrix
-    cm = confusion_matrix(y_test, y_pred)
-    disp = ConfusionMatrixDisplay(confusion_matrix=cm, display_labels=CATEGORIES)
-    disp.plot(cmap=plt.cm.Blues)
-    plt.title(f"{name} - Confusion Matrix")
-    plt.show()
+def load_data(feature_model, store):
+    paths, labels = list_dataset()
+    if paths is None:
+        return None, None, None
 
-    # Classification Report
-    print(f"\nClassification Report for {name}:")
-    print(classification_report(y_test, y_pred, target_names=CATEGORIES))
+    seed = AUGMENT_SEED if AUGMENT else None
+    extract_features(paths, seed, feature_model, store)
+    return load_features(paths, labels, seed, store)
 
-# Print comparison
-print("\n=== Model Accuracy Comparison ===")
-for model_name, acc in accuracies.items():
-    print(f"{model_name}: {acc:.4f}")
-
-# Choose the best model
-best_model_name = max(accuracies, key=accuracies.get)
-clf = models[best_model_name]
-print(f"\nUsing best model for prediction: {best_model_name}")
-
-# Create directory for saving models
-save_dir = r"C:\Users\Ahmed Abd El Rahman\Desktop\Ai Agent Project"
-os.makedirs(save_dir, exist_ok=True)
-
-# Save the best model in multiple formats
-# 1. Save with joblib (recommended)
-model_joblib_path = os.path.join(save_dir, f"{best_model_name.replace(' ', '_')}_best_model.joblib")
-joblib.dump(clf, model_joblib_path, compress=3)
-print(f"Model saved with joblib: {model_joblib_path}")
-
-# 2. Save with pickle (compatibility)
-model_pkl_path = os.path.join(save_dir, f"{best_model_name.replace(' ', '_')}_best_model.pkl")
-with open(model_pkl_path, 'wb') as f:
-    pickle.dump(clf, f, protocol=4)
-print(f"Model saved with pickle: {model_pkl_path}")
-
-# 3. Save MobileNetV2 feature extractor
-feature_model_path = os.path.join(save_dir, "mobilenetv2_feature_extractor.h5")
-feature_model.save(feature_model_path)
-print(f"Feature extractor saved: {feature_model_path}")
-
-# 4. Save model configuration
-import json
-import sklearn
-import tensorflow as tf
-
-config = {
-    'model_type': best_model_name,
-    'categories': CATEGORIES,
-    'image_size': IMAGE_SIZE,
-    'accuracy': accuracies[best_model_name],
-    'sklearn_version': sklearn.__version__,
-    'numpy_version': np.__version__,
-    'tensorflow_version': tf.__version__,
-    'n_features': X.shape[1] if len(X) > 0 else 0
-}
+def build_config(model_type, accuracy, n_features, **extra):
+    """model_config.json content for a trained classifier"""
+    import sklearn
+    from importlib import metadata
 
-config_path = os.path.join(save_dir, "model_config.json")
-with open(config_path, 'w') as f:
-    json.dump(config, f, indent=4)
-print(f"Configuration saved: {config_path}")
+    # Read the TensorFlow version without importing it, so incremental runs
+    # that extract nothing never load TensorFlow
+    try:
+        tensorflow_version = metadata.version('tensorflow')
+    except metadata.PackageNotFoundError:
+        import tensorflow as tf
+        tensorflow_version = tf.__version__
 
-print(f"\nAll models saved to: {save_dir}")
+    config = {
+        'model_type': model_type,
+        'categories': CATEGORIES,
+        'image_size': IMAGE_SIZE,
+        'accuracy': accuracy,
+        'sklearn_version': sklearn.__version__,
+        'numpy_version': np.__version__,
+        'tensorflow_version': tensorflow_version,
+        'n_features': n_features
+    }
+    config.update(extra)
+    return config
+
+def save_training_manifest(train_keys, test_keys, model_path, model_type, version, accuracy):
+    """Record the split and model of this run for the next incremental run"""
+    manifest = {
+        'created': time.time(),
+        'model_path': model_path,
+        'model_type': model_type,
+        'version': version,
+        'accuracy': accuracy,
+        'augment_seed': AUGMENT_SEED if AUGMENT else None,
+        'train': list(train_keys),
+        'test': list(test_keys)
+    }
+    tmp_path = TRAINING_MANIFEST + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, TRAINING_MANIFEST)
+    print(f"Training manifest saved: {TRAINING_MANIFEST}")
 
 # Prediction Function
-def predict_image(img_path):
+def predict_image(img_path, clf, feature_model):
     img = cv2.imread(img_path)
     if img is None:
         print(f"Image not readable: {img_path}")
         return
     original = cv2.cvtColor(img.copy(), cv2.COLOR_BGR2RGB)
-    img = basic_preprocessing(img)
-    img = cv2.resize(img, IMAGE_SIZE)
-    img = keras_image.img_to_array(img)
+    img = preprocess_image(img)
     img = np.expand_dims(img, axis=0)
-    img = preprocess_input(img)
     features = feature_model.predict(img, verbose=0).flatten().reshape(1, -1)
     pred = clf.predict(features)[0]
     predicted_label = CATEGORIES[pred]
@@ -210,19 +296,526 @@ def predict_image(img_path):
 
     return pred
 
-# Test predictions using best model
-test_images = [
-    r"C:\Users\Ahmed Abd El Rahman\Desktop\Ai Agent Project\pothos1.jpg",
-    r"C:\Users\Ahmed Abd El Rahman\Desktop\Ai Agent Project\pothos2.jpg",
-    r"C:\Users\Ahmed Abd El Rahman\Desktop\Ai Agent Project\pothos3.jpg",
-    r"C:\Users\Ahmed Abd El Rahman\Desktop\Ai Agent Project\pothos5b.jpg",
-    r"C:\Users\Ahmed Abd El Rahman\Desktop\Ai Agent Project\pothos6h.jpg",
-    r"C:\Users\Ahmed Abd El Rahman\Desktop\Ai Agent Project\pothos6m.jpg"
-]
-
-print("\nTesting predictions...")
-for img_path in test_images:
-    if os.path.exists(img_path):
-        predict_image(img_path)
+def main(projection_dim=PROJECTION_DIM):
+    from tensorflow.keras.applications import MobileNetV2
+
+    # Load MobileNetV2 model
+    print("Loading MobileNetV2...")
+    feature_model = MobileNetV2(weights='imagenet', include_top=False, pooling='avg', input_shape=(128, 128, 3))
+
+    # Load dataset
+    print("Loading dataset...")
+    store = FeatureStore(FEATURE_STORE_DIR)
+    X, y, keys = load_data(feature_model, store)
+
+    if X is None or len(X) == 0:
+        print("ERROR: No data loaded. Please check your dataset path.")
+        exit()
+
+    print(f"Loaded {len(X)} images")
+
+    # Split data
+    X_train, X_test, y_train, y_test, keys_train, keys_test = train_test_split(
+        X, y, keys, stratify=y, test_size=TEST_FRACTION, random_state=42
+    )
+
+    # Every model sees the same projection, fitted on the training split only
+    projection = None
+    if projection_dim:
+        projection = Projection.fit(X_train, projection_dim)
+        print(f"Feature projection: {X.shape[1]} -> {projection.dim} dimensions, "
+              f"{projection.explained_variance:.1%} of the variance kept")
+
+    # Cross-validated selection on the training split; the test split stays held out
+    rows, selected, within_budget = run_selection(
+        X_train if projection is None else projection.transform(X_train), y_train
+    )
+
+    # The best candidate of each family is refit on the whole training split
+    models = {}
+    for family, (estimator, _) in SELECTION_GRID.items():
+        family_best = selected if family == selected['family'] else max(
+            (row for row in rows if row['family'] == family), key=lambda row: row['accuracy'])
+        model = clone(estimator).set_params(**family_best['params'])
+        models[family] = model if projection is None else ProjectedClassifier(projection, model)
+
+    accuracies = {}
+
+    # Evaluate each model; confusion matrices are saved, not shown, so training runs headless
+    for name, model in models.items():
+        print(f"\n=== {name} ===")
+        model.fit(X_train, y_train)
+        y_pred = model.predict(X_test)
+        acc = accuracy_score(y_test, y_pred)
+        accuracies[name] = acc
+        print(f"Accuracy: {acc:.4f}")
+
+        # Confusion Matrix
+        cm = confusion_matrix(y_test, y_pred)
+        disp = ConfusionMatrixDisplay(confusion_matrix=cm, display_labels=CATEGORIES)
+        disp.plot(cmap=plt.cm.Blues)
+        plt.title(f"{name} - Confusion Matrix")
+        matrix_path = os.path.join(SAVE_DIR, f"{name.replace(' ', '_')}_confusion_matrix.png")
+        plt.savefig(matrix_path, bbox_inches='tight')
+        plt.close()
+        print(f"Confusion matrix saved: {matrix_path}")
+
+        # Classification Report
+        print(f"\nClassification Report for {name}:")
+        print(classification_report(y_test, y_pred, target_names=CATEGORIES))
+
+    # Print comparison
+    print("\n=== Model Accuracy Comparison (held-out test split) ===")
+    for model_name, acc in accuracies.items():
+        print(f"{model_name}: {acc:.4f}")
+
+    # The model chosen by cross-validation under the latency budget
+    best_model_name = selected['family']
+    clf = models[best_model_name]
+    print(f"\nUsing selected model for prediction: {best_model_name}")
+
+    # Create directory for saving models
+    save_dir = SAVE_DIR
+    os.makedirs(save_dir, exist_ok=True)
+
+    # Save the best model in multiple formats
+    # 1. Save with joblib (recommended)
+    model_joblib_path = os.path.join(save_dir, f"{best_model_name.replace(' ', '_')}_best_model.joblib")
+    joblib.dump(clf, model_joblib_path, compress=3)
+    print(f"Model saved with joblib: {model_joblib_path}")
+
+    # 2. Save with pickle (compatibility)
+    model_pkl_path = os.path.join(save_dir, f"{best_model_name.replace(' ', '_')}_best_model.pkl")
+    with open(model_pkl_path, 'wb') as f:
+        pickle.dump(clf, f, protocol=4)
+    print(f"Model saved with pickle: {model_pkl_path}")
+
+    # The other trained models can be served as shadow or ensemble
+    # secondaries (SECONDARY_MODELS in app.py)
+    for name, model in models.items():
+        if name != best_model_name:
+            secondary_path = os.path.join(save_dir, f"{name.replace(' ', '_')}_model.joblib")
+            joblib.dump(model, secondary_path, compress=3)
+            print(f"Secondary model saved with joblib: {secondary_path}")
+
+    # 3. Save MobileNetV2 feature extractor
+    feature_model_path = os.path.join(save_dir, "mobilenetv2_feature_extractor.h5")
+    feature_model.save(feature_model_path)
+    print(f"Feature extractor saved: {feature_model_path}")
+
+    # 4. Save model configuration
+    projection_config = {} if projection is None else {
+        'projection_dim': projection.dim,
+        'projection_explained_variance': projection.explained_variance
+    }
+    selection_config = {
+        'params': selected['params'],
+        'cv_accuracy': selected['accuracy'],
+        'predict_ms_per_image': selected['single_ms'],
+        'latency_budget_ms': LATENCY_BUDGET_MS,
+        'within_latency_budget': within_budget
+    }
+    config = build_config(best_model_name, accuracies[best_model_name], X.shape[1] if len(X) > 0 else 0,
+                          selection=selection_config, **projection_config)
+
+    config_path = os.path.join(save_dir, "model_config.json")
+    with open(config_path, 'w') as f:
+        json.dump(config, f, indent=4)
+    print(f"Configuration saved: {config_path}")
+
+    print(f"\nAll models saved to: {save_dir}")
+
+    # 5. Publish as a registry version the server can swap to without a restart
+    registry = ModelRegistry(REGISTRY_DIR)
+    manifest = registry.publish(model_joblib_path, config, feature_model_path)
+    print(f"Published model version {manifest['version']} to {REGISTRY_DIR}")
+    if registry.routing()['active'] is None:
+        registry.set_routing(active=manifest['version'])
+        print(f"Version {manifest['version']} is now active")
+    else:
+        print(f"Activate it with: python registry.py --registry \"{REGISTRY_DIR}\" activate {manifest['version']}")
+
+    # 6. Record the split and model for incremental runs
+    save_training_manifest(keys_train, keys_test, model_joblib_path, best_model_name,
+                           manifest['version'], accuracies[best_model_name])
+
+    # Test predictions using best model
+    test_images = [
+        r"C:\Users\Ahmed Abd El Rahman\Desktop\Ai Agent Project\pothos1.jpg",
+        r"C:\Users\Ahmed Abd El Rahman\Desktop\Ai Agent Project\pothos2.jpg",
+        r"C:\Users\Ahmed Abd El Rahman\Desktop\Ai Agent Project\pothos3.jpg",
+        r"C:\Users\Ahmed Abd El Rahman\Desktop\Ai Agent Project\pothos5b.jpg",
+        r"C:\Users\Ahmed Abd El Rahman\Desktop\Ai Agent Project\pothos6h.jpg",
+        r"C:\Users\Ahmed Abd El Rahman\Desktop\Ai Agent Project\pothos6m.jpg"
+    ]
+
+    print("\nTesting predictions...")
+    for img_path in test_images:
+        if os.path.exists(img_path):
+            predict_image(img_path, clf, feature_model)
+        else:
+            print(f"Test image not found: {img_path}")
+
+def key_path(key):
+    """Image path of a feature store key"""
+    return key.split('|', 1)[0]
+
+def hashed_to_test(path):
+    """Deterministic train/test side for an image first seen in an incremental run"""
+    digest = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+    return int(digest[:8], 16) / 0x100000000 < TEST_FRACTION
+
+def incremental_main(retrain=False, activate=False):
+    """Update the last model with images added or changed since the last run.
+
+    Only images without cached features go through MobileNetV2. Images
+    that were already in the previous split keep their side, so both models
+    are compared on the same test set. The new model is published as a new
+    registry version and activated only with `activate`.
+    """
+    if not os.path.exists(TRAINING_MANIFEST):
+        print(f"ERROR: No training manifest at {TRAINING_MANIFEST}; run a full training first")
+        return 1
+    with open(TRAINING_MANIFEST) as f:
+        previous = json.load(f)
+
+    seed = AUGMENT_SEED if AUGMENT else None
+    if previous.get('augment_seed') != seed:
+        print("ERROR: The last run used a different augmentation seed; run a full training")
+        return 1
+
+    paths, labels = list_dataset()
+    if paths is None:
+        return 1
+    store = FeatureStore(FEATURE_STORE_DIR)
+    keys = [FeatureStore.make_key(p, seed) for p in paths]
+    previous_keys = set(previous['train']) | set(previous['test'])
+    new_keys = set(keys) - previous_keys
+    removed = len(previous_keys - set(keys))
+    print(f"{len(new_keys)} new or changed images, {removed} removed or changed since the last run")
+    if not new_keys and not removed:
+        print("Nothing to train")
+        return 0
+
+    missing = store.missing(keys)
+    if missing:
+        from tensorflow.keras.applications import MobileNetV2
+        print("Loading MobileNetV2...")
+        feature_model = MobileNetV2(weights='imagenet', include_top=False, pooling='avg', input_shape=(128, 128, 3))
+        extract_features(paths, seed, feature_model, store)
+    X, y, keys = load_features(paths, labels, seed, store)
+
+    # Known images keep their side of the split, new ones are placed by path
+    previous_paths = {key_path(k) for k in previous_keys}
+    previous_test_paths = {key_path(k) for k in previous['test']}
+    is_test = np.array([
+        key_path(k) in previous_test_paths if key_path(k) in previous_paths else hashed_to_test(key_path(k))
+        for k in keys
+    ])
+    X_train, y_train, X_test, y_test = X[~is_test], y[~is_test], X[is_test], y[is_test]
+    print(f"Train: {len(X_train)} images, test: {len(X_test)} images "
+          f"({sum(k in new_keys for k, t in zip(keys, is_test) if t)} new)")
+
+    previous_model = joblib.load(previous['model_path'])
+    model = joblib.load(previous['model_path'])
+    # A projected model keeps its projection, so the features keep their meaning
+    projection = model.projection if isinstance(model, ProjectedClassifier) else None
+    estimator = model.classifier if projection is not None else model
+    if not retrain and isinstance(estimator, RandomForestClassifier):
+        estimator.set_params(warm_start=True, n_estimators=estimator.n_estimators + GROW_TREES)
+        method = f"warm_start +{GROW_TREES} trees"
+    else:
+        estimator = clone(estimator)
+        method = "refit on cached features"
+    model = estimator if projection is None else ProjectedClassifier(projection, estimator)
+
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    estimator.set_params(warm_start=False)
+    print(f"Updated {previous['model_type']} ({method}) in {time.perf_counter() - start:.1f}s")
+
+    previous_accuracy = accuracy_score(y_test, previous_model.predict(X_test))
+    y_pred = model.predict(X_test)
+    accuracy = accuracy_score(y_test, y_pred)
+    print("\n=== Accuracy on the current test set ===")
+    print(f"Previous model ({previous['version']}): {previous_accuracy:.4f}")
+    print(f"Updated model: {accuracy:.4f} ({accuracy - previous_accuracy:+.4f})")
+    print(classification_report(y_test, y_pred, target_names=CATEGORIES))
+
+    # Publish as a new registry version; the training files in SAVE_DIR are left alone
+    model_path = os.path.join(SAVE_DIR, f"{previous['model_type'].replace(' ', '_')}_incremental.joblib")
+    joblib.dump(model, model_path, compress=3)
+    config = build_config(
+        previous['model_type'], accuracy, X.shape[1],
+        previous_version=previous['version'],
+        previous_accuracy=previous_accuracy,
+        training_images=len(X_train),
+        update_method=method,
+        **({} if projection is None else {'projection_dim': projection.dim})
+    )
+    registry = ModelRegistry(REGISTRY_DIR)
+    manifest = registry.publish(model_path, config, os.path.join(SAVE_DIR, "mobilenetv2_feature_extractor.h5"))
+    os.remove(model_path)
+    version_path = os.path.join(registry.version_dir(manifest['version']), manifest['classifier'])
+    print(f"Published model version {manifest['version']} to {REGISTRY_DIR}")
+    if activate:
+        registry.set_routing(active=manifest['version'])
+        print(f"Version {manifest['version']} is now active")
+    else:
+        print(f"Activate it with: python registry.py --registry \"{REGISTRY_DIR}\" activate {manifest['version']}")
+
+    save_training_manifest(
+        [k for k, t in zip(keys, is_test) if not t], [k for k, t in zip(keys, is_test) if t],
+        version_path, previous['model_type'], manifest['version'], accuracy
+    )
+    return 0
+
+def time_per_image(images, predict):
+    """Mean seconds of predict(image) over decoded images, after one warm-up call"""
+    predict(images[0])
+    start = time.perf_counter()
+    for img in images:
+        predict(img)
+    return (time.perf_counter() - start) / len(images)
+
+def cascade_main(target_accuracy=CASCADE_TARGET_ACCURACY):
+    """Train and calibrate the cascade first stage on the split of the last training run.
+
+    Reports first-stage share, accuracy and mean model latency per image on
+    the held-out split for a range of thresholds, against the full pipeline
+    alone. Decoding is left out of the latencies as both paths pay for it.
+    """
+    if not os.path.exists(TRAINING_MANIFEST):
+        print(f"ERROR: No training manifest at {TRAINING_MANIFEST}; run a full training first")
+        return 1
+    with open(TRAINING_MANIFEST) as f:
+        previous = json.load(f)
+    paths, labels = list_dataset()
+    if paths is None:
+        return 1
+    label_of = dict(zip((os.path.abspath(p) for p in paths), labels))
+    store = FeatureStore(FEATURE_STORE_DIR)
+
+    def split(keys):
+        keys = [k for k in keys if key_path(k) in label_of and k in store]
+        with ProcessPoolExecutor(max_workers=NUM_WORKERS) as pool:
+            features = list(tqdm(pool.map(load_cheap_features, [key_path(k) for k in keys], chunksize=8),
+                                 total=len(keys), desc="Cheap features"))
+        kept = [i for i, f in enumerate(features) if f is not None]
+        return ([keys[i] for i in kept], np.stack([features[i] for i in kept]),
+                np.array([label_of[key_path(keys[i])] for i in kept]))
+
+    train_keys, C_train, y_train = split(previous['train'])
+    test_keys, C_test, y_test = split(previous['test'])
+    print(f"Cascade split: {len(train_keys)} train, {len(test_keys)} held-out images")
+
+    # Calibrate on out-of-fold probabilities, then fit on the whole training split
+    first_stage = make_pipeline(StandardScaler(), LogisticRegression(max_iter=2000))
+    out_of_fold = cross_val_predict(first_stage, C_train, y_train, cv=5, method='predict_proba', n_jobs=NUM_WORKERS)
+    threshold = calibrate_threshold(out_of_fold, y_train, target_accuracy)
+    out_of_fold_share = float((out_of_fold.max(axis=1) >= threshold).mean())
+    print(f"Calibrated threshold {threshold:.4f}: the first stage answers {out_of_fold_share:.1%} "
+          f"of the training images (out of fold) at >= {target_accuracy:.1%} accuracy")
+    first_stage.fit(C_train, y_train)
+    first_proba = first_stage.predict_proba(C_test)
+
+    # Full pipeline predictions on the same held-out images
+    full_model = joblib.load(previous['model_path'])
+    full_predictions = full_model.predict(store.get_many(test_keys))
+
+    # Per-image model time of each stage, measured on held-out images one at a time
+    from tensorflow.keras.applications import MobileNetV2
+    feature_model = MobileNetV2(weights='imagenet', include_top=False, pooling='avg', input_shape=(128, 128, 3))
+    sample = [cv2.imread(key_path(k)) for k in test_keys[:CASCADE_TIMING_IMAGES]]
+    first_seconds = time_per_image(sample, lambda img: first_stage.predict_proba(cheap_features(img)[np.newaxis]))
+    full_seconds = time_per_image(sample, lambda img: full_model.predict_proba(
+        feature_model.predict(preprocess_image(img)[np.newaxis], verbose=0)))
+
+    thresholds = sorted({0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99, threshold})
+    rows = tradeoff(first_proba, full_predictions, y_test, first_seconds, full_seconds, thresholds)
+    full_accuracy = accuracy_score(y_test, full_predictions)
+    print(f"\n=== Cascade trade-off on {len(test_keys)} held-out images ===")
+    print(f"{'threshold':>10} {'1st stage':>10} {'1st acc':>8} {'accuracy':>9} {'ms/image':>9}")
+    print(f"{'full only':>10} {0:>10.1%} {'-':>8} {full_accuracy:>9.4f} {full_seconds * 1000:>9.2f}")
+    for row in rows:
+        first_accuracy = f"{row['first_stage_accuracy']:.4f}" if row['first_stage_accuracy'] is not None else '-'
+        marker = '  <- calibrated' if row['threshold'] == threshold else ''
+        print(f"{row['threshold']:>10.4f} {row['first_stage_share']:>10.1%} {first_accuracy:>8} "
+              f"{row['accuracy']:>9.4f} {row['mean_latency_ms']:>9.2f}{marker}")
+
+    chosen = next(row for row in rows if row['threshold'] == threshold)
+    print(f"\nAt the calibrated threshold the first stage handles {chosen['first_stage_share']:.1%} of the "
+          f"held-out images and the full pipeline {1 - chosen['first_stage_share']:.1%}")
+
+    cascade = {
+        'classifier': first_stage,
+        'threshold': threshold,
+        'feature_version': FEATURE_VERSION,
+        'categories': CATEGORIES,
+        'model_version': previous['version'],
+        'calibration': {
+            'target_accuracy': target_accuracy,
+            'threshold': threshold,
+            'out_of_fold_share': out_of_fold_share,
+            'heldout_share': chosen['first_stage_share'],
+            'heldout_accuracy': chosen['accuracy'],
+            'heldout_full_accuracy': full_accuracy,
+            'first_stage_ms': first_seconds * 1000,
+            'full_pipeline_ms': full_seconds * 1000
+        }
+    }
+    joblib.dump(cascade, CASCADE_MODEL_PATH, compress=3)
+    print(f"Cascade first stage saved: {CASCADE_MODEL_PATH} (serve it with CASCADE_MODEL in app.py)")
+    return 0
+
+def load_cached_split():
+    """Return (training manifest, (X_train, y_train, X_test, y_test)) of the last run from the feature store.
+
+    Images no longer in the dataset or without cached features are left
+    out. Returns (None, None) when there is no manifest or dataset.
+    """
+    if not os.path.exists(TRAINING_MANIFEST):
+        print(f"ERROR: No training manifest at {TRAINING_MANIFEST}; run a full training first")
+        return None, None
+    with open(TRAINING_MANIFEST) as f:
+        previous = json.load(f)
+    paths, labels = list_dataset()
+    if paths is None:
+        return None, None
+    label_of = dict(zip((os.path.abspath(p) for p in paths), labels))
+    store = FeatureStore(FEATURE_STORE_DIR)
+
+    def split(keys):
+        keys = [k for k in keys if key_path(k) in label_of and k in store]
+        return store.get_many(keys), np.array([label_of[key_path(k)] for k in keys])
+
+    return previous, split(previous['train']) + split(previous['test'])
+
+def run_selection(X_train, y_train):
+    """Cross-validate SELECTION_GRID and pick a model under LATENCY_BUDGET_MS.
+
+    Prints every candidate, writes SELECTION_REPORT_PATH and returns
+    (rows, selected row, whether it is within the budget).
+    """
+    candidates = expand_grid(SELECTION_GRID)
+    print(f"\nCross-validating {len(candidates)} candidates with {SELECTION_FOLDS} folds "
+          f"on {NUM_WORKERS} processes...")
+    start = time.perf_counter()
+    rows = cross_validate(candidates, X_train, y_train, folds=SELECTION_FOLDS, n_jobs=NUM_WORKERS)
+    selected, within_budget = select(rows, LATENCY_BUDGET_MS)
+    print(f"Model selection took {time.perf_counter() - start:.1f}s\n")
+    print_selection(rows, selected, LATENCY_BUDGET_MS)
+    if within_budget:
+        print(f"\nSelected {selected['family']} {selected['params']}: cv accuracy {selected['accuracy']:.4f}, "
+              f"{selected['single_ms']:.2f} ms per image (budget {LATENCY_BUDGET_MS:g} ms)")
     else:
-        print(f"Test image not found: {img_path}")
\ No newline at end of file
+        print(f"\nWARNING: no candidate predicts within {LATENCY_BUDGET_MS:g} ms per image; "
+              f"using the fastest, {selected['family']} {selected['params']} ({selected['single_ms']:.2f} ms)")
+
+    tmp_path = SELECTION_REPORT_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'folds': SELECTION_FOLDS, 'latency_budget_ms': LATENCY_BUDGET_MS,
+                   'training_images': len(X_train), 'selected': rows.index(selected),
+                   'within_latency_budget': within_budget, 'candidates': rows}, f, indent=4)
+    os.replace(tmp_path, SELECTION_REPORT_PATH)
+    print(f"Selection report saved: {SELECTION_REPORT_PATH}")
+    return rows, selected, within_budget
+
+def selection_main():
+    """Run the model selection alone on the cached features of the last run's training split"""
+    previous, split = load_cached_split()
+    if previous is None:
+        return 1
+    X_train, y_train = split[:2]
+    run_selection(X_train, y_train)
+    return 0
+
+def projection_report_main(dims=PROJECTION_REPORT_DIMS):
+    """Compare the raw features with projections to each of `dims` dimensions.
+
+    The model type of the last training run is refit on the cached features
+    of its split, once on the raw features and once per projection. Reports
+    held-out accuracy, pickled model size, stored bytes per image feature
+    vector and classification latency (projection included).
+    """
+    previous, split = load_cached_split()
+    if previous is None:
+        return 1
+    X_train, y_train, X_test, y_test = split
+    print(f"Projection report on {len(X_train)} train, {len(X_test)} held-out images")
+
+    template = joblib.load(previous['model_path'])
+    if isinstance(template, ProjectedClassifier):
+        template = template.classifier
+    rows = []
+    for dim in [None] + sorted(dims):
+        model = clone(template)
+        projection = None
+        if dim is not None:
+            projection = Projection.fit(X_train, dim)
+            model = ProjectedClassifier(projection, model)
+        start = time.perf_counter()
+        model.fit(X_train, y_train)
+        fit_seconds = time.perf_counter() - start
+        single_ms, batch_ms = classification_latency(model, X_test, PROJECTION_TIMING_IMAGES)
+        rows.append({
+            'dim': X_train.shape[1] if projection is None else projection.dim,
+            'projected': projection is not None,
+            'explained_variance': None if projection is None else projection.explained_variance,
+            'accuracy': accuracy_score(y_test, model.predict(X_test)),
+            'model_bytes': len(pickle.dumps(model, protocol=4)),
+            'feature_bytes': X_train.shape[1] * 4 if projection is None else projection.dim * 2,
+            'fit_seconds': fit_seconds,
+            'single_ms': single_ms,
+            'batch_ms': batch_ms
+        })
+
+    print(f"\n=== {previous['model_type']}: raw features vs PCA projections ===")
+    print(f"{'features':>14} {'variance':>9} {'accuracy':>9} {'model MB':>9} {'bytes/img':>10} "
+          f"{'fit s':>7} {'ms/img 1':>9} {'ms/img batch':>13}")
+    for row in rows:
+        name = f"pca {row['dim']} f16" if row['projected'] else f"raw {row['dim']} f32"
+        variance = f"{row['explained_variance']:.1%}" if row['projected'] else '-'
+        print(f"{name:>14} {variance:>9} {row['accuracy']:>9.4f} {row['model_bytes'] / 1e6:>9.2f} "
+              f"{row['feature_bytes']:>10} {row['fit_seconds']:>7.1f} {row['single_ms']:>9.3f} "
+              f"{row['batch_ms']:>13.4f}")
+
+    tmp_path = PROJECTION_REPORT_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'model_type': previous['model_type'], 'model_version': previous['version'],
+                   'train_images': len(X_train), 'test_images': len(X_test), 'rows': rows}, f, indent=4)
+    os.replace(tmp_path, PROJECTION_REPORT_PATH)
+    print(f"\nReport saved: {PROJECTION_REPORT_PATH}")
+    print("Train with a projection with: python v4Pothos.py --projection-dim N")
+    return 0
+
+# The process pool re-imports this module in its workers, so training only
+# runs when the script is executed directly
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Train the money plant disease classifier")
+    parser.add_argument('--incremental', action='store_true',
+                        help='update the last model with new or changed images only')
+    parser.add_argument('--retrain', action='store_true',
+                        help='with --incremental, refit from cached features instead of growing the forest')
+    parser.add_argument('--activate', action='store_true',
+                        help='with --incremental, make the new version active in the registry')
+    parser.add_argument('--cascade', action='store_true',
+                        help='train and calibrate the cheap first stage of the inference cascade')
+    parser.add_argument('--target-accuracy', type=float, default=CASCADE_TARGET_ACCURACY,
+                        help='with --cascade, accuracy the first-stage answers must reach')
+    parser.add_argument('--select', action='store_true',
+                        help='run the cross-validated model selection alone on the last split')
+    parser.add_argument('--projection-dim', type=int, default=PROJECTION_DIM,
+                        help='train on features projected to this many PCA dimensions (0: raw features)')
+    parser.add_argument('--projection-report', type=int, nargs='*', metavar='DIM',
+                        help='compare projections to these dimensions with the raw features on the last split')
+    args = parser.parse_args()
+    if args.select:
+        sys.exit(selection_main())
+    if args.projection_report is not None:
+        sys.exit(projection_report_main(args.projection_report or PROJECTION_REPORT_DIMS))
+    if args.cascade:
+        sys.exit(cascade_main(args.target_accuracy))
+    if args.incremental:
+        sys.exit(incremental_main(retrain=args.retrain, activate=args.activate))
+    main(args.projection_dim)
@@ -0,0 +1,175 @@
+"""Admission control and request deadlines for the prediction endpoints.
+
+An AdmissionController lets at most `max_in_flight` requests do model work
+at once. Up to `max_queue` more wait for a slot, each for at most
+`max_wait_ms`; anything beyond that is refused straight away instead of
+queueing behind TensorFlow:
+
+    queue_full     the wait queue is full              -> 429 Too Many Requests
+    wait_timeout   no slot freed up within max_wait_ms -> 503 Service Unavailable
+
+Both carry a Retry-After estimated from the recent time a request holds its
+slot. A request whose deadline passes while it waits is dropped as expired
+rather than shed; the client has already given up on it.
+
+Deadlines come from the client as the number of milliseconds it is still
+willing to wait (parse_deadline), so client and server clocks never have
+to agree. They are turned into time.monotonic() values.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Overloaded(Exception):
+    """A request refused by admission control; `status` is 429 or 503"""
+
+    def __init__(self, reason, status, retry_after):
+        super().__init__(f"Server is overloaded ({reason}), retry in {retry_after}s")
+        self.reason = reason
+        self.status = status
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(TimeoutError):
+    """A request whose client deadline passed; `stage` is where it was dropped"""
+
+    def __init__(self, stage):
+        super().__init__(f"Request deadline passed ({stage})")
+        self.stage = stage
+
+
+def parse_deadline(value, default_ms=0.0, now=None):
+    """Monotonic deadline from a remaining-milliseconds header value, or None for no deadline.
+
+    A missing header falls back to `default_ms` (0: no deadline). Raises
+    ValueError for values that are not numbers.
+    """
+    if value is None or value == '':
+        remaining_ms = default_ms
+        if not remaining_ms:
+            return None
+    else:
+        remaining_ms = float(value)
+        if math.isnan(remaining_ms):
+            raise ValueError(f"Invalid deadline {value!r}")
+    return (time.monotonic() if now is None else now) + remaining_ms / 1000.0
+
+
+class AdmissionController:
+    """Bounds concurrent model work and the queue in front of it.
+
+    `max_in_flight` of 0 disables the limit (every request is admitted, but
+    deadlines and counts still apply). `retry_after` is the smallest
+    Retry-After in seconds.
+    """
+
+    REASONS = ('queue_full', 'wait_timeout')
+
+    def __init__(self, max_in_flight=32, max_queue=64, max_wait_ms=1000.0, retry_after=1):
+        self.max_in_flight = max(0, int(max_in_flight))
+        self.max_queue = max(0, int(max_queue))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.retry_after = max(1, int(retry_after))
+
+        self._cond = threading.Condition()
+        self._service_seconds = None
+        self.in_flight = 0
+        self.waiting = 0
+
+        # Counters
+        self.admitted = 0
+        self.shed = {reason: 0 for reason in self.REASONS}
+        self.expired = {}
+        self.max_waiting = 0
+
+    def _retry_after_seconds(self):
+        """Seconds until the queue ahead has probably drained; called with the lock held"""
+        if self._service_seconds is None or not self.max_in_flight:
+            return self.retry_after
+        drain = self._service_seconds * (self.waiting + 1) / self.max_in_flight
+        return max(self.retry_after, math.ceil(drain))
+
+    def expire(self, stage):
+        """Count a request dropped because its deadline passed, and return the exception to raise"""
+        with self._cond:
+            self.expired[stage] = self.expired.get(stage, 0) + 1
+        return DeadlineExceeded(stage)
+
+    def check(self, deadline, stage):
+        """Raise DeadlineExceeded if `deadline` has passed"""
+        if deadline is not None and time.monotonic() >= deadline:
+            raise self.expire(stage)
+
+    def acquire(self, deadline=None):
+        """Take an in-flight slot, waiting in the queue if needed.
+
+        Raises Overloaded when the request is shed and DeadlineExceeded when
+        its deadline passes first.
+        """
+        self.check(deadline, 'queue')
+        with self._cond:
+            if not self.max_in_flight or self.in_flight < self.max_in_flight:
+                self.in_flight += 1
+                self.admitted += 1
+                return
+            if self.waiting >= self.max_queue:
+                self.shed['queue_full'] += 1
+                raise Overloaded('queue_full', 429, self._retry_after_seconds())
+
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+            wait_until = time.monotonic() + self.max_wait
+            until = wait_until if deadline is None else min(wait_until, deadline)
+            try:
+                while self.in_flight >= self.max_in_flight:
+                    remaining = until - time.monotonic()
+                    if remaining <= 0:
+                        if deadline is not None and deadline <= wait_until:
+                            self.expired['queue'] = self.expired.get('queue', 0) + 1
+                            raise DeadlineExceeded('queue')
+                        self.shed['wait_timeout'] += 1
+                        raise Overloaded('wait_timeout', 503, self._retry_after_seconds())
+                    self._cond.wait(remaining)
+                self.in_flight += 1
+                self.admitted += 1
+            finally:
+                self.waiting -= 1
+
+    def release(self, seconds):
+        """Give back a slot held for `seconds`"""
+        with self._cond:
+            self.in_flight -= 1
+            # Exponential moving average of the time a slot is held, for Retry-After
+            if self._service_seconds is None:
+                self._service_seconds = seconds
+            else:
+                self._service_seconds += 0.05 * (seconds - self._service_seconds)
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self, deadline=None):
+        """Hold an in-flight slot for the duration of a with block"""
+        self.acquire(deadline)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - start)
+
+    def stats(self):
+        """Return slot usage, shed and expired counters"""
+        with self._cond:
+            return {
+                'max_in_flight': self.max_in_flight,
+                'max_queue': self.max_queue,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'max_waiting': self.max_waiting,
+                'admitted': self.admitted,
+                'shed': dict(self.shed),
+                'expired': dict(self.expired),
+                'slot_seconds': self._service_seconds
+            }
@@ -1,240 +1,1102 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 import joblib
 import numpy as np
-from PIL import Image
-import cv2
-import io
-import base64
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 import os
-import traceback
-from tensorflow.keras.applications import MobileNetV2
-from tensorflow.keras.applications.mobilenet_v2 import preprocess_input
-from tensorflow.keras.preprocessing import image as keras_image
-import pickle
+import json
+import hashlib
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from admission import AdmissionController, Overloaded, parse_deadline
+from batching import BatchScheduler
+from cascade import CascadeStage
+from cache import PredictionCache, image_digest, make_key
+from shared_cache import SharedTier
+from embedding_index import EmbeddingIndex
+from ensemble import MODES, SecondaryModel, SecondaryScorer, parse_model_specs
+from feature_backends import FEATURE_DIM
+from metrics import CONTENT_TYPE, SIZE_BUCKETS, Registry
+from preprocessing import IMAGE_SIZE, preprocess_batch, preprocess_image
+from quality_gate import REASONS, QualityGate
+from inference import (
+    MODEL_PATH, MODEL_VERSION, FEATURE_BACKEND, CLASSIFIER_ENGINE, CACHE_NAMESPACE,
+    DISEASE_CLASSES, MAX_UPLOAD_BYTES, ImageTooLarge, load_classifier, load_feature_model,
+    decode_image, decode_base64_image, classify, class_probabilities, build_response,
+    cache_namespace, load_pickled_classifier, model_config
+)
+from registry import (
+    REGISTRY_DIR, LoadedModel, ModelRegistry, ModelRouter, RegistryError,
+    check_compatible, process_rss_bytes
+)
 
 app = Flask(__name__)
 CORS(app)
 
-# Model path
-MODEL_PATH = r"C:\Users\Ahmed Abd El Rahman\Desktop\Ai Agent Project\Random_Forest_best_model.joblib"
-# Check if model file exists
-if not os.path.exists(MODEL_PATH):
-    print(f"ERROR: Model file not found at {MODEL_PATH}")
-    model = None
-else:
-    print(f"Model file found at {MODEL_PATH}")
-    try:
-        # Try loading with pickle instead of joblib
-        with open(MODEL_PATH, 'rb') as file:
-            model = pickle.load(file)
-        print(f"Model loaded successfully with pickle")
-    except Exception as e:
-        print(f"Error loading model with pickle: {e}")
-        
-        # If pickle fails, try joblib
-        try:
-            import joblib
-            model = joblib.load(MODEL_PATH)
-            print(f"Model loaded successfully with joblib")
-        except Exception as e2:
-            print(f"Error loading model with joblib: {e2}")
-            model = None
-# Load MobileNetV2 for feature extraction
-try:
-    feature_model = MobileNetV2(
-        weights='imagenet', 
-        include_top=False, 
-        pooling='avg', 
-        input_shape=(128, 128, 3)
-    )
-    print("MobileNetV2 loaded successfully")
-except Exception as e:
-    print(f"Error loading MobileNetV2: {e}")
-    feature_model = None
-
-# Define disease classes (from your model)
-DISEASE_CLASSES = [
-    "Healthy", 
-    "Manganese Toxicity", 
-    "Bacterial wilt disease"
-]
-
-# Image processing settings (same as training)
-IMAGE_SIZE = (128, 128)
-
-# Health scores for each disease
-HEALTH_SCORES = {
-    'Healthy': 95.0,
-    'Manganese Toxicity': 55.0,
-    'Bacterial wilt disease': 35.0
-}
-
-# Recommendations for each disease
-RECOMMENDATIONS = {
-    'Healthy': [
-        'Continue regular watering schedule',
-        'Monitor plant growth regularly',
-        'Maintain current care routine',
-        'Ensure adequate indirect sunlight',
-        'Check soil moisture before watering'
-    ],
-    'Manganese Toxicity': [
-        'Reduce manganese-containing fertilizers immediately',
-        'Check and adjust soil pH (should be 6.0-7.0)',
-        'Flush soil with clean water to remove excess minerals',
-        'Improve drainage to prevent mineral buildup',
-        'Consider repotting with fresh, well-draining soil',
-        'Avoid tap water high in minerals - use filtered water'
-    ],
-    'Bacterial wilt disease': [
-        'Isolate infected plant immediately to prevent spread',
-        'Remove all infected leaves and stems',
-        'Apply copper-based bactericide',
-        'Reduce watering frequency - bacteria thrive in wet conditions',
-        'Improve air circulation around the plant',
-        'Sterilize all tools after use',
-        'Consider propagating healthy cuttings before plant deteriorates'
+# Request bodies over MAX_REQUEST_BYTES are refused with 413 before they are
+# read; single images are limited by MAX_UPLOAD_BYTES in inference.py
+MAX_REQUEST_BYTES = int(os.environ.get('MAX_REQUEST_BYTES', str(256 * 1024 * 1024)))
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
+
+# Per-request details are logged at DEBUG; set LOG_LEVEL=DEBUG to see them
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+log = logging.getLogger('app')
+log.info("Model version: %s", MODEL_VERSION)
+
+# Load models in a background thread so /health/live answers immediately;
+# set STARTUP_BACKGROUND=0 to load them before the server starts
+STARTUP_BACKGROUND = os.environ.get('STARTUP_BACKGROUND', '1') == '1'
+
+# Models are filled in by load_models(). The classifier is held by the
+# router so it can be swapped while requests are in flight. A classifier
+# saved with a feature projection (projection.py) reduces the MobileNetV2
+# features itself right before its trees; caches and secondary models keep
+# the full features.
+model_router = ModelRouter()
+feature_model = None
+
+# Model registry: with REGISTRY_DIR set, the active and candidate versions
+# named in its routing.json are served, and routing.json is checked every
+# REGISTRY_POLL_SECONDS (0 disables polling; POST /models/reload still
+# works). Without it the classifier at MODEL_PATH is served.
+REGISTRY_POLL_SECONDS = float(os.environ.get('REGISTRY_POLL_SECONDS', '10'))
+model_registry = ModelRegistry(REGISTRY_DIR) if REGISTRY_DIR else None
+registry_lock = threading.Lock()
+registry_mtime = None
+
+# Secondary classifiers scored on the same MobileNetV2 features as the
+# primary one. SCORING_MODE is 'single' (primary only), 'shadow' (secondaries
+# scored in the background, disagreements logged) or 'ensemble' (weighted
+# mean of all probabilities). SECONDARY_MODELS lists classifier files as
+# 'path[:weight[:budget_ms]]', comma separated; PRIMARY_WEIGHT weighs the
+# primary model. A secondary that takes longer than its budget (default
+# SECONDARY_BUDGET_MS, read in ensemble.py) is skipped for the batch instead
+# of delaying it.
+SCORING_MODE = os.environ.get('SCORING_MODE', 'single')
+SECONDARY_MODELS = os.environ.get('SECONDARY_MODELS', '')
+PRIMARY_WEIGHT = float(os.environ.get('PRIMARY_WEIGHT', '1'))
+SHADOW_MAX_PENDING = int(os.environ.get('SHADOW_MAX_PENDING', '64'))
+if SCORING_MODE not in MODES:
+    raise ValueError(f"SCORING_MODE must be one of {MODES}, got {SCORING_MODE!r}")
+secondary_scorer = None
+
+# Nearest-neighbour index of training and past embeddings (see
+# embedding_index.py). With EMBEDDING_INDEX_DIR set, responses list the
+# EVIDENCE_K most similar training images, and images within cosine
+# DUPLICATE_THRESHOLD of an indexed one are reported as near duplicates;
+# DUPLICATE_SHORT_CIRCUIT=1 answers them with the label of the duplicate
+# without running the classifier. Neighbours are looked up again on every
+# cache hit, since the index keeps growing.
+# Submissions that are not near duplicates are added to the index in the
+# background unless INDEX_SUBMISSIONS=0.
+EMBEDDING_INDEX_DIR = os.environ.get('EMBEDDING_INDEX_DIR', '')
+EVIDENCE_K = int(os.environ.get('EVIDENCE_K', '3'))
+DUPLICATE_THRESHOLD = float(os.environ.get('DUPLICATE_THRESHOLD', '0.98'))
+DUPLICATE_SHORT_CIRCUIT = os.environ.get('DUPLICATE_SHORT_CIRCUIT', '0') == '1'
+INDEX_SUBMISSIONS = os.environ.get('INDEX_SUBMISSIONS', '1') == '1'
+INDEX_N_PROBE = int(os.environ.get('INDEX_N_PROBE', '8'))
+embedding_index = None
+index_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='index-writer')
+
+# Image-quality gate (see quality_gate.py): with QUALITY_GATE=reject, blurry,
+# badly exposed and non-plant photos get a "retake photo" response without
+# running the models; 'report' only adds the measures to every response and
+# 'off' skips the checks. Thresholds set to 0 are not checked.
+QUALITY_GATE = os.environ.get('QUALITY_GATE', 'off')
+if QUALITY_GATE not in ('off', 'report', 'reject'):
+    raise ValueError(f"QUALITY_GATE must be 'off', 'report' or 'reject', got {QUALITY_GATE!r}")
+quality_gate = QualityGate(
+    min_sharpness=float(os.environ.get('QUALITY_MIN_SHARPNESS', '25')),
+    min_brightness=float(os.environ.get('QUALITY_MIN_BRIGHTNESS', '35')),
+    max_brightness=float(os.environ.get('QUALITY_MAX_BRIGHTNESS', '225')),
+    max_clipped=float(os.environ.get('QUALITY_MAX_CLIPPED', '0.5')),
+    min_leaf_coverage=float(os.environ.get('QUALITY_MIN_LEAF_COVERAGE', '0.05')),
+    leaf_hue=[int(h) for h in os.environ.get('QUALITY_LEAF_HUE', '20,95').split(',')],
+    size=int(os.environ.get('QUALITY_SIZE', '256'))
+) if QUALITY_GATE != 'off' else None
+
+# Inference cascade (see cascade.py): with CASCADE_MODEL set to a first
+# stage trained by v4Pothos.py --cascade, images the cheap first stage is
+# confident about are answered without MobileNetV2; the rest go through the
+# full pipeline. CASCADE_THRESHOLD overrides the calibrated threshold.
+CASCADE_MODEL = os.environ.get('CASCADE_MODEL', '')
+CASCADE_THRESHOLD = os.environ.get('CASCADE_THRESHOLD', '')
+cascade_stage = None
+
+# Startup state: per-phase timings in seconds, and whether the warm-up
+# inference has completed
+startup_timings = {}
+startup_done = threading.Event()
+ready = False
+
+# Micro-batching settings: concurrent /predict requests are grouped into one
+# MobileNetV2 + Random Forest pass of up to BATCH_MAX_SIZE images, waiting at
+# most BATCH_MAX_WAIT_MS for the batch to fill up
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', '16'))
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', '10'))
+
+# Admission control for /predict and /predict/batch (see admission.py): at
+# most MAX_IN_FLIGHT requests that missed the cache, or batch uploads, do
+# model work at once, up to ADMISSION_QUEUE more wait at most
+# ADMISSION_WAIT_MS for a slot, and the rest get 429 or 503 with
+# Retry-After instead of queueing. MAX_IN_FLIGHT=0
+# admits everything. Clients send how many milliseconds they will still
+# wait in DEADLINE_HEADER (DEFAULT_DEADLINE_MS when absent, 0 for none);
+# requests whose deadline has passed get 504 before they reach MobileNetV2.
+MAX_IN_FLIGHT = int(os.environ.get('MAX_IN_FLIGHT', str(2 * BATCH_MAX_SIZE)))
+ADMISSION_QUEUE = int(os.environ.get('ADMISSION_QUEUE', str(4 * BATCH_MAX_SIZE)))
+ADMISSION_WAIT_MS = float(os.environ.get('ADMISSION_WAIT_MS', '1000'))
+DEADLINE_HEADER = os.environ.get('DEADLINE_HEADER', 'X-Deadline-Ms')
+DEFAULT_DEADLINE_MS = float(os.environ.get('DEFAULT_DEADLINE_MS', '0'))
+admission = AdmissionController(MAX_IN_FLIGHT, ADMISSION_QUEUE, ADMISSION_WAIT_MS)
+
+# Prediction cache settings: results are keyed by a hash of the uploaded image
+# bytes and the model version. Set CACHE_DISK_PATH to keep them across restarts.
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', '1024'))
+CACHE_TTL_SECONDS = float(os.environ.get('CACHE_TTL_SECONDS', '3600'))
+CACHE_DISK_PATH = os.environ.get('CACHE_DISK_PATH', '')
+
+# Cache tier shared by all replicas and workers (see shared_cache.py), e.g.
+# CACHE_SHARED_URL=redis://cache:6379/0 or sqlite:///var/cache/plant.db. If
+# it fails, or takes longer than CACHE_SHARED_TIMEOUT_MS to answer, it is
+# skipped for CACHE_SHARED_RETRY_SECONDS and requests are scored as usual.
+CACHE_SHARED_URL = os.environ.get('CACHE_SHARED_URL', '')
+CACHE_SHARED_TIMEOUT_MS = float(os.environ.get('CACHE_SHARED_TIMEOUT_MS', '50'))
+CACHE_SHARED_RETRY_SECONDS = float(os.environ.get('CACHE_SHARED_RETRY_SECONDS', '30'))
+
+# Prometheus metrics served on /metrics. Request stages are observed once per
+# request; 'mobilenet' and 'classifier' are observed once per model batch.
+metrics = Registry()
+STAGE_SECONDS = metrics.histogram(
+    'plant_stage_duration_seconds', 'Time spent in each prediction stage', ('stage',)
+)
+REQUEST_SECONDS = metrics.histogram(
+    'plant_request_duration_seconds', 'Time to build the response of each request', ('endpoint',)
+)
+REQUESTS = metrics.counter('plant_requests_total', 'Requests by endpoint and HTTP status', ('endpoint', 'status'))
+REQUEST_BYTES = metrics.histogram(
+    'plant_request_image_bytes', 'Size of uploaded images', ('endpoint',), buckets=SIZE_BUCKETS
+)
+ERRORS = metrics.counter('plant_errors_total', 'Failed predictions by error class', ('endpoint', 'error'))
+PREDICTIONS = metrics.counter('plant_predictions_total', 'Predictions served by disease', ('disease',))
+MODEL_BATCH_SIZE = metrics.histogram(
+    'plant_model_batch_size', 'Images per MobileNetV2 + Random Forest pass', buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+VERSION_PREDICTIONS = metrics.counter(
+    'plant_model_predictions_total', 'Images scored by each classifier version', ('version', 'role')
+)
+NEAR_DUPLICATES = metrics.counter(
+    'plant_near_duplicates_total', 'Images within DUPLICATE_THRESHOLD of an indexed one', ('source',)
+)
+
+def predict_batch(items):
+    """Run one MobileNetV2 pass over a batch and one classifier pass per model version.
+
+    `items` are (image, LoadedModel) pairs. Returns a (prediction,
+    confidence, features, duplicate, timings) tuple per image, in input
+    order. `duplicate` is the (similarity, entry id) of the indexed image
+    that answered it when DUPLICATE_SHORT_CIRCUIT is set, else None.
+    `timings` holds the seconds spent in each model for the whole batch and
+    is shared by all images of the batch.
+    """
+    start = time.perf_counter()
+    batch = np.stack([img for img, _ in items])
+    features = feature_model.predict(batch)
+    mobilenet_done = time.perf_counter()
+    log.debug("Extracted features shape: %s", features.shape)
+    
+    # Ensemble secondaries run on their own threads while the primary scores
+    scorer = secondary_scorer
+    ensemble = scorer is not None and scorer.mode == 'ensemble'
+    pending = scorer.submit(features) if ensemble else None
+    
+    # Near duplicates of indexed images take the duplicate's label and skip the classifier
+    predictions = np.empty(len(items), dtype=np.int64)
+    confidences = np.empty(len(items), dtype=np.float64)
+    duplicates = [None] * len(items)
+    if embedding_index is not None and DUPLICATE_SHORT_CIRCUIT:
+        duplicates = find_duplicates(features)
+        STAGE_SECONDS.observe(time.perf_counter() - mobilenet_done, stage='duplicate_lookup')
+    
+    # Requests routed to different versions share the feature pass
+    groups = {}
+    for i, (_, loaded) in enumerate(items):
+        if duplicates[i] is None:
+            groups.setdefault(id(loaded), (loaded, []))[1].append(i)
+        else:
+            similarity, _, label = duplicates[i]
+            predictions[i], confidences[i] = label, similarity * 100
+            duplicates[i] = duplicates[i][:2]
+    if ensemble:
+        # Score the primary first; only then wait for whatever budget the secondaries have left
+        primary_probas = [(rows, class_probabilities(loaded.classifier, features[rows]))
+                          for loaded, rows in groups.values()]
+        secondary_probas = scorer.collect(pending, mobilenet_done)
+        for rows, primary_proba in primary_probas:
+            predictions[rows], confidences[rows] = scorer.combine(primary_proba, secondary_probas, rows)
+    else:
+        for loaded, rows in groups.values():
+            predictions[rows], confidences[rows] = classify(loaded.classifier, features[rows])
+        if scorer is not None:
+            classified = [i for i, duplicate in enumerate(duplicates) if duplicate is None]
+            if classified:
+                scorer.shadow(features[classified], predictions[classified])
+    timings = {
+        'batch_size': len(items),
+        'mobilenet': mobilenet_done - start,
+        'classifier': time.perf_counter() - mobilenet_done
+    }
+    STAGE_SECONDS.observe(timings['mobilenet'], stage='mobilenet')
+    STAGE_SECONDS.observe(timings['classifier'], stage='classifier')
+    MODEL_BATCH_SIZE.observe(len(items))
+    # The warm-up pass is not representative of model time
+    if quality_gate is not None and ready:
+        quality_gate.note_model_seconds((timings['mobilenet'] + timings['classifier']) / len(items))
+    return [(int(p), float(c), f, d, timings) for p, c, f, d in zip(predictions, confidences, features, duplicates)]
+
+# Scheduler that groups concurrent /predict requests into batches
+batch_scheduler = BatchScheduler(
+    predict_batch,
+    max_batch_size=BATCH_MAX_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS
+)
+
+# Cache of features and responses for images that were already scored
+prediction_cache = PredictionCache(
+    max_entries=CACHE_MAX_ENTRIES,
+    ttl_seconds=CACHE_TTL_SECONDS,
+    disk_path=CACHE_DISK_PATH or None,
+    shared=SharedTier(
+        CACHE_SHARED_URL, CACHE_SHARED_RETRY_SECONDS, CACHE_SHARED_TIMEOUT_MS / 1000
+    ) if CACHE_SHARED_URL else None
+)
+
+def collect_runtime_metrics():
+    """Model load times and batching and cache counters, read on every scrape"""
+    batching = batch_scheduler.stats()
+    cache = prediction_cache.stats()
+    entries = [({'tier': 'memory'}, cache['entries'])]
+    if 'disk_entries' in cache:
+        entries.append(({'tier': 'disk'}, cache['disk_entries']))
+    if 'entries' in cache.get('shared', {}):
+        entries.append(({'tier': 'shared'}, cache['shared']['entries']))
+    return [
+        ('plant_model_ready', 'gauge', 'Whether both models are loaded and warmed up', [({}, int(ready))]),
+        ('plant_model_load_seconds', 'gauge', 'Time spent in each startup phase',
+         [({'phase': phase}, seconds) for phase, seconds in list(startup_timings.items())]),
+        ('plant_batch_queue_depth', 'gauge', 'Requests waiting for the batch scheduler',
+         [({}, batching['queue_depth'])]),
+        ('plant_batch_queue_depth_max', 'gauge', 'Highest batch scheduler queue depth seen',
+         [({}, batching['max_queue_depth'])]),
+        ('plant_batches_total', 'counter', 'Model batches run by the batch scheduler', [({}, batching['batches'])]),
+        ('plant_batch_items_total', 'counter', 'Images scored by the batch scheduler', [({}, batching['items'])]),
+        ('plant_cache_lookups_total', 'counter', 'Prediction cache lookups by result', [
+            ({'result': 'hit'}, cache['hits']),
+            ({'result': 'disk_hit'}, cache['disk_hits']),
+            ({'result': 'shared_hit'}, cache['shared_hits']),
+            ({'result': 'miss'}, cache['misses'])
+        ]),
+        ('plant_cache_removals_total', 'counter', 'Prediction cache entries removed by reason', [
+            ({'reason': 'eviction'}, cache['evictions']),
+            ({'reason': 'expiration'}, cache['expirations'])
+        ]),
+        ('plant_cache_entries', 'gauge', 'Entries held by each prediction cache tier', entries),
+        ('plant_cache_shared_errors_total', 'counter', 'Failed calls to the shared cache store',
+         [({}, cache['shared']['errors'])] if 'shared' in cache else []),
+        ('plant_cache_shared_available', 'gauge', 'Whether the shared cache store is in use',
+         [({}, int(cache['shared']['available']))] if 'shared' in cache else []),
+        ('plant_model_memory_bytes', 'gauge', 'Estimated memory held by each resident classifier',
+         [({'version': m.version, 'role': role}, m.nbytes) for role, m in model_router.loaded().items()]),
+        ('plant_model_swaps_total', 'counter', 'Classifier swaps, including the initial load',
+         [({}, model_router.swaps)])
+    ] + collect_admission_metrics() + collect_secondary_metrics() + collect_index_metrics() + \
+        collect_quality_metrics() + collect_cascade_metrics()
+
+def collect_admission_metrics():
+    """Admission slots in use, and requests shed or dropped past their deadline"""
+    admitted = admission.stats()
+    # Items the batch scheduler dropped count as expired while waiting for a batch
+    expired = dict(admitted['expired'], batch=batch_scheduler.stats()['expired'])
+    return [
+        ('plant_admission_in_flight', 'gauge', 'Requests holding an admission slot',
+         [({}, admitted['in_flight'])]),
+        ('plant_admission_waiting', 'gauge', 'Requests waiting for an admission slot',
+         [({}, admitted['waiting'])]),
+        ('plant_admission_admitted_total', 'counter', 'Requests given an admission slot',
+         [({}, admitted['admitted'])]),
+        ('plant_admission_shed_total', 'counter', 'Requests refused by admission control by reason',
+         [({'reason': reason}, count) for reason, count in admitted['shed'].items()]),
+        ('plant_deadline_expired_total', 'counter', 'Requests dropped after their deadline by stage',
+         [({'stage': stage}, count) for stage, count in expired.items()])
     ]
-}
-
-def basic_preprocessing(img):
-    """Apply the same preprocessing as in training"""
-    img = cv2.resize(img, IMAGE_SIZE)
-    img = cv2.GaussianBlur(img, (3, 3), 0)
-    ycrcb = cv2.cvtColor(img, cv2.COLOR_BGR2YCrCb)
-    ycrcb[:, :, 0] = cv2.equalizeHist(ycrcb[:, :, 0])
-    img = cv2.cvtColor(ycrcb, cv2.COLOR_YCrCb2BGR)
-    img = cv2.normalize(img.astype("float32"), None, 0, 1, cv2.NORM_MINMAX)
-    return img
-
-def preprocess_image(image_data):
-    """Preprocess the image for model prediction"""
-    try:
-        print("Starting image preprocessing...")
-        
-        # Decode base64 image
-        image_bytes = base64.b64decode(image_data)
-        print(f"Decoded image bytes: {len(image_bytes)} bytes")
-        
-        # Convert to numpy array
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if img is None:
-            raise ValueError("Could not decode image")
+
+def collect_cascade_metrics():
+    """Images answered by each cascade stage"""
+    if cascade_stage is None:
+        return []
+    cascade = cascade_stage.stats()
+    return [
+        ('plant_cascade_images_total', 'counter', 'Images answered by each stage of the inference cascade',
+         [({'stage': 'first'}, cascade['first_stage']), ({'stage': 'full'}, cascade['full_pipeline'])]),
+        ('plant_cascade_threshold', 'gauge', 'Confidence the cascade first stage needs to answer',
+         [({}, cascade['threshold'])])
+    ]
+
+def collect_quality_metrics():
+    """Quality gate rejections and the model time they saved"""
+    if quality_gate is None:
+        return []
+    quality = quality_gate.stats()
+    return [
+        ('plant_quality_checks_total', 'counter', 'Images measured by the quality gate',
+         [({}, quality['checked'])]),
+        ('plant_quality_rejections_total', 'counter', 'Images failing each quality check',
+         [({'reason': reason}, quality['rejected_by_reason'][reason]) for reason in REASONS]),
+        ('plant_quality_gate_seconds_total', 'counter', 'Time spent in the quality gate',
+         [({}, quality['gate_seconds'])]),
+        ('plant_quality_saved_seconds_total', 'counter',
+         'Estimated model time saved by not scoring rejected images', [({}, quality['saved_seconds'])])
+    ]
+
+def collect_index_metrics():
+    """Entries held by the embedding index, per source"""
+    if embedding_index is None:
+        return []
+    entries = embedding_index.stats()['entries']
+    return [('plant_index_entries', 'gauge', 'Embeddings held by the nearest-neighbour index',
+             [({'source': source}, count) for source, count in entries.items()])]
+
+def collect_secondary_metrics():
+    """Latency, skip and agreement counters of the secondary classifiers"""
+    if secondary_scorer is None:
+        return []
+    models = secondary_scorer.stats()['models']
+    return [
+        ('plant_secondary_batches_total', 'counter', 'Batches scored by each secondary classifier',
+         [({'model': name}, m['batches']) for name, m in models.items()]),
+        ('plant_secondary_latency_ms', 'gauge', 'Mean batch latency of each secondary classifier',
+         [({'model': name}, m['avg_ms']) for name, m in models.items()]),
+        ('plant_secondary_skipped_total', 'counter', 'Batches a secondary classifier was skipped for',
+         [({'model': name, 'reason': reason}, m[f'skipped_{reason}'])
+          for name, m in models.items() for reason in ('busy', 'timeout')]),
+        ('plant_shadow_comparisons_total', 'counter', 'Shadow predictions compared with the primary',
+         [({'model': name, 'result': result}, m[key]) for name, m in models.items()
+          for result, key in (('agree', 'agreements'), ('disagree', 'disagreements'))]),
+        ('plant_shadow_dropped_total', 'counter', 'Batches not shadow scored because the backlog was full',
+         [({}, secondary_scorer.shadow_dropped)])
+    ]
+
+metrics.add_collector(collect_runtime_metrics)
+
+def warm_up():
+    """Run one inference so graph tracing and allocations happen before traffic"""
+    predict_batch([(np.zeros(IMAGE_SIZE + (3,), dtype=np.float32), model_router.active)])
+
+def load_version(version):
+    """Load one registry version's classifier, checking it fits the running extractor"""
+    manifest = model_registry.manifest(version)
+    check_compatible(manifest, DISEASE_CLASSES, IMAGE_SIZE, FEATURE_DIM)
+    version_dir = model_registry.version_dir(version)
+    path = os.path.join(version_dir, manifest['classifier'])
+    
+    rss_before = process_rss_bytes()
+    classifier = load_classifier(path, os.path.join(version_dir, 'forest'))
+    if classifier is None:
+        raise RegistryError(f"Classifier of version {version} could not be loaded")
+    # One pass over dummy features so the first real request is not slower
+    classify(classifier, np.zeros((1, FEATURE_DIM), dtype=np.float32))
+    rss_after = process_rss_bytes()
+    rss_delta = rss_after - rss_before if rss_before is not None and rss_after is not None else None
+    
+    loaded = LoadedModel(version, classifier, manifest, cache_namespace(version), path, rss_delta)
+    log.info("Loaded model version %s: %.1f MB estimated, RSS %+.1f MB", version,
+             loaded.nbytes / 1e6, (rss_delta or 0) / 1e6)
+    return loaded
+
+def reload_models():
+    """Serve the versions named in the registry's routing.json.
+
+    Versions already resident are reused. The router is only swapped once
+    every new classifier has loaded, so a bad version leaves the current
+    ones serving. Returns the router stats.
+    """
+    global registry_mtime
+    
+    with registry_lock:
+        mtime = model_registry.routing_mtime()
+        routing = model_registry.routing()
+        if routing['active'] is None:
+            raise RegistryError(f"No active version in the registry at {REGISTRY_DIR}")
         
-        print(f"Original image shape: {img.shape}")
+        resident = {m.version: m for m in model_router.loaded().values()}
+        loaded = {}
+        for role in ('active', 'candidate'):
+            version = routing[role]
+            if version is not None and version not in loaded:
+                loaded[version] = resident.get(version) or load_version(version)
         
-        # Apply the same preprocessing as training
-        img = basic_preprocessing(img)
-        print(f"After basic preprocessing: {img.shape}")
+        candidate = loaded[routing['candidate']] if routing['candidate'] is not None else None
+        model_router.swap(loaded[routing['active']], candidate, routing['candidate_fraction'])
+        registry_mtime = mtime
+        stats = model_router.stats()
+        log.info("Serving version %s, candidate %s at %.0f%%, resident classifiers %.1f MB",
+                 routing['active'], routing['candidate'], routing['candidate_fraction'] * 100,
+                 stats['resident_memory_bytes'] / 1e6)
+        return stats
+
+def watch_registry():
+    """Reload the models whenever the registry's routing.json changes"""
+    while True:
+        time.sleep(REGISTRY_POLL_SECONDS)
+        if model_registry.routing_mtime() == registry_mtime:
+            continue
+        try:
+            reload_models()
+        except Exception as e:
+            log.error("Registry reload failed, keeping the current models: %s", e)
+
+def load_secondary_models():
+    """Build the SecondaryScorer for SCORING_MODE from SECONDARY_MODELS, or return None"""
+    if SCORING_MODE == 'single' or not SECONDARY_MODELS:
+        return None
+    models = []
+    for name, path, weight, budget_ms in parse_model_specs(SECONDARY_MODELS):
+        classifier = load_pickled_classifier(path)
+        if classifier is None:
+            log.error("Secondary model %s could not be loaded, skipping it", path)
+            continue
+        n_features = getattr(classifier, 'n_features_in_', FEATURE_DIM)
+        if n_features != FEATURE_DIM:
+            log.error("Secondary model %s expects %d features, skipping it", path, n_features)
+            continue
+        models.append(SecondaryModel(name, classifier, weight, budget_ms))
+        # One pass over dummy features so the first real batch is not slower
+        class_probabilities(classifier, np.zeros((1, FEATURE_DIM), dtype=np.float32))
+    if not models:
+        return None
+    log.info("Secondary models in %s mode: %s", SCORING_MODE, ', '.join(m.name for m in models))
+    return SecondaryScorer(models, SCORING_MODE, PRIMARY_WEIGHT, SHADOW_MAX_PENDING)
+
+def load_embedding_index():
+    """Open the index at EMBEDDING_INDEX_DIR, or return None"""
+    if not EMBEDDING_INDEX_DIR:
+        return None
+    try:
+        index = EmbeddingIndex(EMBEDDING_INDEX_DIR, n_probe=INDEX_N_PROBE)
+        log.info("Embedding index loaded: %s", index.stats())
+        return index
+    except Exception as e:
+        log.error("Embedding index at %s could not be loaded: %s", EMBEDDING_INDEX_DIR, e)
+        return None
+
+def describe_neighbour(similarity, entry):
+    label, source, ref = entry
+    return {
+        'disease': DISEASE_CLASSES[label],
+        'source': source,
+        'ref': os.path.basename(ref) if source == 'train' else ref[:12],
+        'similarity': round(similarity, 4)
+    }
+
+def find_duplicates(features):
+    """Return the (similarity, entry id, label) of a near duplicate per feature row, or None.
+
+    A near duplicate is the most similar indexed submission or training
+    image, if it is within DUPLICATE_THRESHOLD.
+    """
+    index = embedding_index
+    nearest = [max(submission + train, default=None) for submission, train in zip(
+        index.search(features, 1, sources=('submission',)), index.search(features, 1, sources=('train',))
+    )]
+    nearest = [hit if hit is not None and hit[0] >= DUPLICATE_THRESHOLD else None for hit in nearest]
+    entries = index.entries([hit[1] for hit in nearest if hit is not None])
+    return [(hit[0], hit[1], entries[hit[1]][0]) if hit is not None and hit[1] in entries else None
+            for hit in nearest]
+
+def add_neighbours(response, prediction, features, digest, insert=True):
+    """Add similar training images and near-duplicate information to a response.
+
+    The image is queued for insertion into the index unless it is a near
+    duplicate or `insert` is False (cache hits were inserted when first
+    scored).
+    """
+    index = embedding_index
+    query = features[np.newaxis]
+    evidence = index.search(query, EVIDENCE_K, sources=('train',))[0] if EVIDENCE_K > 0 else []
+    best = index.search(query, 1, sources=('submission',))[0] + evidence[:1]
+    best = max(best, default=None)
+    duplicate = best if best is not None and best[0] >= DUPLICATE_THRESHOLD else None
+    
+    entries = index.entries([i for _, i in evidence + ([duplicate] if duplicate else [])])
+    response = dict(response, similar_examples=[
+        describe_neighbour(similarity, entries[i]) for similarity, i in evidence if i in entries
+    ])
+    if duplicate is not None and duplicate[1] in entries:
+        near = describe_neighbour(duplicate[0], entries[duplicate[1]])
+        NEAR_DUPLICATES.inc(source=near['source'])
+        response['near_duplicate'] = near
+    elif INDEX_SUBMISSIONS and insert:
+        index_writer.submit(index.add, query, [prediction], 'submission', [digest])
+    return response
+
+def cached_response(cached, digest):
+    """Response for a cache hit, with neighbours from the index as it is now.
+
+    Cached responses never hold neighbours; first-stage answers have no
+    features to look them up with.
+    """
+    if embedding_index is None or not len(cached.features):
+        return cached.response
+    prediction = DISEASE_CLASSES.index(cached.response['disease'])
+    return add_neighbours(cached.response, prediction, cached.features, digest, insert=False)
+
+def result_namespace(loaded):
+    """Cache namespace of responses produced by a model version in the current scoring and gate modes"""
+    namespace = loaded.cache_namespace
+    if secondary_scorer is not None and secondary_scorer.mode == 'ensemble':
+        members = ','.join(f"{m.name}:{m.weight:g}" for m in secondary_scorer.models)
+        namespace = f"{namespace}-ensemble{PRIMARY_WEIGHT:g}:{members}"
+    if cascade_stage is not None:
+        namespace = f"{namespace}-cascade{cascade_stage.version}@{cascade_stage.threshold:g}"
+    if quality_gate is not None:
+        g = quality_gate
+        thresholds = (f"{g.min_sharpness:g},{g.min_brightness:g},{g.max_brightness:g},{g.max_clipped:g},"
+                      f"{g.min_leaf_coverage:g},{g.leaf_hue[0]}-{g.leaf_hue[1]},{g.size}")
+        namespace = f"{namespace}-gate{QUALITY_GATE}:{thresholds}"
+    return namespace
+
+def load_cascade():
+    """Load the cascade first stage at CASCADE_MODEL, or return None"""
+    try:
+        with open(CASCADE_MODEL, 'rb') as f:
+            version = hashlib.sha256(f.read()).hexdigest()[:12]
+        stage = CascadeStage(joblib.load(CASCADE_MODEL), version, float(CASCADE_THRESHOLD) if CASCADE_THRESHOLD else None)
+        log.info("Cascade first stage %s loaded, threshold %.4f", version, stage.threshold)
+        return stage
+    except Exception as e:
+        log.error("Cascade model at %s could not be loaded, serving the full pipeline only: %s", CASCADE_MODEL, e)
+        return None
+
+def first_stage_response(decision, loaded):
+    """Response for an image the cascade first stage answered"""
+    prediction, confidence = decision
+    PREDICTIONS.inc(disease=DISEASE_CLASSES[prediction])
+    return dict(build_response(prediction, confidence), model_version=loaded.version, stage='first',
+                cascade_version=cascade_stage.version)
+
+def load_models():
+    """Load both models and warm them up, recording how long each phase takes"""
+    global feature_model, secondary_scorer, embedding_index, cascade_stage, ready
+    
+    try:
+        start = time.perf_counter()
+        if model_registry is not None and model_registry.routing()['active'] is not None:
+            reload_models()
+        else:
+            classifier = load_classifier()
+            if classifier is not None:
+                model_router.swap(LoadedModel(MODEL_VERSION, classifier, model_config, CACHE_NAMESPACE, MODEL_PATH))
+        startup_timings['load_classifier'] = time.perf_counter() - start
         
-        # Prepare for MobileNetV2
-        img = cv2.resize(img, IMAGE_SIZE)
-        img = keras_image.img_to_array(img)
-        img = np.expand_dims(img, axis=0)
-        img = preprocess_input(img)
-        print(f"After MobileNetV2 preprocessing: {img.shape}")
+        if SCORING_MODE != 'single':
+            start = time.perf_counter()
+            secondary_scorer = load_secondary_models()
+            startup_timings['load_secondary_models'] = time.perf_counter() - start
         
-        # Extract features using MobileNetV2
-        features = feature_model.predict(img, verbose=0).flatten()
-        print(f"Extracted features shape: {features.shape}")
+        if CASCADE_MODEL:
+            start = time.perf_counter()
+            cascade_stage = load_cascade()
+            startup_timings['load_cascade'] = time.perf_counter() - start
         
-        # Reshape for the Random Forest model
-        features = features.reshape(1, -1)
-        print(f"Final features shape: {features.shape}")
+        if EMBEDDING_INDEX_DIR:
+            start = time.perf_counter()
+            embedding_index = load_embedding_index()
+            startup_timings['load_embedding_index'] = time.perf_counter() - start
         
-        return features
+        start = time.perf_counter()
+        feature_model = load_feature_model()
+        startup_timings['load_feature_model'] = time.perf_counter() - start
         
+        if model_router.active is not None and feature_model is not None:
+            start = time.perf_counter()
+            warm_up()
+            startup_timings['warm_up'] = time.perf_counter() - start
+            ready = True
     except Exception as e:
-        print(f"Error in preprocessing: {str(e)}")
-        traceback.print_exc()
-        raise
+        log.exception("ERROR during startup: %s", e)
+    finally:
+        startup_timings['total'] = sum(startup_timings.values())
+        log.info("Startup timings: %s", startup_timings)
+        startup_done.set()
+    
+    if model_registry is not None and REGISTRY_POLL_SECONDS > 0:
+        threading.Thread(target=watch_registry, name='registry-watcher', daemon=True).start()
+
+def wait_until_ready(timeout=None):
+    """Block until startup has finished; returns whether the models are ready"""
+    startup_done.wait(timeout)
+    return ready
+
+if STARTUP_BACKGROUND:
+    threading.Thread(target=load_models, name='model-loader', daemon=True).start()
+else:
+    load_models()
+
+def record_stage(timings, stage, stage_start):
+    """Store the time since stage_start under `stage` and return the current time"""
+    now = time.perf_counter()
+    timings[stage] = now - stage_start
+    return now
+
+def observe_stages(timings):
+    """Record the per-request stages of a /predict call in STAGE_SECONDS"""
+    for stage, seconds in timings.items():
+        # Model stages are observed per batch in predict_batch
+        if stage not in ('mobilenet', 'classifier', 'batch_size'):
+            STAGE_SECONDS.observe(seconds, stage=stage)
+
+def error_response(endpoint, error, message, status):
+    """Count a failed request under its error class and build the JSON error response"""
+    ERRORS.inc(endpoint=endpoint, error=error)
+    return jsonify({'error': message, 'success': False}), status
+
+def with_timings(response, timings):
+    """Add per-stage timings in milliseconds to the response if the client asked for them"""
+    if request.headers.get('X-Timings') != '1':
+        return response
+    timings_ms = {k: (v if k == 'batch_size' else v * 1000) for k, v in timings.items()}
+    return dict(response, timings_ms=timings_ms)
+
+@app.before_request
+def start_request_timer():
+    request.environ['app.start_time'] = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    """Count every request and time it; streamed responses are timed up to the first byte"""
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    start = request.environ.get('app.start_time')
+    if start is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+    REQUESTS.inc(endpoint=endpoint, status=str(response.status_code))
+    return response
 
 @app.route('/predict', methods=['POST'])
 def predict():
     try:
-        print("\n=== New prediction request ===")
+        log.debug("=== New prediction request ===")
         
-        if model is None:
-            print("ERROR: Model is not loaded")
-            return jsonify({'error': 'Model not loaded', 'success': False}), 500
+        if not startup_done.is_set():
+            ERRORS.inc(endpoint='/predict', error='not_ready')
+            return jsonify({'error': 'Models are still loading', 'success': False}), 503, {'Retry-After': '5'}
+        
+        if model_router.active is None:
+            log.error("Model is not loaded")
+            return error_response('/predict', 'model_not_loaded', 'Model not loaded', 500)
         
         if feature_model is None:
-            print("ERROR: Feature model is not loaded")
-            return jsonify({'error': 'Feature model not loaded', 'success': False}), 500
+            log.error("Feature model is not loaded")
+            return error_response('/predict', 'model_not_loaded', 'Feature model not loaded', 500)
+        
+        # A request whose client deadline has already passed is dropped unread
+        try:
+            deadline = parse_deadline(request.headers.get(DEADLINE_HEADER), DEFAULT_DEADLINE_MS)
+        except ValueError:
+            return error_response('/predict', 'invalid_deadline',
+                                  f"{DEADLINE_HEADER} must be a number of milliseconds", 400)
+        admission.check(deadline, 'arrival')
+        
+        # The body is base64 JSON, about 4/3 of the image size; refuse it unread if too large
+        if request.content_length is not None and request.content_length > MAX_UPLOAD_BYTES * 4 // 3 + 1024:
+            return error_response('/predict', 'ImageTooLarge', f"Image is larger than {MAX_UPLOAD_BYTES} bytes", 413)
             
         data = request.get_json()
         
         if 'image' not in data:
-            return jsonify({'error': 'No image data provided', 'success': False}), 400
+            return error_response('/predict', 'missing_image', 'No image data provided', 400)
         
-        print("Image data received")
+        log.debug("Image data received")
         
-        # Preprocess the image
-        features = preprocess_image(data['image'])
-        print("Image preprocessing completed")
+        # Per-stage timings in seconds, returned when the client sends X-Timings: 1
+        timings = {}
+        stage_start = time.perf_counter()
         
-        # Make prediction
-        prediction = model.predict(features)[0]
-        print(f"Prediction: {prediction}")
+        # Decode base64 image
+        image_bytes = decode_base64_image(data['image'])
+        log.debug("Decoded image bytes: %d bytes", len(image_bytes))
+        REQUEST_BYTES.observe(len(image_bytes), endpoint='/predict')
+        stage_start = record_stage(timings, 'base64_decode', stage_start)
+        
+        # Pick the model version, then return the cached result if this
+        # exact image was already scored by it
+        digest = image_digest(image_bytes)
+        loaded, role = model_router.route(digest)
+        cache_key = make_key(image_bytes, result_namespace(loaded), digest)
+        cached = prediction_cache.get(cache_key)
+        if cached is not None:
+            log.debug("Cache hit, sending cached response")
+            record_stage(timings, 'cache_lookup', stage_start)
+            observe_stages(timings)
+            PREDICTIONS.inc(disease=cached.response['disease'])
+            return jsonify(with_timings(cached_response(cached, digest), timings))
+        stage_start = record_stage(timings, 'cache_lookup', stage_start)
         
-        # Get prediction probabilities if available
+        # Requests that missed the cache wait here for a model slot or are shed
+        with admission.slot(deadline):
+            stage_start = record_stage(timings, 'admission', stage_start)
+            
+            # Preprocess the image
+            img = decode_image(image_bytes)
+            stage_start = record_stage(timings, 'imdecode', stage_start)
+            quality = None
+            if quality_gate is not None:
+                quality = quality_gate.check(img)
+                stage_start = record_stage(timings, 'quality_gate', stage_start)
+                if QUALITY_GATE == 'reject' and not quality.ok:
+                    log.debug("Quality gate rejected the image: %s", quality.reasons)
+                    observe_stages(timings)
+                    ERRORS.inc(endpoint='/predict', error='retake')
+                    return jsonify(with_timings(quality_gate.retake_response(quality), timings))
+            if cascade_stage is not None:
+                decision = cascade_stage.decide(img)
+                stage_start = record_stage(timings, 'cascade', stage_start)
+                if decision is not None:
+                    response = first_stage_response(decision, loaded)
+                    if quality is not None:
+                        response['quality'] = quality.describe()
+                    observe_stages(timings)
+                    prediction_cache.put(cache_key, np.empty(0, dtype=np.float32), response)
+                    return jsonify(with_timings(response, timings))
+            img = preprocess_image(img)
+            log.debug("Image preprocessing completed")
+            stage_start = record_stage(timings, 'preprocess', stage_start)
+            
+            # Make prediction (batched with any concurrent requests)
+            prediction, confidence, features, duplicate, batch_timings = \
+                batch_scheduler.submit((img, loaded), deadline).result()
+            log.debug("Prediction: %s, confidence: %.1f%%", prediction, confidence)
+            timings['mobilenet'] = batch_timings['mobilenet']
+            timings['classifier'] = batch_timings['classifier']
+            timings['batch_size'] = batch_timings['batch_size']
+            stage_start = record_stage(timings, 'queue_and_models', stage_start)
+            
+            response = dict(build_response(prediction, confidence), model_version=loaded.version)
+            if cascade_stage is not None:
+                response['stage'] = 'full'
+            if quality is not None:
+                response['quality'] = quality.describe()
+            # Neighbours depend on the index at the time of the request, so
+            # only the model's answer is cached; answers taken from a near
+            # duplicate are not cached at all
+            if duplicate is None:
+                prediction_cache.put(cache_key, features, response)
+            if embedding_index is not None:
+                response = add_neighbours(response, prediction, features, digest)
+                record_stage(timings, 'neighbours', stage_start)
+            
+            observe_stages(timings)
+            
+            log.debug("Disease: %s", response['disease'])
+            PREDICTIONS.inc(disease=response['disease'])
+            VERSION_PREDICTIONS.inc(version=loaded.version, role=role)
+            
+            log.debug("Sending successful response")
+            return jsonify(with_timings(response, timings))
+    
+    except (ImageTooLarge, RequestEntityTooLarge) as e:
+        log.debug("Rejected oversized upload: %s", e)
+        return error_response('/predict', 'ImageTooLarge', str(e), 413)
+    
+    except Overloaded as e:
+        log.debug("Shed request: %s", e)
+        body, status = error_response('/predict', e.reason, str(e), e.status)
+        return body, status, {'Retry-After': str(e.retry_after)}
+    
+    except TimeoutError as e:
+        # DeadlineExceeded from admission control, or an item the batch scheduler dropped
+        log.debug("Dropped expired request: %s", e)
+        return error_response('/predict', 'deadline_exceeded', str(e), 504)
+    
+    except Exception as e:
+        log.exception("ERROR in prediction: %s", e)
+        return error_response('/predict', type(e).__name__, str(e), 500)
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch_endpoint():
+    """Score many images uploaded as multipart parts.
+
+    Every file part of the request is treated as one image. Results are
+    streamed back as NDJSON, one line per image in upload order, each tagged
+    with its `index` and `filename`. Images are decoded and scored in chunks
+    of BATCH_MAX_SIZE so only one chunk of decoded tensors is held at a time.
+    The request holds one admission slot until its last line is sent, and
+    images still unscored when its deadline passes are answered with
+    `deadline_exceeded`.
+    """
+    log.debug("=== New batch prediction request ===")
+    
+    if not startup_done.is_set():
+        ERRORS.inc(endpoint='/predict/batch', error='not_ready')
+        return jsonify({'error': 'Models are still loading', 'success': False}), 503, {'Retry-After': '5'}
+    
+    if model_router.active is None:
+        return error_response('/predict/batch', 'model_not_loaded', 'Model not loaded', 500)
+    
+    if feature_model is None:
+        return error_response('/predict/batch', 'model_not_loaded', 'Feature model not loaded', 500)
+    
+    try:
+        deadline = parse_deadline(request.headers.get(DEADLINE_HEADER), DEFAULT_DEADLINE_MS)
+    except ValueError:
+        return error_response('/predict/batch', 'invalid_deadline',
+                              f"{DEADLINE_HEADER} must be a number of milliseconds", 400)
+    
+    uploads = [f for _, f in request.files.items(multi=True)]
+    if not uploads:
+        return error_response('/predict/batch', 'missing_image', 'No image files provided', 400)
+    
+    # A whole batch waits for one model slot or is shed, like a /predict request
+    try:
+        admission.acquire(deadline)
+    except Overloaded as e:
+        log.debug("Shed batch request: %s", e)
+        body, status = error_response('/predict/batch', e.reason, str(e), e.status)
+        return body, status, {'Retry-After': str(e.retry_after)}
+    except TimeoutError as e:
+        log.debug("Dropped expired batch request: %s", e)
+        return error_response('/predict/batch', 'deadline_exceeded', str(e), 504)
+    admitted_at = time.perf_counter()
+    # Released when the stream ends or the response is closed, whichever
+    # comes first; a response closed before it was iterated never runs the
+    # generator's finally block
+    held = [True]
+    
+    def release_slot():
         try:
-            probabilities = model.predict_proba(features)[0]
-            confidence = float(probabilities[prediction]) * 100
-            print(f"Confidence: {confidence}%")
+            held.pop()
+        except IndexError:
+            return
+        admission.release(time.perf_counter() - admitted_at)
+    
+    log.debug("Batch of %d images received", len(uploads))
+    
+    # The uploaded files are closed once this view returns, before the
+    # streamed response is generated, so every upload is read here and the
+    # generator only works on these bytes (or the error reading them)
+    files = []
+    for upload in uploads:
+        try:
+            files.append((upload.filename, upload.read(), None))
         except Exception as e:
-            print(f"Could not get probabilities: {e}")
-            confidence = 85.0
-        
-        # Get disease name
-        disease_name = DISEASE_CLASSES[prediction]
-        print(f"Disease: {disease_name}")
-        
-        # Prepare response
-        response = {
-            'success': True,
-            'disease': disease_name,
-            'confidence': f'{confidence:.1f}%',
-            'health_score': HEALTH_SCORES.get(disease_name, 50.0),
-            'recommendations': RECOMMENDATIONS.get(disease_name, []),
-            'model_type': 'Random Forest with MobileNetV2 Features'
-        }
-        
-        print("Sending successful response")
-        return jsonify(response)
+            files.append((upload.filename, None, e))
+        finally:
+            upload.close()
     
-    except Exception as e:
-        print(f"ERROR in prediction: {str(e)}")
-        traceback.print_exc()
-        return jsonify({'error': str(e), 'success': False}), 500
+    def generate():
+        try:
+            yield from generate_chunks()
+        finally:
+            release_slot()
+    
+    def generate_chunks():
+        for start in range(0, len(files), BATCH_MAX_SIZE):
+            chunk = files[start:start + BATCH_MAX_SIZE]
+            try:
+                admission.check(deadline, 'batch')
+            except TimeoutError as e:
+                # Nothing is left to wait for: answer the remaining images unscored
+                for index in range(start, len(files)):
+                    ERRORS.inc(endpoint='/predict/batch', error='deadline_exceeded')
+                    yield json.dumps({'index': index, 'filename': files[index][0], 'success': False,
+                                      'error': str(e)}) + '\n'
+                return
+            pending = []
+            
+            decoded = []
+            
+            # Hash this chunk, answering bad uploads right away
+            uploaded = []
+            first_stage = []
+            for offset, (filename, image_bytes, read_error) in enumerate(chunk):
+                result = {'index': start + offset, 'filename': filename}
+                try:
+                    if read_error is not None:
+                        raise read_error
+                    REQUEST_BYTES.observe(len(image_bytes), endpoint='/predict/batch')
+                    digest = image_digest(image_bytes)
+                    loaded, role = model_router.route(digest)
+                    cache_key = make_key(image_bytes, result_namespace(loaded), digest)
+                    uploaded.append((result, (cache_key, loaded, role, digest), image_bytes))
+                    continue
+                except Exception as e:
+                    ERRORS.inc(endpoint='/predict/batch', error=type(e).__name__)
+                    result.update({'success': False, 'error': str(e)})
+                pending.append((result, None, None))
+            
+            # Look the whole chunk up in the cache at once, then decode the misses
+            cached_entries = prediction_cache.get_many([route[0] for _, route, _ in uploaded])
+            for (result, route, image_bytes), cached in zip(uploaded, cached_entries):
+                try:
+                    if cached is not None:
+                        result.update(cached_response(cached, route[3]))
+                        PREDICTIONS.inc(disease=cached.response['disease'])
+                    else:
+                        decode_start = time.perf_counter()
+                        img = decode_image(image_bytes)
+                        STAGE_SECONDS.observe(time.perf_counter() - decode_start, stage='imdecode')
+                        if quality_gate is not None:
+                            quality = quality_gate.check(img)
+                            STAGE_SECONDS.observe(quality.seconds, stage='quality_gate')
+                            if QUALITY_GATE == 'reject' and not quality.ok:
+                                ERRORS.inc(endpoint='/predict/batch', error='retake')
+                                result.update(quality_gate.retake_response(quality))
+                                pending.append((result, None, None))
+                                continue
+                            result['quality'] = quality.describe()
+                        if cascade_stage is not None:
+                            cascade_start = time.perf_counter()
+                            decision = cascade_stage.decide(img)
+                            STAGE_SECONDS.observe(time.perf_counter() - cascade_start, stage='cascade')
+                            if decision is not None:
+                                response = first_stage_response(decision, route[1])
+                                first_stage.append((route[0], np.empty(0, dtype=np.float32), response))
+                                result.update(response)
+                                pending.append((result, None, None))
+                                continue
+                        decoded.append((result, route, img))
+                        continue
+                except Exception as e:
+                    ERRORS.inc(endpoint='/predict/batch', error=type(e).__name__)
+                    result.update({'success': False, 'error': str(e)})
+                pending.append((result, None, None))
+            
+            # Preprocess the rest as one batch and queue it for the models
+            if decoded:
+                preprocess_start = time.perf_counter()
+                inputs = preprocess_batch([img for _, _, img in decoded])
+                STAGE_SECONDS.observe(time.perf_counter() - preprocess_start, stage='preprocess_batch')
+                for (result, route, _), img in zip(decoded, inputs):
+                    pending.append((result, route, batch_scheduler.submit((img, route[1]), deadline)))
+            pending.sort(key=lambda item: item[0]['index'])
+            
+            # Wait for the models, then store the chunk's new results in one cache call
+            scored = []
+            for result, route, future in pending:
+                if future is not None:
+                    try:
+                        cache_key, loaded, role, digest = route
+                        prediction, confidence, features, duplicate, _ = future.result()
+                        response = dict(build_response(prediction, confidence), model_version=loaded.version)
+                        if cascade_stage is not None:
+                            response['stage'] = 'full'
+                        if duplicate is None:
+                            scored.append((cache_key, features, response))
+                        if embedding_index is not None:
+                            response = add_neighbours(response, prediction, features, digest)
+                        PREDICTIONS.inc(disease=response['disease'])
+                        VERSION_PREDICTIONS.inc(version=loaded.version, role=role)
+                        result.update(response)
+                    except Exception as e:
+                        log.error("ERROR in batch prediction: %s", e)
+                        ERRORS.inc(endpoint='/predict/batch', error=type(e).__name__)
+                        result.update({'success': False, 'error': str(e)})
+            prediction_cache.put_many(first_stage + scored)
+            
+            for result, _, _ in pending:
+                yield json.dumps(result) + '\n'
+    
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.call_on_close(release_slot)
+    return response
+
+@app.route('/health/live', methods=['GET'])
+def liveness():
+    """Liveness probe: the process is up and serving HTTP"""
+    return jsonify({'status': 'alive'})
+
+@app.route('/health/ready', methods=['GET'])
+def readiness():
+    """Readiness probe: both models are loaded and warmed up"""
+    body = {
+        'ready': ready,
+        'startup_complete': startup_done.is_set(),
+        'startup_timings': startup_timings
+    }
+    return jsonify(body), 200 if ready else 503
 
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({
-        'status': 'healthy', 
-        'model_loaded': model is not None,
+        'status': 'healthy' if ready else ('starting' if not startup_done.is_set() else 'unhealthy'),
+        'ready': ready,
+        'startup_timings': startup_timings,
+        'model_loaded': model_router.active is not None,
         'feature_model_loaded': feature_model is not None,
-        'model_path': MODEL_PATH,
-        'feature_extractor': 'MobileNetV2'
+        'model_path': model_router.active.path if model_router.active is not None else MODEL_PATH,
+        'feature_extractor': 'MobileNetV2',
+        'feature_backend': FEATURE_BACKEND,
+        'classifier_engine': CLASSIFIER_ENGINE,
+        'model_version': model_router.active.version if model_router.active is not None else MODEL_VERSION,
+        'models': model_router.stats(),
+        'secondary_models': secondary_scorer.stats() if secondary_scorer is not None else None,
+        'embedding_index': embedding_index.stats() if embedding_index is not None else None,
+        'batching': batch_scheduler.stats(),
+        'admission': admission.stats(),
+        'cache': prediction_cache.stats(),
+        'quality_gate': dict(quality_gate.stats(), mode=QUALITY_GATE) if quality_gate is not None else None,
+        'cascade': cascade_stage.stats() if cascade_stage is not None else None
     })
 
+@app.route('/models', methods=['GET'])
+def models():
+    """Resident classifiers, their memory cost and the versions published in the registry"""
+    body = {'registry_dir': REGISTRY_DIR or None, 'serving': model_router.stats()}
+    if model_registry is not None:
+        body['routing'] = model_registry.routing()
+        body['versions'] = model_registry.versions()
+    return jsonify(body)
+
+@app.route('/models/reload', methods=['POST'])
+def models_reload():
+    """Swap to the versions in the registry's routing.json now instead of at the next poll"""
+    if model_registry is None:
+        return error_response('/models/reload', 'no_registry', 'REGISTRY_DIR is not set', 400)
+    if not startup_done.is_set():
+        return error_response('/models/reload', 'not_ready', 'Models are still loading', 503)
+    try:
+        return jsonify({'success': True, 'serving': reload_models()})
+    except RegistryError as e:
+        return error_response('/models/reload', 'RegistryError', str(e), 409)
+    except Exception as e:
+        log.exception("ERROR reloading models: %s", e)
+        return error_response('/models/reload', type(e).__name__, str(e), 500)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics in the text exposition format"""
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
 @app.route('/test', methods=['GET'])
 def test():
     """Test endpoint to verify server is running"""
     return jsonify({
         'message': 'Money Plant Disease Detection API is running',
-        'endpoints': ['/predict', '/health', '/test'],
+        'endpoints': ['/predict', '/predict/batch', '/health', '/health/live', '/health/ready', '/models',
+                      '/models/reload', '/metrics', '/test'],
         'model_classes': DISEASE_CLASSES,
         'model_type': 'Random Forest with MobileNetV2 feature extraction',
-        'model_loaded': model is not None,
+        'model_loaded': model_router.active is not None,
         'feature_model_loaded': feature_model is not None
     })
 
 if __name__ == '__main__':
     print("Starting Flask server...")
-    print(f"Model loaded: {model is not None}")
-    print(f"Feature model loaded: {feature_model is not None}")
+    if startup_done.is_set():
+        print(f"Model loaded: {model_router.active is not None}")
+        print(f"Feature model loaded: {feature_model is not None}")
+    else:
+        print("Models are loading in the background, see /health/ready")
     app.run(host='192.168.1.4', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,127 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+class BatchScheduler:
+    """Collects concurrent prediction requests and runs them as one batch.
+
+    Requests are queued by `submit`. A single worker thread waits for the
+    first request, keeps collecting until `max_batch_size` requests are
+    queued or `max_wait_ms` has passed, then calls `process_batch` once with
+    the list of queued items. `process_batch` must return one result per
+    item, in order; each result is handed back through the item's Future.
+    """
+
+    def __init__(self, process_batch, max_batch_size=16, max_wait_ms=10.0):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+
+        # Metrics
+        self._batches = 0
+        self._items = 0
+        self._max_queue_depth = 0
+        self._last_batch_size = 0
+        self._batch_size_counts = {}
+        self._expired = 0
+
+    def submit(self, item, deadline=None):
+        """Queue one item and return a Future for its result"""
+        future = Future()
+        with self._cond:
+            self._ensure_started()
+            self._queue.append((item, future, deadline))
+            self._max_queue_depth = max(self._max_queue_depth, len(self._queue))
+            self._cond.notify()
+        return future
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name='batch-scheduler', daemon=True
+            )
+            self._thread.start()
+
+    def _collect(self):
+        """Block until a batch is ready and pop it off the queue"""
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+
+            deadline = time.monotonic() + self.max_wait
+            while len(self._queue) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            size = min(len(self._queue), self.max_batch_size)
+            return [self._queue.popleft() for _ in range(size)]
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            now = time.monotonic()
+            expired = [future for _, future, deadline in batch if deadline is not None and deadline <= now]
+            if expired:
+                self._record_expired(len(expired))
+                for future in expired:
+                    future.set_exception(TimeoutError("Deadline passed while queued for a batch"))
+                batch = [entry for entry in batch if entry[2] is None or entry[2] > now]
+                if not batch:
+                    continue
+            items = [item for item, _, _ in batch]
+            futures = [future for _, future, _ in batch]
+
+            self._record_batch(len(batch))
+
+            try:
+                results = self.process_batch(items)
+                if len(results) != len(items):
+                    raise RuntimeError(
+                        f"process_batch returned {len(results)} results for {len(items)} items"
+                    )
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+    def _record_batch(self, size):
+        with self._cond:
+            self._batches += 1
+            self._items += size
+            self._last_batch_size = size
+            self._batch_size_counts[size] = self._batch_size_counts.get(size, 0) + 1
+
+    def _record_expired(self, count):
+        with self._cond:
+            self._expired += count
+
+    def queue_depth(self):
+        with self._cond:
+            return len(self._queue)
+
+    def stats(self):
+        """Return queue depth and batch size metrics"""
+        with self._cond:
+            return {
+                'queue_depth': len(self._queue),
+                'max_queue_depth': self._max_queue_depth,
+                'batches': self._batches,
+                'items': self._items,
+                'last_batch_size': self._last_batch_size,
+                'avg_batch_size': (self._items / self._batches) if self._batches else 0.0,
+                'batch_size_counts': dict(sorted(self._batch_size_counts.items())),
+                'expired': self._expired,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+            }
@@ -0,0 +1,247 @@
+"""Load test for the /predict endpoint.
+
+Usage:
+    python benchmark_api.py [--concurrency 1,4,16] [--sizes original,2048,1024,512]
+                            [--requests 64] [--output report.json] [--baseline old.json]
+
+Starts app.py in-process (with the prediction cache disabled so every
+request runs the models) and replays the bundled pothos*.jpg images and a
+sample of the MoneyPlant dataset against /predict. Every image size is
+sent at every concurrency level. The report has p50/p95/p99 latency,
+throughput, peak RSS and the mean time spent in each server stage (base64
+decode, image decode, preprocessing, MobileNetV2, Random Forest). Pass
+--url to benchmark a server that is already running instead; peak RSS is
+then not available.
+
+With --baseline, p95 latency and throughput are compared against an
+earlier report and the script exits 1 if any run regressed by more than
+--tolerance.
+"""
+import argparse
+import base64
+import glob
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.join(BASE_DIR, 'Ai Agent Project')
+DATASET_DIR = os.path.join(PROJECT_DIR, 'MoneyPlant', 'MoneyPlant')
+
+STAGES = ('base64_decode', 'cache_lookup', 'admission', 'imdecode', 'quality_gate', 'cascade', 'preprocess', 'mobilenet',
+          'classifier', 'queue_and_models', 'neighbours')
+
+
+def load_images(dataset_images):
+    """Return (name, jpeg bytes) for the sample images and part of the dataset"""
+    paths = sorted(glob.glob(os.path.join(PROJECT_DIR, 'pothos*.jpg')))
+    paths += sorted(glob.glob(os.path.join(DATASET_DIR, '*', '*.jpg')))[:dataset_images]
+    images = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            images.append((os.path.basename(path), f.read()))
+    return images
+
+
+def resize_jpeg(image_bytes, max_side):
+    """Re-encode an image so its longest side is at most max_side pixels"""
+    img = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None or max(img.shape[:2]) <= max_side:
+        return image_bytes
+    scale = max_side / max(img.shape[:2])
+    size = (max(1, round(img.shape[1] * scale)), max(1, round(img.shape[0] * scale)))
+    img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return encoded.tobytes() if ok else image_bytes
+
+
+def start_local_server(port):
+    """Serve app.py from a background thread and return its base URL once models are ready"""
+    # Every request must reach the models, so the cache is off
+    os.environ['CACHE_MAX_ENTRIES'] = '0'
+    os.environ['CACHE_DISK_PATH'] = ''
+    import app as app_module
+    from werkzeug.serving import make_server
+
+    if not app_module.wait_until_ready(timeout=600):
+        raise RuntimeError('Models did not load, see the log above')
+    server = make_server('127.0.0.1', port, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='benchmark-server', daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+def post_predict(url, body):
+    """Send one request; return (latency seconds, server timings or None, error or None)"""
+    req = urllib.request.Request(
+        url + '/predict', data=body,
+        headers={'Content-Type': 'application/json', 'X-Timings': '1'}
+    )
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=120) as resp:
+            result = json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return time.perf_counter() - start, None, f"HTTP {e.code}"
+    except Exception as e:
+        return time.perf_counter() - start, None, str(e)
+    latency = time.perf_counter() - start
+    if not result.get('success'):
+        return latency, None, result.get('error', 'unsuccessful response')
+    return latency, result.get('timings_ms'), None
+
+
+def run_level(url, bodies, concurrency, total):
+    """Send `total` requests with `concurrency` clients and summarise them"""
+    requests_to_send = [bodies[i % len(bodies)] for i in range(total)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda body: post_predict(url, body), requests_to_send))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([r[0] for r in results if r[2] is None]) * 1000
+    errors = [r[2] for r in results if r[2] is not None]
+    stage_ms = {}
+    for stage in STAGES + ('batch_size',):
+        values = [r[1][stage] for r in results if r[1] and stage in r[1]]
+        if values:
+            stage_ms[stage] = float(np.mean(values))
+
+    summary = {
+        'concurrency': concurrency,
+        'requests': total,
+        'errors': len(errors),
+        # Requests refused by admission control (429/503), included in errors
+        'shed': sum(e in ('HTTP 429', 'HTTP 503') for e in errors),
+        'throughput_rps': (total - len(errors)) / elapsed,
+        'stages_ms': stage_ms,
+    }
+    if len(latencies):
+        summary.update({
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+            'mean_ms': float(latencies.mean()),
+        })
+    if errors:
+        summary['first_error'] = errors[0]
+    return summary
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+
+def compare(report, baseline, tolerance):
+    """Return a list of regressions of p95 latency or throughput against a baseline report"""
+    previous = {(r['size'], r['concurrency']): r for r in baseline.get('runs', [])}
+    regressions = []
+    for run in report['runs']:
+        old = previous.get((run['size'], run['concurrency']))
+        if old is None or 'p95_ms' not in run or 'p95_ms' not in old:
+            continue
+        name = f"size={run['size']} concurrency={run['concurrency']}"
+        if run['p95_ms'] > old['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {old['p95_ms']:.1f} -> {run['p95_ms']:.1f} ms")
+        if run['throughput_rps'] < old['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {old['throughput_rps']:.1f} -> {run['throughput_rps']:.1f} req/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='', help='benchmark a running server instead of starting app.py')
+    parser.add_argument('--port', type=int, default=0, help='port for the in-process server (default: any free port)')
+    parser.add_argument('--concurrency', default='1,4,16')
+    parser.add_argument('--sizes', default='original,2048,1024,512',
+                        help="'original' or a maximum image side in pixels")
+    parser.add_argument('--requests', type=int, default=64, help='requests per size and concurrency level')
+    parser.add_argument('--dataset-images', type=int, default=24)
+    parser.add_argument('--warmup', type=int, default=4)
+    parser.add_argument('--output', default='', help='optional path for a JSON report')
+    parser.add_argument('--baseline', default='', help='earlier JSON report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    images = load_images(args.dataset_images)
+    if not images:
+        print("ERROR: no images found")
+        return 1
+    print(f"Loaded {len(images)} images, largest {max(len(b) for _, b in images) / 1e6:.2f} MB")
+
+    server = None
+    url = args.url.rstrip('/')
+    if not url:
+        print("Starting in-process server...")
+        url, server = start_local_server(args.port)
+    print(f"Benchmarking {url}")
+
+    report = {
+        'url': url if args.url else 'in-process',
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'images': [name for name, _ in images],
+        'runs': [],
+    }
+    if server is not None:
+        import app as app_module
+        report['model_version'] = app_module.MODEL_VERSION
+        report['feature_backend'] = app_module.FEATURE_BACKEND
+        report['classifier_engine'] = app_module.CLASSIFIER_ENGINE
+        report['startup_timings'] = dict(app_module.startup_timings)
+
+    try:
+        for size in args.sizes.split(','):
+            size = size.strip()
+            encoded = [b if size == 'original' else resize_jpeg(b, int(size)) for _, b in images]
+            bodies = [json.dumps({'image': base64.b64encode(b).decode('ascii')}).encode() for b in encoded]
+            run_level(url, bodies, 1, args.warmup)
+
+            for concurrency in (int(c) for c in args.concurrency.split(',')):
+                summary = run_level(url, bodies, concurrency, args.requests)
+                summary['size'] = size
+                summary['mean_image_kb'] = float(np.mean([len(b) for b in encoded]) / 1e3)
+                report['runs'].append(summary)
+                print(f"size={size:>8} concurrency={concurrency:>3}: "
+                      f"p50 {summary.get('p50_ms', float('nan')):7.1f} ms  "
+                      f"p95 {summary.get('p95_ms', float('nan')):7.1f} ms  "
+                      f"p99 {summary.get('p99_ms', float('nan')):7.1f} ms  "
+                      f"{summary['throughput_rps']:6.1f} req/s  errors {summary['errors']} (shed {summary['shed']})")
+                if summary['stages_ms']:
+                    print("    stages (ms): " + ", ".join(
+                        f"{k} {v:.1f}" for k, v in summary['stages_ms'].items() if k != 'batch_size'))
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    if server is not None:
+        report['peak_rss_mb'] = peak_rss_mb()
+        print(f"Peak RSS: {report['peak_rss_mb']:.0f} MB")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f"Report saved: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+        print(f"No regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""Benchmark reduced-resolution JPEG decoding against full decoding.
+
+Usage:
+    python benchmark_decode.py [--repeats 10] [--output report.json] [--check-model]
+
+For each bundled pothos*.jpg sample, decodes the image fully (the previous
+path) and with inference.decode_image, which decodes large JPEGs at 1/2,
+1/4 or 1/8 scale, then runs the shared preprocessing on both. Reports
+decode + preprocess latency, the size of the decoded image, the peak
+memory traced while decoding and the largest difference between the two
+MobileNetV2 inputs. With --check-model both inputs are also scored by the
+saved models and the predicted classes compared.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import inference
+from preprocessing import preprocess_image
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.join(BASE_DIR, 'Ai Agent Project')
+
+
+def full_decode(image_bytes):
+    """The decode path used before reduced decoding"""
+    return cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+
+
+def best_time(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def peak_memory(fn):
+    """Peak bytes allocated through Python and NumPy while running fn"""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--output', default='', help='optional path for a JSON report')
+    parser.add_argument('--check-model', action='store_true', help='compare predicted classes with the saved models')
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(PROJECT_DIR, 'pothos*.jpg')))
+    if not paths:
+        print("ERROR: no sample images found")
+        return 1
+
+    models = None
+    if args.check_model:
+        models = (inference.load_classifier(), inference.load_feature_model())
+        if None in models:
+            print("ERROR: models could not be loaded")
+            return 1
+
+    report = {
+        'reduced_decode': inference.REDUCED_DECODE,
+        'decode_min_side': inference.DECODE_MIN_SIDE,
+        'images': []
+    }
+    print(f"{'image':>14} {'bytes':>9} {'scale':>5} {'full ms':>8} {'reduced ms':>10} "
+          f"{'full MB':>8} {'reduced MB':>10} {'max diff':>9}")
+    for path in paths:
+        with open(path, 'rb') as f:
+            image_bytes = f.read()
+        image_format, width, height = inference.read_image_header(image_bytes)
+        scale = inference.decode_scale(image_format, width, height)
+
+        full = full_decode(image_bytes)
+        reduced = inference.decode_image(image_bytes)
+        full_input = preprocess_image(full)
+        reduced_input = preprocess_image(reduced)
+
+        row = {
+            'image': os.path.basename(path),
+            'bytes': len(image_bytes),
+            'size': [width, height],
+            'scale': scale,
+            'full_ms': best_time(lambda: preprocess_image(full_decode(image_bytes)), args.repeats) * 1000,
+            'reduced_ms': best_time(lambda: preprocess_image(inference.decode_image(image_bytes)), args.repeats) * 1000,
+            'full_decoded_mb': full.nbytes / 1e6,
+            'reduced_decoded_mb': reduced.nbytes / 1e6,
+            'full_peak_mb': peak_memory(lambda: full_decode(image_bytes)) / 1e6,
+            'reduced_peak_mb': peak_memory(lambda: inference.decode_image(image_bytes)) / 1e6,
+            'max_input_diff': float(np.max(np.abs(full_input - reduced_input))),
+        }
+        if models is not None:
+            classifier, feature_model = models
+            features = feature_model.predict(np.stack([full_input, reduced_input]))
+            predictions, _ = inference.classify(classifier, features)
+            row['same_class'] = bool(predictions[0] == predictions[1])
+        report['images'].append(row)
+        print(f"{row['image']:>14} {row['bytes']:>9} {scale:>5} {row['full_ms']:>8.1f} {row['reduced_ms']:>10.1f} "
+              f"{row['full_peak_mb']:>8.1f} {row['reduced_peak_mb']:>10.1f} {row['max_input_diff']:>9.3f}")
+
+    rows = report['images']
+    report['total_full_ms'] = sum(r['full_ms'] for r in rows)
+    report['total_reduced_ms'] = sum(r['reduced_ms'] for r in rows)
+    print(f"\nTotal decode + preprocess: full {report['total_full_ms']:.1f} ms, "
+          f"reduced {report['total_reduced_ms']:.1f} ms "
+          f"({report['total_full_ms'] / report['total_reduced_ms']:.1f}x)")
+    if models is not None:
+        report['same_class'] = all(r['same_class'] for r in rows)
+        print(f"Same predicted class for every image: {report['same_class']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f"Report saved: {args.output}")
+    return 0 if report.get('same_class', True) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
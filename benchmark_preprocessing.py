@@ -0,0 +1,115 @@
+"""Benchmark preprocess_batch against the previous per-image preprocessing.
+
+Usage:
+    python benchmark_preprocessing.py [--images 256] [--repeats 5]
+
+Checks that both paths produce identical arrays on the bundled sample
+images and a sample of the MoneyPlant dataset, then reports per-image
+latency and batch throughput.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from preprocessing import IMAGE_SIZE, allocate_batch, basic_preprocessing, preprocess_batch, preprocess_image
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.join(BASE_DIR, 'Ai Agent Project')
+DATASET_DIR = os.path.join(PROJECT_DIR, 'MoneyPlant', 'MoneyPlant')
+
+try:
+    from tensorflow.keras.applications.mobilenet_v2 import preprocess_input
+    from tensorflow.keras.preprocessing.image import img_to_array
+except ImportError:
+    # Same arithmetic as the keras functions, for machines without TensorFlow
+    def preprocess_input(x):
+        x /= 127.5
+        x -= 1.
+        return x
+
+    def img_to_array(img):
+        return np.asarray(img, dtype=np.float32)
+
+
+def legacy_preprocess(img):
+    """The per-image path app.py used before preprocess_batch"""
+    img = basic_preprocessing(img)
+    img = cv2.resize(img, IMAGE_SIZE)
+    img = img_to_array(img)
+    img = np.expand_dims(img, axis=0)
+    img = preprocess_input(img)
+    return img[0]
+
+
+def load_images(count):
+    paths = sorted(glob.glob(os.path.join(PROJECT_DIR, 'pothos*.jpg')))
+    paths += sorted(glob.glob(os.path.join(DATASET_DIR, '*', '*.jpg')))[:max(0, count - len(paths))]
+    images = [cv2.imread(p) for p in paths]
+    return [img for img in images if img is not None]
+
+
+def best_time(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=256)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--output', default='', help='optional path for a JSON report')
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+    if not images:
+        print("ERROR: no images found")
+        return 1
+    print(f"Loaded {len(images)} images")
+
+    # Both paths must agree exactly, or the saved Random Forest is no longer valid
+    legacy = np.stack([legacy_preprocess(img) for img in images])
+    batched = preprocess_batch(images)
+    identical = bool(np.array_equal(legacy, batched))
+    print(f"Identical output: {identical}")
+    if not identical:
+        print(f"Max abs difference: {np.max(np.abs(legacy - batched))}")
+
+    report = {'images': len(images), 'identical': identical, 'per_image_ms': {}, 'throughput': {}}
+
+    legacy_time = best_time(lambda: [legacy_preprocess(img) for img in images], args.repeats)
+    single_time = best_time(lambda: [preprocess_image(img) for img in images], args.repeats)
+    report['per_image_ms']['legacy'] = legacy_time / len(images) * 1000
+    report['per_image_ms']['preprocess_image'] = single_time / len(images) * 1000
+    report['throughput']['legacy'] = len(images) / legacy_time
+
+    for batch_size in (1, 8, 32, 64):
+        chunks = [images[i:i + batch_size] for i in range(0, len(images), batch_size)]
+        buffers = {len(c): allocate_batch(len(c)) for c in chunks}
+        elapsed = best_time(lambda: [preprocess_batch(c, out=buffers[len(c)]) for c in chunks], args.repeats)
+        report['throughput'][f'batch_{batch_size}'] = len(images) / elapsed
+
+    print(f"\nPer-image latency (ms): legacy {report['per_image_ms']['legacy']:.3f}, "
+          f"preprocess_image {report['per_image_ms']['preprocess_image']:.3f}")
+    print("Throughput (images/s):")
+    for name, value in report['throughput'].items():
+        print(f"  {name:>10}: {value:8.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f"Report saved: {args.output}")
+    return 0 if identical else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,237 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def image_digest(image_bytes):
+    """Hex SHA-256 of an uploaded image"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def make_key(image_bytes, model_version, digest=None):
+    """Content-addressed cache key for an uploaded image and model version.
+
+    Pass `digest` when the image has already been hashed.
+    """
+    return f"{model_version}:{digest or image_digest(image_bytes)}"
+
+
+class CacheEntry:
+    """Cached MobileNetV2 feature vector and final response for one image"""
+
+    __slots__ = ('features', 'response', 'created')
+
+    def __init__(self, features, response, created=None):
+        self.features = features
+        self.response = response
+        self.created = time.time() if created is None else created
+
+
+class DiskTier:
+    """SQLite-backed cache tier that survives restarts"""
+
+    def __init__(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            "key TEXT PRIMARY KEY, created REAL, features BLOB, response TEXT)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT created, features, response FROM predictions WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        created, features, response = row
+        return CacheEntry(np.frombuffer(features, dtype=np.float32), json.loads(response), created)
+
+    def put(self, key, entry):
+        features = np.ascontiguousarray(entry.features, dtype=np.float32).tobytes()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)",
+                (key, entry.created, features, json.dumps(entry.response))
+            )
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM predictions WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def purge_expired(self, ttl):
+        """Delete entries older than ttl seconds and return how many were removed"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM predictions WHERE created < ?", (time.time() - ttl,)
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+
+
+class PredictionCache:
+    """Bounded in-memory LRU with TTL eviction and optional disk and shared tiers.
+
+    Entries are keyed by `make_key(image_bytes, model_version)`. Lookups
+    check memory first, then the disk tier, then the tier shared with other
+    replicas (see shared_cache.py), promoting hits back into memory.
+    `max_entries=0` disables the memory tier and `ttl_seconds=0` disables
+    expiry. `shared` is a SharedTier, or None.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=3600, disk_path=None, shared=None):
+        self.max_entries = max(0, int(max_entries))
+        self.ttl = max(0.0, float(ttl_seconds))
+        self.disk = DiskTier(disk_path) if disk_path else None
+        self.shared = shared
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Counters
+        self.hits = 0
+        self.disk_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _expired(self, entry, now):
+        return self.ttl > 0 and now - entry.created > self.ttl
+
+    def get(self, key):
+        """Return the CacheEntry for key, or None on a miss"""
+        return self.get_many([key])[0]
+
+    def get_many(self, keys):
+        """Return a CacheEntry or None per key; the shared tier is asked once for all misses"""
+        now = time.time()
+        found = [self._get_local(key, now) for key in keys]
+
+        missing = [i for i, entry in enumerate(found) if entry is None]
+        if self.shared is not None and missing:
+            values = self.shared.get_many([keys[i] for i in missing])
+            for i, value in zip(missing, values):
+                if value is None:
+                    continue
+                entry = CacheEntry(*value)
+                if self._expired(entry, now):
+                    with self._lock:
+                        self.expirations += 1
+                    continue
+                self._put_memory(keys[i], entry)
+                with self._lock:
+                    self.shared_hits += 1
+                found[i] = entry
+
+        misses = sum(entry is None for entry in found)
+        if misses:
+            with self._lock:
+                self.misses += misses
+        return found
+
+    def _get_local(self, key, now):
+        """Look key up in the memory and disk tiers without counting a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._expired(entry, now):
+                    del self._entries[key]
+                    self.expirations += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry
+
+        if self.disk is not None:
+            entry = self.disk.get(key)
+            if entry is not None:
+                if self._expired(entry, now):
+                    self.disk.delete(key)
+                    with self._lock:
+                        self.expirations += 1
+                else:
+                    self._put_memory(key, entry)
+                    with self._lock:
+                        self.disk_hits += 1
+                    return entry
+        return None
+
+    def put(self, key, features, response):
+        self.put_many([(key, features, response)])
+
+    def put_many(self, items):
+        """Store (key, features, response) triples; the shared tier gets them in one call"""
+        entries = [(key, CacheEntry(np.asarray(features, dtype=np.float32), response))
+                   for key, features, response in items]
+        for key, entry in entries:
+            self._put_memory(key, entry)
+            if self.disk is not None:
+                self.disk.put(key, entry)
+        if self.shared is not None:
+            self.shared.put_many(entries, self.ttl)
+
+    def _put_memory(self, key, entry):
+        if self.max_entries == 0:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def purge_expired(self):
+        """Drop expired entries from both tiers"""
+        if self.ttl <= 0:
+            return 0
+        now = time.time()
+        with self._lock:
+            expired = [k for k, e in self._entries.items() if self._expired(e, now)]
+            for k in expired:
+                del self._entries[k]
+            self.expirations += len(expired)
+        removed = len(expired)
+        if self.disk is not None:
+            removed += self.disk.purge_expired(self.ttl)
+        return removed
+
+    def stats(self):
+        """Return hit, miss and eviction counters"""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.shared_hits + self.misses
+            stats = {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': ((self.hits + self.disk_hits + self.shared_hits) / lookups) if lookups else 0.0,
+            }
+        if self.disk is not None:
+            stats['disk_path'] = self.disk.path
+            stats['disk_entries'] = len(self.disk)
+        if self.shared is not None:
+            stats['shared'] = self.shared.stats()
+        return stats
@@ -0,0 +1,135 @@
+"""Two-stage inference cascade: a cheap first stage in front of MobileNetV2.
+
+The first stage classifies colour statistics of a small copy of the
+decoded image (cheap_features: an HSV histogram plus per-channel means and
+standard deviations, well under a millisecond) with a small linear model.
+When its top probability reaches the calibrated threshold it answers on
+its own; otherwise the image goes through the full MobileNetV2 + Random
+Forest pipeline as before.
+
+v4Pothos.py --cascade trains the first stage on the training split,
+calibrates the threshold on out-of-fold probabilities so first-stage
+answers reach a target accuracy, and reports the accuracy / latency
+trade-off on the held-out split. The result is one joblib file holding a
+dict with the classifier, the threshold and how it was calibrated; app.py
+serves it when CASCADE_MODEL points to it.
+"""
+import threading
+import time
+
+import cv2
+import numpy as np
+
+FEATURE_VERSION = 'hsv-16x4x4-64px'
+CHEAP_SIZE = (64, 64)
+HIST_BINS = (16, 4, 4)
+
+
+def cheap_features(img):
+    """Colour descriptor of a BGR uint8 image: normalised HSV histogram, channel means and stds"""
+    small = cv2.resize(img, CHEAP_SIZE, interpolation=cv2.INTER_AREA)
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1, 2], None, HIST_BINS, [0, 180, 0, 256, 0, 256]).ravel()
+    hist /= hist.sum()
+    mean, std = cv2.meanStdDev(hsv)
+    return np.concatenate([hist, mean.ravel() / 255, std.ravel() / 255]).astype(np.float32)
+
+
+def calibrate_threshold(probabilities, y_true, target_accuracy):
+    """Lowest confidence threshold whose first-stage answers reach target_accuracy.
+
+    `probabilities` are out-of-fold first-stage probabilities with one
+    column per class index. Images are accepted from the most confident
+    down; the threshold is the confidence of the last image that keeps the
+    accuracy of all accepted ones at or above the target. Returns a value
+    above 1 (the first stage never answers) when no prefix reaches it.
+    """
+    confidence = probabilities.max(axis=1)
+    correct = np.argmax(probabilities, axis=1) == np.asarray(y_true)
+    order = np.argsort(-confidence, kind='stable')
+    sorted_confidence = confidence[order]
+    accuracy = np.cumsum(correct[order]) / np.arange(1, len(order) + 1)
+    # Images with equal confidence are accepted together, so only group ends are candidates
+    ends = np.flatnonzero(np.append(sorted_confidence[1:] != sorted_confidence[:-1], True))
+    passing = ends[accuracy[ends] >= target_accuracy]
+    if len(passing) == 0:
+        return 1.01
+    return float(sorted_confidence[passing[-1]])
+
+
+def tradeoff(first_proba, full_predictions, y_true, first_seconds, full_seconds, thresholds):
+    """Cascade accuracy, first-stage share and mean latency per image for each threshold.
+
+    Latency is the first-stage time for every image plus the full pipeline
+    time for escalated ones. Returns a list of dicts.
+    """
+    y_true = np.asarray(y_true)
+    confidence = first_proba.max(axis=1)
+    first_predictions = np.argmax(first_proba, axis=1)
+    rows = []
+    for threshold in thresholds:
+        answered = confidence >= threshold
+        predictions = np.where(answered, first_predictions, full_predictions)
+        rows.append({
+            'threshold': float(threshold),
+            'first_stage_share': float(answered.mean()),
+            'first_stage_accuracy': float((first_predictions[answered] == y_true[answered]).mean())
+            if answered.any() else None,
+            'accuracy': float((predictions == y_true).mean()),
+            'mean_latency_ms': float(first_seconds + (1 - answered.mean()) * full_seconds) * 1000
+        })
+    return rows
+
+
+class CascadeStage:
+    """Serving side of a first stage saved by v4Pothos.py --cascade.
+
+    `model` is the saved dict; `threshold` overrides its calibrated
+    threshold. `version` identifies the saved file in cache keys. Counts
+    the images each stage handled.
+    """
+
+    def __init__(self, model, version, threshold=None):
+        if model.get('feature_version') != FEATURE_VERSION:
+            raise ValueError(f"Cascade model uses features {model.get('feature_version')!r}, "
+                             f"this server computes {FEATURE_VERSION!r}")
+        self.classifier = model['classifier']
+        self.threshold = float(model['threshold'] if threshold is None else threshold)
+        self.model = model
+        self.version = version
+
+        self._lock = threading.Lock()
+
+        # Counters
+        self.first_stage = 0
+        self.full_pipeline = 0
+        self.seconds = 0.0
+
+    def decide(self, img):
+        """Return (class index, confidence in percent) if the first stage is confident, else None"""
+        start = time.perf_counter()
+        proba = self.classifier.predict_proba(cheap_features(img)[np.newaxis])[0]
+        best = int(np.argmax(proba))
+        answered = proba[best] >= self.threshold
+        with self._lock:
+            self.seconds += time.perf_counter() - start
+            if answered:
+                self.first_stage += 1
+            else:
+                self.full_pipeline += 1
+        if not answered:
+            return None
+        return int(np.asarray(self.classifier.classes_)[best]), float(proba[best] * 100)
+
+    def stats(self):
+        with self._lock:
+            total = self.first_stage + self.full_pipeline
+            return {
+                'version': self.version,
+                'threshold': self.threshold,
+                'calibration': self.model.get('calibration'),
+                'first_stage': self.first_stage,
+                'full_pipeline': self.full_pipeline,
+                'first_stage_share': (self.first_stage / total) if total else None,
+                'avg_first_stage_ms': (self.seconds / total * 1000) if total else 0.0
+            }
@@ -0,0 +1,364 @@
+"""Approximate nearest-neighbour index over MobileNetV2 embeddings.
+
+Embeddings are L2-normalised, so the inner product is the cosine
+similarity. The index is an inverted file: k-means centroids split the
+space into `n_lists` cells and each embedding is appended to the list files
+of its nearest centroid. A query scores the centroids and scans only the
+`n_probe` closest lists.
+
+Each list stores a 128-dim float32 projection of its embeddings (the top
+right singular vectors of the training embeddings) for the scan, and the
+full embedding as float16 for re-ranking the best `rerank` candidates.
+Scanning the projection is a single BLAS product; converting full float16
+rows is the expensive step, so only the candidates are converted. List
+files are append-only and memory-mapped, so inserts never rewrite the
+index and resident memory is bounded by the pages the queries touch.
+
+Training images and past submissions are kept in separate lists, so
+evidence can be restricted to labelled training examples while duplicate
+detection looks at both.
+
+Layout of the index directory:
+    centroids.npy                 (n_lists, 1280) float32
+    projection.npy                (1280, 128) float32
+    lists/<source>-<list>.low     raw float32 projected rows
+    lists/<source>-<list>.f16     raw float16 rows
+    lists/<source>-<list>.ids     raw int64 entry ids, one per row
+    meta.sqlite                   id -> label, source, ref
+
+Usage:
+    python embedding_index.py build FEATURE_STORE_DIR INDEX_DIR [--lists N] [--dims 128]
+    python embedding_index.py bench INDEX_DIR [--queries 1000] [--k 5] [--synthetic N]
+
+`build` trains the centroids on the feature store written by v4Pothos.py
+and inserts one embedding per training image, labelled by its folder. When
+lists grow large enough to slow queries down, rebuild with more lists.
+"""
+import argparse
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import numpy as np
+
+SOURCES = ('train', 'submission')
+
+
+def normalize(vectors):
+    """L2-normalise rows as float32"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def train_centroids(vectors, n_lists, iterations=20, sample_size=50000, seed=0):
+    """Spherical k-means over (a sample of) normalised vectors"""
+    rng = np.random.default_rng(seed)
+    vectors = normalize(vectors)
+    if len(vectors) > sample_size:
+        vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    n_lists = max(1, min(n_lists, len(vectors)))
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        for c in range(n_lists):
+            members = vectors[assignment == c]
+            if len(members):
+                centroids[c] = members.sum(axis=0)
+        centroids = normalize(centroids)
+    return centroids
+
+
+def train_projection(vectors, dims=128, sample_size=50000, seed=0):
+    """Top right singular vectors of (a sample of) normalised vectors, as a (dim, dims) matrix.
+
+    The vectors are not centred, so inner products of projected unit
+    vectors approximate their cosine similarity.
+    """
+    rng = np.random.default_rng(seed)
+    vectors = normalize(vectors)
+    if len(vectors) > sample_size:
+        vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    _, _, vt = np.linalg.svd(vectors, full_matrices=False)
+    projection = vt[:dims].T
+    if projection.shape[1] < dims:
+        # Fewer samples than dims: pad with zero columns
+        projection = np.pad(projection, ((0, 0), (0, dims - projection.shape[1])))
+    return np.ascontiguousarray(projection, dtype=np.float32)
+
+
+class EmbeddingIndex:
+    """IVF index of embeddings with memory-mapped, append-only lists.
+
+    `search` may run concurrently with `add`; appends and list remapping
+    are serialised by one lock.
+    """
+
+    def __init__(self, directory, n_probe=8, rerank=64):
+        self.directory = directory
+        self.n_probe = n_probe
+        self.rerank = rerank
+        self.centroids = np.load(os.path.join(directory, 'centroids.npy'))
+        self.projection = np.load(os.path.join(directory, 'projection.npy'))
+        self.dim, self.low_dim = self.projection.shape
+        self.lists_dir = os.path.join(directory, 'lists')
+        os.makedirs(self.lists_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, 'meta.sqlite'), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "id INTEGER PRIMARY KEY, label INTEGER, source TEXT, ref TEXT UNIQUE, created REAL)"
+        )
+        self._conn.commit()
+        # Row counts and memory maps per (source, list), refreshed as lists grow
+        self._sizes = {}
+        self._maps = {}
+        for name in os.listdir(self.lists_dir):
+            if name.endswith('.ids'):
+                source, list_id = name[:-4].rsplit('-', 1)
+                self._sizes[(source, int(list_id))] = os.path.getsize(os.path.join(self.lists_dir, name)) // 8
+
+    @classmethod
+    def create(cls, directory, centroids, projection, **kwargs):
+        """Create an empty index with the given centroids and projection"""
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'centroids.npy'), normalize(centroids))
+        np.save(os.path.join(directory, 'projection.npy'), np.asarray(projection, dtype=np.float32))
+        return cls(directory, **kwargs)
+
+    def _path(self, source, list_id, ext):
+        return os.path.join(self.lists_dir, f"{source}-{list_id:05d}.{ext}")
+
+    def _list(self, source, list_id):
+        """Return (projected, vectors, ids) memory maps of one list, or None if it is empty"""
+        key = (source, list_id)
+        with self._lock:
+            size = self._sizes.get(key, 0)
+            if size == 0:
+                return None
+            mapped = self._maps.get(key)
+            if mapped is None or len(mapped[2]) != size:
+                projected = np.memmap(self._path(source, list_id, 'low'), dtype=np.float32,
+                                      mode='r', shape=(size, self.low_dim))
+                vectors = np.memmap(self._path(source, list_id, 'f16'), dtype=np.float16,
+                                    mode='r', shape=(size, self.dim))
+                ids = np.memmap(self._path(source, list_id, 'ids'), dtype=np.int64, mode='r', shape=(size,))
+                # Plain ndarray views index much faster than np.memmap objects
+                mapped = self._maps[key] = tuple(a.view(np.ndarray) for a in (projected, vectors, ids))
+            return mapped
+
+    def __len__(self):
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def add(self, vectors, labels, source, refs):
+        """Append embeddings with their labels and refs; refs already present are skipped.
+
+        Returns the number of embeddings added.
+        """
+        if source not in SOURCES:
+            raise ValueError(f"Unknown source {source!r}, expected one of {SOURCES}")
+        vectors = normalize(vectors)
+        assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+        projected = vectors @ self.projection
+        with self._lock:
+            rows, ids = [], []
+            for row, (label, ref) in enumerate(zip(labels, refs)):
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO entries (label, source, ref, created) VALUES (?, ?, ?, ?)",
+                    (int(label), source, ref, time.time())
+                )
+                if cursor.rowcount:
+                    rows.append(row)
+                    ids.append(cursor.lastrowid)
+            rows, ids = np.asarray(rows, dtype=np.int64), np.asarray(ids, dtype=np.int64)
+            
+            for list_id in np.unique(assignment[rows]):
+                members = assignment[rows] == list_id
+                list_id = int(list_id)
+                # Vectors are written before ids, so a partial write is never read
+                with open(self._path(source, list_id, 'low'), 'ab') as f:
+                    f.write(projected[rows[members]].tobytes())
+                with open(self._path(source, list_id, 'f16'), 'ab') as f:
+                    f.write(vectors[rows[members]].astype(np.float16).tobytes())
+                with open(self._path(source, list_id, 'ids'), 'ab') as f:
+                    f.write(ids[members].tobytes())
+                self._sizes[(source, list_id)] = self._sizes.get((source, list_id), 0) + int(members.sum())
+            self._conn.commit()
+        return len(rows)
+
+    def search(self, queries, k=5, sources=SOURCES):
+        """Return the k most similar entries for each query.
+
+        Each result is a list of (similarity, entry id) pairs, most similar
+        first, taken from the n_probe closest lists of each source. The
+        similarity is the exact cosine of the float16 embeddings.
+        """
+        queries = normalize(queries)
+        n_probe = min(self.n_probe, len(self.centroids))
+        probes = np.argpartition(-(queries @ self.centroids.T), n_probe - 1, axis=1)[:, :n_probe]
+        projected_queries = queries @ self.projection
+        results = []
+        for query, projected_query, lists in zip(queries, projected_queries, probes):
+            scores, scanned = [], []
+            for source in sources:
+                for list_id in lists:
+                    mapped = self._list(source, int(list_id))
+                    if mapped is not None:
+                        scores.append(mapped[0] @ projected_query)
+                        scanned.append(mapped)
+            if not scores:
+                results.append([])
+                continue
+            offsets = np.cumsum([0] + [len(s) for s in scores])
+            candidates = _top(np.concatenate(scores), max(k, self.rerank))
+            
+            # Exact cosine on the full embeddings of the candidates only
+            lists_of = np.searchsorted(offsets, candidates, side='right') - 1
+            rows_of = candidates - offsets[lists_of]
+            full = np.empty((len(candidates), self.dim), dtype=np.float32)
+            ids = np.empty(len(candidates), dtype=np.int64)
+            for list_index in np.unique(lists_of):
+                members = lists_of == list_index
+                full[members] = scanned[list_index][1][rows_of[members]]
+                ids[members] = scanned[list_index][2][rows_of[members]]
+            exact = full @ query
+            results.append([(float(exact[i]), int(ids[i])) for i in _top(exact, k)])
+        return results
+
+    def entries(self, ids):
+        """Return {id: (label, source, ref)} for entry ids"""
+        ids = list({int(i) for i in ids})
+        if not ids:
+            return {}
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, label, source, ref FROM entries WHERE id IN ({','.join('?' * len(ids))})", ids
+            ).fetchall()
+        return {row[0]: row[1:] for row in rows}
+
+    def stats(self):
+        with self._lock:
+            per_source = {source: 0 for source in SOURCES}
+            for (source, _), size in self._sizes.items():
+                per_source[source] = per_source.get(source, 0) + size
+            largest = max(self._sizes.values(), default=0)
+        return {
+            'directory': self.directory,
+            'lists': len(self.centroids),
+            'n_probe': self.n_probe,
+            'entries': per_source,
+            'largest_list': largest,
+            'disk_bytes': sum(per_source.values()) * (self.low_dim * 4 + self.dim * 2 + 8)
+        }
+
+
+def _top(scores, k):
+    """Indices of the k highest scores, highest first"""
+    top = np.arange(len(scores)) if len(scores) <= k else np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def build(feature_store_dir, index_dir, n_lists=None, dims=128):
+    """Build an index from a v4Pothos.py feature store, one embedding per training image"""
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Ai Agent Project'))
+    from feature_store import FeatureStore
+    from inference import DISEASE_CLASSES
+
+    store = FeatureStore(feature_store_dir)
+    # Keys are 'path|mtime|seed'; keep one key per image path
+    by_path = {}
+    for key in store.keys():
+        by_path[key.split('|', 1)[0]] = key
+    paths = [p for p in sorted(by_path) if os.path.basename(os.path.dirname(p)) in DISEASE_CLASSES]
+    if not paths:
+        raise SystemExit(f"No labelled images in the feature store at {feature_store_dir}")
+    vectors = store.get_many([by_path[p] for p in paths])
+    labels = [DISEASE_CLASSES.index(os.path.basename(os.path.dirname(p))) for p in paths]
+
+    n_lists = n_lists or max(1, int(math.sqrt(len(paths))))
+    start = time.perf_counter()
+    index = EmbeddingIndex.create(index_dir, train_centroids(vectors, n_lists), train_projection(vectors, dims))
+    added = index.add(vectors, labels, 'train', paths)
+    print(f"Indexed {added} training images in {n_lists} lists in {time.perf_counter() - start:.1f}s")
+    return index
+
+
+def build_synthetic(index_dir, size, n_lists=None, dims=128, seed=0):
+    """Build an index of `size` clustered random embeddings, for benchmarking at scale"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((256, 1280)).astype(np.float32)
+    sample = centers[rng.integers(0, len(centers), min(size, 50000))]
+    sample += 0.5 * rng.standard_normal(sample.shape).astype(np.float32)
+    n_lists = n_lists or max(1, int(math.sqrt(size)))
+    index = EmbeddingIndex.create(index_dir, train_centroids(sample, n_lists, iterations=5),
+                                  train_projection(sample, dims))
+    for start in range(0, size, 10000):
+        count = min(10000, size - start)
+        vectors = centers[rng.integers(0, len(centers), count)]
+        vectors += 0.5 * rng.standard_normal(vectors.shape).astype(np.float32)
+        index.add(vectors, [0] * count, 'train', [f"synthetic-{start + i}" for i in range(count)])
+    print(f"Indexed {size} synthetic embeddings in {n_lists} lists")
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_parser = commands.add_parser('build')
+    build_parser.add_argument('feature_store_dir')
+    build_parser.add_argument('index_dir')
+    build_parser.add_argument('--lists', type=int, default=None)
+    build_parser.add_argument('--dims', type=int, default=128)
+    bench_parser = commands.add_parser('bench')
+    bench_parser.add_argument('index_dir')
+    bench_parser.add_argument('--queries', type=int, default=1000)
+    bench_parser.add_argument('--k', type=int, default=5)
+    bench_parser.add_argument('--n-probe', type=int, default=8)
+    bench_parser.add_argument('--rerank', type=int, default=64)
+    bench_parser.add_argument('--synthetic', type=int, default=0,
+                              help='first build an index of this many random embeddings in index_dir')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build(args.feature_store_dir, args.index_dir, args.lists, args.dims)
+        return 0
+
+    if args.synthetic:
+        build_synthetic(args.index_dir, args.synthetic)
+    index = EmbeddingIndex(args.index_dir, n_probe=args.n_probe, rerank=args.rerank)
+    print(index.stats())
+
+    # Queries are perturbed copies of indexed embeddings, so recall can be checked
+    rng = np.random.default_rng(1)
+    stored = []
+    for list_id in rng.choice(len(index.centroids), min(args.queries, len(index.centroids))):
+        mapped = index._list('train', int(list_id))
+        if mapped is not None:
+            row = int(rng.integers(len(mapped[2])))
+            stored.append((np.asarray(mapped[1][row], dtype=np.float32), int(mapped[2][row])))
+    if not stored:
+        print("The index is empty")
+        return 1
+    latencies, found = [], 0
+    index.search(stored[0][0][np.newaxis], args.k)
+    for i in range(args.queries):
+        vector, entry_id = stored[i % len(stored)]
+        query = vector + 0.001 * rng.standard_normal(vector.shape).astype(np.float32)
+        start = time.perf_counter()
+        result = index.search(query[np.newaxis], args.k)[0]
+        latencies.append(time.perf_counter() - start)
+        found += any(i == entry_id for _, i in result)
+    latencies = np.array(latencies) * 1000
+    print(f"Query latency over {args.queries} queries: p50 {np.percentile(latencies, 50):.3f} ms, "
+          f"p99 {np.percentile(latencies, 99):.3f} ms; source found in top {args.k}: {found / args.queries:.1%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,235 @@
+"""Secondary classifiers scored on the features of the primary model.
+
+MobileNetV2 runs once per image; every secondary classifier (for example
+the SVM that v4Pothos.py trains next to the Random Forest) reuses those
+features. Two modes:
+
+    shadow    the response comes from the primary model only; secondaries
+              are scored on a background thread and disagreements with the
+              primary are counted and logged
+    ensemble  the class probabilities of the primary and the secondaries
+              are averaged (optionally weighted) into the response
+
+Each secondary runs on its own thread and has its own latency budget
+(SECONDARY_BUDGET_MS unless its spec sets one). A secondary that has not
+answered within its budget is skipped for that batch, and one that is
+still busy with an earlier batch is skipped without being queued, so a
+slow model never delays the response.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import numpy as np
+
+from inference import DISEASE_CLASSES, class_probabilities
+
+log = logging.getLogger(__name__)
+
+MODES = ('single', 'shadow', 'ensemble')
+
+# Latency budget of a secondary model whose spec does not set one
+SECONDARY_BUDGET_MS = float(os.environ.get('SECONDARY_BUDGET_MS', '20'))
+
+
+class SecondaryModel:
+    """One secondary classifier with its latency budget and skip counters.
+
+    `budget_ms` is how long a batch waits for this model; None uses
+    SECONDARY_BUDGET_MS.
+    """
+
+    def __init__(self, name, classifier, weight=1.0, budget_ms=None):
+        self.name = name
+        self.classifier = classifier
+        self.weight = float(weight)
+        self.budget = max(0.0, float(SECONDARY_BUDGET_MS if budget_ms is None else budget_ms)) / 1000.0
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'secondary-{name}')
+        self.busy = None
+        self._lock = threading.Lock()
+
+        # Counters
+        self.batches = 0
+        self.seconds = 0.0
+        self.last_seconds = 0.0
+        self.skipped_busy = 0
+        self.skipped_timeout = 0
+        self.errors = 0
+
+    def _score(self, features):
+        start = time.perf_counter()
+        proba = class_probabilities(self.classifier, features)
+        seconds = time.perf_counter() - start
+        with self._lock:
+            self.last_seconds = seconds
+            self.seconds += seconds
+            self.batches += 1
+        return proba
+
+    def submit(self, features):
+        """Start scoring features, or return None if the previous batch is still running"""
+        with self._lock:
+            if self.busy is not None and not self.busy.done():
+                self.skipped_busy += 1
+                return None
+            self.busy = self.executor.submit(self._score, features)
+            return self.busy
+
+    def record_timeout(self):
+        with self._lock:
+            self.skipped_timeout += 1
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'weight': self.weight,
+                'budget_ms': self.budget * 1000,
+                'batches': self.batches,
+                'avg_ms': (self.seconds / self.batches * 1000) if self.batches else 0.0,
+                'last_ms': self.last_seconds * 1000,
+                'skipped_busy': self.skipped_busy,
+                'skipped_timeout': self.skipped_timeout,
+                'errors': self.errors
+            }
+
+
+class SecondaryScorer:
+    """Scores secondary classifiers in shadow or ensemble mode.
+
+    `primary_weight` weighs the primary model's probabilities in ensemble
+    mode; each SecondaryModel carries its own weight and latency budget. In
+    shadow mode at most `max_pending` batches wait for the background
+    thread; more are dropped.
+    """
+
+    def __init__(self, models, mode='shadow', primary_weight=1.0, max_pending=64):
+        if mode not in ('shadow', 'ensemble'):
+            raise ValueError(f"Unknown scoring mode {mode!r}, expected 'shadow' or 'ensemble'")
+        self.models = list(models)
+        self.mode = mode
+        self.primary_weight = float(primary_weight)
+        self.max_pending = max(1, int(max_pending))
+
+        self._lock = threading.Lock()
+        self._shadow = ThreadPoolExecutor(max_workers=1, thread_name_prefix='shadow')
+        self._pending = 0
+
+        # Counters, per secondary model name
+        self.agreements = {m.name: 0 for m in self.models}
+        self.disagreements = {m.name: 0 for m in self.models}
+        self.shadow_dropped = 0
+
+    def submit(self, features):
+        """Start every available secondary on a batch of features; returns the pending work"""
+        return [(model, model.submit(features)) for model in self.models]
+
+    def collect(self, pending, start):
+        """Wait for pending work, each model until its budget after `start` (time.perf_counter).
+
+        Returns {model: probabilities} for the secondaries that finished in time.
+        """
+        results = {}
+        for model, future in pending:
+            if future is None:
+                continue
+            try:
+                results[model] = future.result(timeout=max(0.0, start + model.budget - time.perf_counter()))
+            except FutureTimeoutError:
+                model.record_timeout()
+            except Exception as e:
+                model.record_error()
+                log.warning("Secondary model %s failed: %s", model.name, e)
+        return results
+
+    def combine(self, primary_proba, secondary_probas, rows=None):
+        """Weighted mean of the primary and secondary probabilities.
+
+        `rows` selects the rows of the secondary probabilities that match
+        `primary_proba`. Returns (class indices, confidences in percent).
+        """
+        total = primary_proba * self.primary_weight
+        weight = self.primary_weight
+        for model, proba in secondary_probas.items():
+            total = total + (proba if rows is None else proba[rows]) * model.weight
+            weight += model.weight
+        total /= weight
+        return np.argmax(total, axis=1), total.max(axis=1) * 100
+
+    def shadow(self, features, predictions):
+        """Score the secondaries off the response path and compare with the primary predictions"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.shadow_dropped += 1
+                return
+            self._pending += 1
+        self._shadow.submit(self._run_shadow, features, np.asarray(predictions))
+
+    def _run_shadow(self, features, predictions):
+        try:
+            start = time.perf_counter()
+            results = self.collect(self.submit(features), start)
+            for model, proba in results.items():
+                secondary = np.argmax(proba, axis=1)
+                disagree = np.flatnonzero(secondary != predictions)
+                with self._lock:
+                    self.agreements[model.name] += len(predictions) - len(disagree)
+                    self.disagreements[model.name] += len(disagree)
+                for i in disagree:
+                    log.info("Shadow model %s disagrees: primary %s, %s %s (%.1f%%)",
+                             model.name, DISEASE_CLASSES[predictions[i]], model.name,
+                             DISEASE_CLASSES[secondary[i]], proba[i].max() * 100)
+        except Exception as e:
+            log.exception("Shadow scoring failed: %s", e)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def stats(self):
+        """Return per-model latency, skip and agreement counters"""
+        with self._lock:
+            models = {}
+            for model in self.models:
+                compared = self.agreements[model.name] + self.disagreements[model.name]
+                models[model.name] = dict(
+                    model.stats(),
+                    agreements=self.agreements[model.name],
+                    disagreements=self.disagreements[model.name],
+                    agreement_rate=(self.agreements[model.name] / compared) if compared else None
+                )
+            return {
+                'mode': self.mode,
+                'primary_weight': self.primary_weight,
+                'shadow_pending': self._pending,
+                'shadow_dropped': self.shadow_dropped,
+                'models': models
+            }
+
+
+def parse_model_specs(spec):
+    """Parse 'path[:weight[:budget_ms]],...' into (name, path, weight, budget_ms) tuples.
+
+    The name is the file name without its extension. budget_ms is None
+    when the spec does not set one.
+    """
+    models = []
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        path, numbers = item, []
+        while len(numbers) < 2:
+            head, sep, tail = path.rpartition(':')
+            if not (sep and head):
+                break
+            try:
+                numbers.insert(0, float(tail))
+            except ValueError:
+                break
+            path = head
+        weight = numbers[0] if numbers else 1.0
+        budget_ms = numbers[1] if len(numbers) > 1 else None
+        models.append((os.path.splitext(os.path.basename(path))[0], path, weight, budget_ms))
+    return models
@@ -0,0 +1,216 @@
+"""Export the MobileNetV2 feature extractor to TFLite or ONNX and check parity.
+
+Usage:
+    python export_feature_extractor.py --format tflite --quantize int8
+    python export_feature_extractor.py --format onnx --quantize float16
+
+INT8 quantization is calibrated on images from the MoneyPlant dataset. After
+exporting, the Random Forest used by app.py is run on features from both the
+Keras model and the exported model for the bundled sample images plus a
+sample of the dataset; the script exits with status 1 if the predictions
+disagree more than the given tolerance. Serve the result with
+FEATURE_BACKEND=tflite|onnx and FEATURE_MODEL_PATH=<exported file>.
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.join(BASE_DIR, 'Ai Agent Project')
+DEFAULT_DATASET_DIR = os.path.join(PROJECT_DIR, 'MoneyPlant', 'MoneyPlant')
+DEFAULT_OUTPUT_DIR = os.path.join(PROJECT_DIR, 'exported')
+SAMPLE_IMAGES = sorted(glob.glob(os.path.join(PROJECT_DIR, 'pothos*.jpg')))
+
+
+def list_images(dataset_dir, count, seed=42):
+    """Pick `count` images spread evenly over the dataset's class folders"""
+    paths = []
+    for category in sorted(os.listdir(dataset_dir)):
+        folder = os.path.join(dataset_dir, category)
+        if os.path.isdir(folder):
+            paths.append(sorted(os.path.join(folder, name) for name in os.listdir(folder)))
+    rng = random.Random(seed)
+    picked = []
+    per_class = max(1, count // max(1, len(paths)))
+    for class_paths in paths:
+        picked.extend(rng.sample(class_paths, min(per_class, len(class_paths))))
+    return picked[:count]
+
+
+def load_inputs(paths, preprocess):
+    """Preprocess image files into a float32 (N, 128, 128, 3) batch"""
+    images, kept = [], []
+    for path in paths:
+        with open(path, 'rb') as f:
+            data = f.read()
+        try:
+            images.append(preprocess(data))
+            kept.append(path)
+        except Exception as e:
+            print(f"Skipping {path}: {e}")
+    return np.stack(images).astype(np.float32), kept
+
+
+def export_tflite(keras_model, output_path, quantize, calibration):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    if quantize == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantize == 'int8':
+        def representative_dataset():
+            for img in calibration:
+                yield [img[np.newaxis]]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        # Integer kernels everywhere, float32 input/output so callers don't change
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+
+
+def export_onnx(keras_model, output_path, quantize, calibration):
+    import tensorflow as tf
+    import tf2onnx
+
+    spec = [tf.TensorSpec((None, 128, 128, 3), tf.float32, name='input')]
+    if quantize == 'none':
+        tf2onnx.convert.from_keras(keras_model, input_signature=spec, opset=13, output_path=output_path)
+        return
+
+    float_path = output_path.replace('.onnx', '.float32.onnx')
+    tf2onnx.convert.from_keras(keras_model, input_signature=spec, opset=13, output_path=float_path)
+
+    if quantize == 'float16':
+        import onnx
+        from onnxconverter_common import float16
+        converted = float16.convert_float_to_float16(onnx.load(float_path), keep_io_types=True)
+        onnx.save(converted, output_path)
+    else:
+        from onnxruntime.quantization import CalibrationDataReader, QuantType, quantize_static
+
+        class Reader(CalibrationDataReader):
+            def __init__(self):
+                self._images = iter(calibration)
+
+            def get_next(self):
+                img = next(self._images, None)
+                return None if img is None else {'input': img[np.newaxis]}
+
+        quantize_static(
+            float_path, output_path, Reader(),
+            activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8
+        )
+    os.remove(float_path)
+
+
+def time_backend(backend, batch, repeats=5):
+    """Median seconds per image for backend.predict on batch"""
+    backend.predict(batch[:1])
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        backend.predict(batch)
+        timings.append((time.perf_counter() - start) / len(batch))
+    return float(np.median(timings))
+
+
+def check_parity(classifier, reference, exported, batch):
+    """Compare classifier outputs on reference vs exported features"""
+    ref_features = reference.predict(batch)
+    exp_features = exported.predict(batch)
+
+    ref_proba = classifier.predict_proba(ref_features)
+    exp_proba = classifier.predict_proba(exp_features)
+
+    norms = np.linalg.norm(ref_features, axis=1) * np.linalg.norm(exp_features, axis=1)
+    cosine = np.sum(ref_features * exp_features, axis=1) / np.maximum(norms, 1e-12)
+
+    return {
+        'images': len(batch),
+        'label_agreement': float(np.mean(ref_proba.argmax(1) == exp_proba.argmax(1))),
+        'max_probability_diff': float(np.max(np.abs(ref_proba - exp_proba))),
+        'max_feature_diff': float(np.max(np.abs(ref_features - exp_features))),
+        'min_cosine_similarity': float(np.min(cosine)),
+        'keras_ms_per_image': time_backend(reference, batch) * 1000,
+        'exported_ms_per_image': time_backend(exported, batch) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--format', choices=['tflite', 'onnx'], default='tflite')
+    parser.add_argument('--quantize', choices=['none', 'float16', 'int8'], default='none')
+    parser.add_argument('--dataset-dir', default=DEFAULT_DATASET_DIR)
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument('--calibration-images', type=int, default=300)
+    parser.add_argument('--parity-images', type=int, default=150)
+    parser.add_argument('--min-agreement', type=float, default=0.99,
+                        help='minimum fraction of matching Random Forest labels')
+    parser.add_argument('--max-probability-diff', type=float, default=0.05,
+                        help='maximum absolute difference of any class probability')
+    args = parser.parse_args()
+
+    # Reuse the serving preprocessing, Random Forest and Keras extractor
+    import app
+    app.wait_until_ready()
+    from feature_backends import KerasBackend, build_mobilenet_v2, load_feature_backend
+    from inference import preprocess_image_bytes
+
+    if app.model_router.active is None:
+        print("ERROR: Random Forest model not loaded, cannot check parity")
+        return 1
+    classifier = app.model_router.active.classifier
+    reference = app.feature_model if isinstance(app.feature_model, KerasBackend) else KerasBackend(build_mobilenet_v2())
+
+    calibration = None
+    if args.quantize == 'int8':
+        print(f"Loading {args.calibration_images} calibration images...")
+        paths = list_images(args.dataset_dir, args.calibration_images, seed=0)
+        calibration, _ = load_inputs(paths, preprocess_image_bytes)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    suffix = '' if args.quantize == 'none' else f'_{args.quantize}'
+    output_path = os.path.join(args.output_dir, f"mobilenetv2_feature_extractor{suffix}.{args.format}")
+
+    print(f"Exporting {args.format} ({args.quantize}) to {output_path}...")
+    export = export_tflite if args.format == 'tflite' else export_onnx
+    export(reference.model, output_path, args.quantize, calibration)
+    print(f"Exported model size: {os.path.getsize(output_path) / 1e6:.1f} MB")
+
+    exported = load_feature_backend(args.format, output_path)
+
+    paths = SAMPLE_IMAGES + list_images(args.dataset_dir, args.parity_images, seed=1)
+    batch, paths = load_inputs(paths, preprocess_image_bytes)
+    report = check_parity(classifier, reference, exported, batch)
+    report.update({
+        'format': args.format,
+        'quantize': args.quantize,
+        'model_path': output_path,
+        'model_bytes': os.path.getsize(output_path),
+    })
+    passed = (report['label_agreement'] >= args.min_agreement and
+              report['max_probability_diff'] <= args.max_probability_diff)
+    report['passed'] = passed
+
+    with open(output_path + '.parity.json', 'w') as f:
+        json.dump(report, f, indent=4)
+    print(json.dumps(report, indent=4))
+
+    if not passed:
+        print("PARITY CHECK FAILED")
+        return 1
+    print("Parity check passed")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
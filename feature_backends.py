@@ -0,0 +1,138 @@
+"""MobileNetV2 feature extractor backends.
+
+Every backend exposes `predict(batch)` taking a float32 (N, 128, 128, 3)
+array that has already been through `preprocess_input`, and returning the
+(N, 1280) pooled feature matrix. TensorFlow, TFLite and ONNX Runtime are
+imported only by the backend that needs them.
+"""
+import os
+
+import numpy as np
+
+BACKENDS = ('keras', 'tflite', 'onnx')
+
+INPUT_SHAPE = (128, 128, 3)
+# Length of the pooled MobileNetV2 feature vector
+FEATURE_DIM = 1280
+
+# Files looked up in a local artifact directory, in order of preference:
+# the full extractor saved by v4Pothos.py, then bare Keras ImageNet weights
+SAVED_EXTRACTOR_FILE = 'mobilenetv2_feature_extractor.h5'
+IMAGENET_WEIGHTS_FILE = 'mobilenet_v2_weights_tf_dim_ordering_tf_kernels_1.0_128_no_top.h5'
+
+
+def build_mobilenet_v2(weights='imagenet'):
+    """Build the Keras MobileNetV2 extractor used for training and serving"""
+    from tensorflow.keras.applications import MobileNetV2
+    return MobileNetV2(
+        weights=weights,
+        include_top=False,
+        pooling='avg',
+        input_shape=INPUT_SHAPE
+    )
+
+
+class KerasBackend:
+    """Runs the Keras model directly"""
+
+    name = 'keras'
+
+    def __init__(self, keras_model):
+        self.model = keras_model
+
+    def predict(self, batch):
+        return self.model.predict(batch, verbose=0)
+
+
+class TFLiteBackend:
+    """Runs an exported .tflite model (float32, float16 or INT8 weights)"""
+
+    name = 'tflite'
+
+    def __init__(self, model_path, num_threads=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+        self.model_path = model_path
+        self.interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = None
+
+    def _resize(self, batch_size):
+        if batch_size != self._batch_size:
+            self.interpreter.resize_tensor_input(
+                self._input['index'], (batch_size,) + INPUT_SHAPE
+            )
+            self.interpreter.allocate_tensors()
+            self._batch_size = batch_size
+
+    def predict(self, batch):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        self._resize(len(batch))
+        self.interpreter.set_tensor(self._input['index'], batch)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self._output['index']).copy()
+
+
+class OnnxBackend:
+    """Runs an exported .onnx model with ONNX Runtime on CPU"""
+
+    name = 'onnx'
+
+    def __init__(self, model_path, num_threads=None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.model_path = model_path
+        self.session = ort.InferenceSession(
+            model_path, options, providers=['CPUExecutionProvider']
+        )
+        self._input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch):
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        return self.session.run(None, {self._input_name: batch})[0]
+
+
+def load_keras_extractor(artifact_dir=None, offline=False):
+    """Load the Keras extractor, preferring local files over a weights download"""
+    if artifact_dir:
+        saved = os.path.join(artifact_dir, SAVED_EXTRACTOR_FILE)
+        if os.path.exists(saved):
+            import tensorflow as tf
+            return tf.keras.models.load_model(saved, compile=False)
+        weights = os.path.join(artifact_dir, IMAGENET_WEIGHTS_FILE)
+        if os.path.exists(weights):
+            return build_mobilenet_v2(weights=weights)
+    if offline:
+        raise FileNotFoundError(
+            f"Offline mode: neither {SAVED_EXTRACTOR_FILE} nor {IMAGENET_WEIGHTS_FILE} "
+            f"found in {artifact_dir}"
+        )
+    return build_mobilenet_v2()
+
+
+def load_feature_backend(name, model_path=None, num_threads=None, artifact_dir=None, offline=False):
+    """Create the feature extractor backend `name`.
+
+    For 'keras' a `model_path` to a saved model (.h5) is optional; without
+    one the extractor is loaded from `artifact_dir` if possible and
+    otherwise built with downloaded ImageNet weights, unless `offline`.
+    'tflite' and 'onnx' require the path of a model written by
+    export_feature_extractor.py.
+    """
+    if name == 'keras':
+        if model_path:
+            import tensorflow as tf
+            return KerasBackend(tf.keras.models.load_model(model_path, compile=False))
+        return KerasBackend(load_keras_extractor(artifact_dir, offline))
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown feature backend '{name}', expected one of {BACKENDS}")
+    if not model_path:
+        raise ValueError(f"Feature backend '{name}' needs a model path")
+    if name == 'tflite':
+        return TFLiteBackend(model_path, num_threads=num_threads)
+    return OnnxBackend(model_path, num_threads=num_threads)
@@ -0,0 +1,329 @@
+"""Model artifacts, loading and the prediction steps shared by app.py and serve.py"""
+import os
+import io
+import base64
+import json
+import hashlib
+import logging
+import pickle
+import joblib
+import numpy as np
+import cv2
+from PIL import Image
+from feature_backends import load_feature_backend
+from preprocessing import IMAGE_SIZE, preprocess_image
+from rf_engine import FlatForest
+from projection import Projection, ProjectedClassifier
+
+log = logging.getLogger(__name__)
+
+# Model path
+MODEL_PATH = os.environ.get(
+    'MODEL_PATH',
+    r"C:\Users\Ahmed Abd El Rahman\Desktop\Ai Agent Project\Random_Forest_best_model.joblib"
+)
+# Local artifact directory holding the model, model_config.json and the
+# mobilenetv2_feature_extractor.h5 saved by v4Pothos.py
+ARTIFACT_DIR = os.environ.get('ARTIFACT_DIR', os.path.dirname(MODEL_PATH))
+# With OFFLINE=1 the feature extractor is only loaded from ARTIFACT_DIR and
+# never downloads ImageNet weights
+OFFLINE = os.environ.get('OFFLINE', '0') == '1'
+# Classifier engine: 'sklearn' uses the unpickled estimator, 'flat' evaluates
+# the Random Forest with rf_engine.FlatForest. The flattened arrays are read
+# from FOREST_DIR (written by `python rf_engine.py MODEL_PATH`) when present,
+# otherwise converted from the pickled model at startup. A model saved with a
+# feature projection (projection.py) keeps it next to the flattened arrays.
+CLASSIFIER_ENGINE = os.environ.get('CLASSIFIER_ENGINE', 'sklearn')
+FOREST_DIR = os.environ.get('FOREST_DIR', os.path.splitext(MODEL_PATH)[0] + '_forest')
+
+# Model configuration written by v4Pothos.py next to the model. Its content
+# identifies the model version, so cached predictions never outlive a model.
+MODEL_CONFIG_PATH = os.path.join(ARTIFACT_DIR, 'model_config.json')
+model_config = {}
+if os.path.exists(MODEL_CONFIG_PATH):
+    with open(MODEL_CONFIG_PATH) as f:
+        model_config = json.load(f)
+MODEL_VERSION = model_config.get('version') or hashlib.sha256(
+    json.dumps(model_config, sort_keys=True).encode()
+).hexdigest()[:12]
+
+# Feature extractor backend: 'keras' builds MobileNetV2 in-process, 'tflite'
+# and 'onnx' load a model written by export_feature_extractor.py from
+# FEATURE_MODEL_PATH
+FEATURE_BACKEND = os.environ.get('FEATURE_BACKEND', 'keras')
+FEATURE_MODEL_PATH = os.environ.get('FEATURE_MODEL_PATH', '')
+FEATURE_THREADS = int(os.environ.get('FEATURE_THREADS', '0')) or None
+
+# Upload limits: images above MAX_UPLOAD_BYTES or whose header declares more
+# than MAX_IMAGE_PIXELS are rejected before they are decoded
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', str(15 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', '50000000'))
+# Large JPEGs are decoded at 1/2, 1/4 or 1/8 resolution straight from the DCT
+# coefficients, as long as the decoded image keeps at least DECODE_MIN_SIDE
+# pixels on its shorter side. Set REDUCED_DECODE=0 to always decode fully.
+REDUCED_DECODE = os.environ.get('REDUCED_DECODE', '1') == '1'
+DECODE_MIN_SIDE = int(os.environ.get('DECODE_MIN_SIDE', str(2 * max(IMAGE_SIZE))))
+
+# Exported extractors and reduced decoding produce slightly different
+# features, so cached results are kept apart per model version, feature
+# backend and decode mode
+def cache_namespace(model_version):
+    """Cache namespace for results of one model version under the current backend and decode mode"""
+    namespace = model_version if FEATURE_BACKEND == 'keras' else (
+        f"{model_version}-{FEATURE_BACKEND}-{os.path.basename(FEATURE_MODEL_PATH)}"
+    )
+    if REDUCED_DECODE:
+        namespace += f"-reduced{DECODE_MIN_SIDE}"
+    return namespace
+
+CACHE_NAMESPACE = cache_namespace(MODEL_VERSION)
+
+def load_classifier(model_path=None, forest_dir=None):
+    """Load the classifier for CLASSIFIER_ENGINE, or return None.
+
+    Defaults to MODEL_PATH and FOREST_DIR; registry versions pass their own
+    paths.
+    """
+    model_path = model_path or MODEL_PATH
+    forest_dir = forest_dir or FOREST_DIR
+    if CLASSIFIER_ENGINE == 'flat':
+        if os.path.isdir(forest_dir):
+            classifier = load_flat_classifier(forest_dir)
+            log.info("Flattened Random Forest loaded from %s", forest_dir)
+            return classifier
+        classifier = load_pickled_classifier(model_path)
+        if classifier is None:
+            return None
+        log.info("Flattening Random Forest")
+        return flatten_classifier(classifier)
+    return load_pickled_classifier(model_path)
+
+def flatten_classifier(classifier):
+    """FlatForest of a pickled Random Forest, keeping its feature projection if it has one"""
+    if isinstance(classifier, ProjectedClassifier):
+        return ProjectedClassifier(classifier.projection, FlatForest.from_sklearn(classifier.classifier))
+    return FlatForest.from_sklearn(classifier)
+
+def load_flat_classifier(forest_dir, mmap=True):
+    """Load a forest saved by save_flat_forest, with its feature projection if one was saved"""
+    forest = FlatForest.load(forest_dir, mmap=mmap)
+    projection = Projection.load(forest_dir)
+    return forest if projection is None else ProjectedClassifier(projection, forest)
+
+def save_flat_forest():
+    """Write FOREST_DIR from the pickled model unless it already exists; returns success"""
+    if os.path.isdir(FOREST_DIR):
+        return True
+    classifier = load_pickled_classifier()
+    if classifier is None:
+        return False
+    flat = flatten_classifier(classifier)
+    if isinstance(flat, ProjectedClassifier):
+        flat.classifier.save(FOREST_DIR)
+        flat.projection.save(FOREST_DIR)
+    else:
+        flat.save(FOREST_DIR)
+    log.info("Flattened Random Forest saved to %s", FOREST_DIR)
+    return True
+
+def load_pickled_classifier(model_path=None):
+    """Load the Random Forest from model_path (default MODEL_PATH), or return None"""
+    model_path = model_path or MODEL_PATH
+    if not os.path.exists(model_path):
+        log.error("Model file not found at %s", model_path)
+        return None
+    
+    log.debug("Model file found at %s", model_path)
+    try:
+        # Try loading with pickle instead of joblib
+        with open(model_path, 'rb') as file:
+            classifier = pickle.load(file)
+        log.info("Model loaded successfully with pickle")
+        return classifier
+    except Exception as e:
+        log.debug("Could not load model with pickle, trying joblib: %s", e)
+        
+        # If pickle fails, try joblib
+        try:
+            classifier = joblib.load(model_path)
+            log.info("Model loaded successfully with joblib")
+            return classifier
+        except Exception as e2:
+            log.error("Error loading model with joblib: %s", e2)
+            return None
+
+def load_feature_model():
+    """Load the MobileNetV2 feature extractor backend, or return None"""
+    try:
+        extractor = load_feature_backend(
+            FEATURE_BACKEND,
+            FEATURE_MODEL_PATH or None,
+            num_threads=FEATURE_THREADS,
+            artifact_dir=ARTIFACT_DIR,
+            offline=OFFLINE
+        )
+        log.info("MobileNetV2 loaded successfully (%s backend)", FEATURE_BACKEND)
+        return extractor
+    except Exception as e:
+        log.error("Error loading MobileNetV2: %s", e)
+        return None
+
+# Define disease classes (from your model)
+DISEASE_CLASSES = [
+    "Healthy", 
+    "Manganese Toxicity", 
+    "Bacterial wilt disease"
+]
+
+# Health scores for each disease
+HEALTH_SCORES = {
+    'Healthy': 95.0,
+    'Manganese Toxicity': 55.0,
+    'Bacterial wilt disease': 35.0
+}
+
+# Recommendations for each disease
+RECOMMENDATIONS = {
+    'Healthy': [
+        'Continue regular watering schedule',
+        'Monitor plant growth regularly',
+        'Maintain current care routine',
+        'Ensure adequate indirect sunlight',
+        'Check soil moisture before watering'
+    ],
+    'Manganese Toxicity': [
+        'Reduce manganese-containing fertilizers immediately',
+        'Check and adjust soil pH (should be 6.0-7.0)',
+        'Flush soil with clean water to remove excess minerals',
+        'Improve drainage to prevent mineral buildup',
+        'Consider repotting with fresh, well-draining soil',
+        'Avoid tap water high in minerals - use filtered water'
+    ],
+    'Bacterial wilt disease': [
+        'Isolate infected plant immediately to prevent spread',
+        'Remove all infected leaves and stems',
+        'Apply copper-based bactericide',
+        'Reduce watering frequency - bacteria thrive in wet conditions',
+        'Improve air circulation around the plant',
+        'Sterilize all tools after use',
+        'Consider propagating healthy cuttings before plant deteriorates'
+    ]
+}
+
+class ImageTooLarge(ValueError):
+    """The upload is over MAX_UPLOAD_BYTES or MAX_IMAGE_PIXELS"""
+
+# OpenCV flags for JPEG decoding at a reduced scale
+REDUCED_COLOR_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    1: cv2.IMREAD_COLOR
+}
+
+def decode_base64_image(data):
+    """Base64-decode an upload, rejecting it by its encoded length if it is over MAX_UPLOAD_BYTES"""
+    if len(data) // 4 * 3 > MAX_UPLOAD_BYTES + 3:
+        raise ImageTooLarge(f"Image is larger than {MAX_UPLOAD_BYTES} bytes")
+    image_bytes = base64.b64decode(data)
+    if len(image_bytes) > MAX_UPLOAD_BYTES:
+        raise ImageTooLarge(f"Image is larger than {MAX_UPLOAD_BYTES} bytes")
+    return image_bytes
+
+def read_image_header(image_bytes):
+    """Return (format, width, height) from the image header without decoding pixels, or None"""
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as header:
+            return header.format, header.width, header.height
+    except Exception:
+        return None
+
+def decode_scale(image_format, width, height):
+    """Pick the largest JPEG reduction that keeps DECODE_MIN_SIDE pixels on the shorter side"""
+    if not REDUCED_DECODE or image_format != 'JPEG':
+        return 1
+    for scale in (8, 4, 2):
+        if min(width, height) // scale >= DECODE_MIN_SIDE:
+            return scale
+    return 1
+
+def decode_image(image_bytes):
+    """Decode raw image bytes into a BGR uint8 image.
+
+    Raises ImageTooLarge for uploads over the byte or pixel limits, checked
+    from the length and the image header before any pixel is decoded.
+    """
+    if len(image_bytes) > MAX_UPLOAD_BYTES:
+        raise ImageTooLarge(f"Image is larger than {MAX_UPLOAD_BYTES} bytes")
+    
+    scale = 1
+    header = read_image_header(image_bytes)
+    if header is not None:
+        image_format, width, height = header
+        if width * height > MAX_IMAGE_PIXELS:
+            raise ImageTooLarge(f"Image has {width}x{height} pixels, the limit is {MAX_IMAGE_PIXELS}")
+        scale = decode_scale(image_format, width, height)
+    
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    img = cv2.imdecode(nparr, REDUCED_COLOR_FLAGS[scale])
+    
+    if img is None:
+        raise ValueError("Could not decode image")
+    
+    log.debug("Decoded image shape: %s (1/%d scale)", img.shape, scale)
+    return img
+
+def preprocess_image_bytes(image_bytes):
+    """Decode raw image bytes and preprocess them into a MobileNetV2 input (without batch axis)"""
+    try:
+        log.debug("Starting image preprocessing...")
+        
+        # Apply the same preprocessing as training
+        img = preprocess_image(decode_image(image_bytes))
+        log.debug("After MobileNetV2 preprocessing: %s", img.shape)
+        
+        return img
+        
+    except Exception as e:
+        log.exception("Error in preprocessing: %s", e)
+        raise
+
+def classify(classifier, features):
+    """Return (class indices, confidences in percent) for a batch of feature vectors"""
+    try:
+        if isinstance(classifier, (FlatForest, ProjectedClassifier)):
+            # Classes and probabilities come from the same pass over the trees
+            predictions, probabilities = classifier.predict_with_proba(features)
+        else:
+            probabilities = classifier.predict_proba(features)
+            predictions = np.asarray(classifier.classes_)[np.argmax(probabilities, axis=1)]
+        confidences = probabilities.max(axis=1) * 100
+    except Exception as e:
+        log.warning("Could not get probabilities: %s", e)
+        predictions = classifier.predict(features)
+        confidences = np.full(len(predictions), 85.0)
+    return predictions, confidences
+
+def class_probabilities(classifier, features):
+    """Return (N, len(DISEASE_CLASSES)) probabilities with one column per class index.
+
+    Classifiers trained on a subset of the classes get zero probability for
+    the missing ones, so probabilities of different models can be combined.
+    """
+    probabilities = classifier.predict_proba(features)
+    aligned = np.zeros((len(features), len(DISEASE_CLASSES)), dtype=np.float64)
+    aligned[:, np.asarray(classifier.classes_, dtype=np.int64)] = probabilities
+    return aligned
+
+def build_response(prediction, confidence):
+    """Build the JSON response for one predicted class index"""
+    disease_name = DISEASE_CLASSES[prediction]
+    return {
+        'success': True,
+        'disease': disease_name,
+        'confidence': f'{confidence:.1f}%',
+        'health_score': HEALTH_SCORES.get(disease_name, 50.0),
+        'recommendations': RECOMMENDATIONS.get(disease_name, []),
+        'model_type': 'Random Forest with MobileNetV2 Features'
+    }
+
@@ -0,0 +1,87 @@
+"""Image preprocessing shared by app.py and the training scripts.
+
+The output must stay bit-identical to the preprocessing the saved Random
+Forest was trained with: resize to IMAGE_SIZE, 3x3 Gaussian blur, histogram
+equalisation of the luma channel in YCrCb, per-image min-max normalisation
+to [0, 1] in float32, then MobileNetV2's `preprocess_input` scaling.
+"""
+import cv2
+import numpy as np
+
+# Image processing settings (same as training)
+IMAGE_SIZE = (128, 128)
+
+
+def basic_preprocessing(img):
+    """Apply the same preprocessing as in training to one BGR uint8 image"""
+    img = cv2.resize(img, IMAGE_SIZE)
+    img = cv2.GaussianBlur(img, (3, 3), 0)
+    ycrcb = cv2.cvtColor(img, cv2.COLOR_BGR2YCrCb)
+    ycrcb[:, :, 0] = cv2.equalizeHist(ycrcb[:, :, 0])
+    img = cv2.cvtColor(ycrcb, cv2.COLOR_YCrCb2BGR)
+    img = cv2.normalize(img.astype("float32"), None, 0, 1, cv2.NORM_MINMAX)
+    return img
+
+
+def mobilenet_preprocess_input(x):
+    """keras' mobilenet_v2.preprocess_input, in place on a float32 array"""
+    np.divide(x, 127.5, out=x)
+    np.subtract(x, 1., out=x)
+    return x
+
+
+def allocate_batch(n):
+    """Allocate an output buffer for preprocess_batch"""
+    width, height = IMAGE_SIZE
+    return np.empty((n, height, width, 3), dtype=np.float32)
+
+
+def preprocess_batch(images, out=None, augment=None):
+    """Turn BGR uint8 images into a float32 (N, H, W, 3) MobileNetV2 input batch.
+
+    `images` is an (N, H, W, 3) uint8 array or a sequence of images of any
+    size. Resizing, blurring and equalisation run per image into shared
+    batch buffers, the colour conversions run once over the whole batch,
+    and the final scaling is done in place in `out` (allocated if not
+    given). `augment(img, index)`, if set, is applied to each normalised
+    image before scaling, as in training. The result equals running
+    `basic_preprocessing` then `preprocess_input` on each image.
+    """
+    n = len(images)
+    width, height = IMAGE_SIZE
+    if out is None:
+        out = allocate_batch(n)
+    elif out.shape != (n, height, width, 3) or out.dtype != np.float32:
+        raise ValueError(f"out must be a float32 array of shape {(n, height, width, 3)}")
+    if n == 0:
+        return out
+
+    resized = np.empty((n, height, width, 3), dtype=np.uint8)
+    blurred = np.empty_like(resized)
+    for i, img in enumerate(images):
+        cv2.resize(img, IMAGE_SIZE, dst=resized[i])
+        cv2.GaussianBlur(resized[i], (3, 3), 0, dst=blurred[i])
+
+    # Colour conversions are per pixel, so one call covers the whole batch
+    rows = (n * height, width, 3)
+    ycrcb = cv2.cvtColor(blurred.reshape(rows), cv2.COLOR_BGR2YCrCb).reshape(blurred.shape)
+    for i in range(n):
+        ycrcb[i, :, :, 0] = cv2.equalizeHist(np.ascontiguousarray(ycrcb[i, :, :, 0]))
+    bgr = resized.reshape(rows)
+    cv2.cvtColor(ycrcb.reshape(rows), cv2.COLOR_YCrCb2BGR, dst=bgr)
+
+    # Min-max normalisation is per image
+    as_float = bgr.reshape(resized.shape).astype(np.float32)
+    for i in range(n):
+        cv2.normalize(as_float[i], out[i], 0, 1, cv2.NORM_MINMAX)
+        if augment is not None:
+            out[i] = augment(out[i], i)
+
+    return mobilenet_preprocess_input(out)
+
+
+def preprocess_image(img, augment=None):
+    """Preprocess one BGR uint8 image into a float32 (H, W, 3) MobileNetV2 input"""
+    if augment is not None:
+        return preprocess_batch([img], augment=lambda x, _: augment(x))[0]
+    return preprocess_batch([img])[0]
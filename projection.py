@@ -0,0 +1,127 @@
+"""Learned linear projection of the MobileNetV2 features.
+
+The classifier normally sees the raw 1280-dim float32 MobileNetV2 vector
+(5 KB per image), most of which is redundant. A Projection maps it to a
+few dozen or hundred principal components and stores both its components
+and the projected features as float16, so the trees split over a small
+feature space and a projected vector costs 2 bytes per dimension.
+
+ProjectedClassifier pairs a projection with the classifier trained on its
+output. It takes raw feature vectors like any other classifier, so a model
+saved with a projection (v4Pothos.py with PROJECTION_DIM or
+--projection-dim) is served by app.py, serve.py and score_bulk.py without
+changes; the projection runs right before the trees. With
+CLASSIFIER_ENGINE=flat the projection is saved next to the flattened forest.
+"""
+import os
+
+import numpy as np
+
+MEAN_FILE = 'projection_mean.npy'
+COMPONENTS_FILE = 'projection_components.npy'
+
+
+class Projection:
+    """Centre and project feature vectors onto float16 components.
+
+    `mean` has one value per input feature, `components` one row per
+    output dimension. transform() returns float16, the form projected
+    features are stored and compared in; training and serving therefore
+    see exactly the same values.
+    """
+
+    def __init__(self, mean, components):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.asarray(components, dtype=np.float16)
+        self._weights = self.components.T.astype(np.float32)
+
+    @classmethod
+    def fit(cls, X, dim, random_state=42):
+        """Fit a PCA projection to `dim` dimensions on feature vectors X"""
+        from sklearn.decomposition import PCA
+        dim = min(int(dim), X.shape[0], X.shape[1])
+        pca = PCA(n_components=dim, random_state=random_state).fit(X)
+        projection = cls(pca.mean_, pca.components_)
+        projection.explained_variance = float(pca.explained_variance_ratio_.sum())
+        return projection
+
+    @property
+    def n_features_in_(self):
+        return self.components.shape[1]
+
+    @property
+    def dim(self):
+        return self.components.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.mean.nbytes + self.components.nbytes
+
+    def transform(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"Expected X with {self.n_features_in_} features, got shape {X.shape}")
+        return ((X - self.mean) @ self._weights).astype(np.float16)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, MEAN_FILE), self.mean)
+        np.save(os.path.join(directory, COMPONENTS_FILE), self.components)
+
+    @classmethod
+    def load(cls, directory):
+        """Load a projection saved in directory, or return None if it holds none"""
+        path = os.path.join(directory, COMPONENTS_FILE)
+        if not os.path.exists(path):
+            return None
+        return cls(np.load(os.path.join(directory, MEAN_FILE)), np.load(path))
+
+    # The float32 copy of the components is rebuilt on load, not pickled
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_weights']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._weights = self.components.T.astype(np.float32)
+
+
+class ProjectedClassifier:
+    """A classifier trained on projected features, called with raw ones"""
+
+    def __init__(self, projection, classifier):
+        self.projection = projection
+        self.classifier = classifier
+
+    @property
+    def classes_(self):
+        return self.classifier.classes_
+
+    @property
+    def n_features_in_(self):
+        return self.projection.n_features_in_
+
+    @property
+    def nbytes(self):
+        # Estimators without array sizes are measured by registry.classifier_nbytes
+        inner = getattr(self.classifier, 'nbytes', None)
+        return None if inner is None else self.projection.nbytes + inner
+
+    def fit(self, X, y):
+        self.classifier.fit(self.projection.transform(X), y)
+        return self
+
+    def predict_proba(self, X):
+        return self.classifier.predict_proba(self.projection.transform(X))
+
+    def predict_with_proba(self, X):
+        """Return (classes, probabilities), in one pass when the classifier supports it"""
+        projected = self.projection.transform(X)
+        if hasattr(self.classifier, 'predict_with_proba'):
+            return self.classifier.predict_with_proba(projected)
+        proba = self.classifier.predict_proba(projected)
+        return np.asarray(self.classes_)[np.argmax(proba, axis=1)], proba
+
+    def predict(self, X):
+        return self.classifier.predict(self.projection.transform(X))
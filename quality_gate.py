@@ -0,0 +1,166 @@
+"""Cheap image-quality checks run before the models.
+
+Blurry, badly exposed and non-plant photos still get a confident-looking
+label from MobileNetV2 and the Random Forest. QualityGate measures a
+downscaled copy of the decoded image with a few OpenCV calls (one or two
+milliseconds for a decoded upload) and names what is wrong with it:
+
+    blurry        variance of the Laplacian below min_sharpness
+    too_dark      mean brightness below min_brightness, or more than
+                  max_clipped of the pixels nearly black
+    overexposed   mean brightness above max_brightness, or more than
+                  max_clipped of the pixels nearly white
+    no_plant      less than min_leaf_coverage of the pixels have a leaf
+                  colour (HSV hue in leaf_hue, enough saturation and value)
+
+The leaf hue range reaches from yellow to green so yellowed and spotted
+leaves still count as plant. Any threshold set to 0 is not checked.
+"""
+import threading
+import time
+
+import cv2
+import numpy as np
+
+REASONS = ('blurry', 'too_dark', 'overexposed', 'no_plant')
+
+MESSAGES = {
+    'blurry': 'The photo is blurry. Hold the camera steady and tap to focus on the leaf.',
+    'too_dark': 'The photo is too dark. Take it in better light.',
+    'overexposed': 'The photo is overexposed. Avoid direct sunlight or flash glare on the leaf.',
+    'no_plant': 'No leaf was found in the photo. Fill the frame with the affected leaf.',
+}
+
+
+class QualityReport:
+    """Outcome of QualityGate.check: failed reasons and the measured values"""
+
+    __slots__ = ('reasons', 'measures', 'seconds')
+
+    def __init__(self, reasons, measures, seconds):
+        self.reasons = reasons
+        self.measures = measures
+        self.seconds = seconds
+
+    @property
+    def ok(self):
+        return not self.reasons
+
+    def describe(self):
+        return dict(self.measures, passed=self.ok, reasons=list(self.reasons))
+
+
+class QualityGate:
+    """Measures photos against configurable thresholds and counts what it rejects.
+
+    `size` is the longest side of the copy the measures are taken on. The
+    gate also keeps a running estimate of the model time per image (fed by
+    `note_model_seconds`) to report how much inference time rejections
+    saved.
+    """
+
+    def __init__(self, min_sharpness=25.0, min_brightness=35.0, max_brightness=225.0, max_clipped=0.5,
+                 min_leaf_coverage=0.05, leaf_hue=(20, 95), size=256):
+        self.min_sharpness = float(min_sharpness)
+        self.min_brightness = float(min_brightness)
+        self.max_brightness = float(max_brightness)
+        self.max_clipped = float(max_clipped)
+        self.min_leaf_coverage = float(min_leaf_coverage)
+        self.leaf_hue = tuple(int(h) for h in leaf_hue)
+        self.size = int(size)
+
+        self._lock = threading.Lock()
+        self._model_seconds = None
+
+        # Counters
+        self.checked = 0
+        self.rejected = {reason: 0 for reason in REASONS}
+        self.rejected_images = 0
+        self.gate_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def measure(self, img):
+        """Sharpness, brightness, clipped-pixel and leaf-coverage measures of a BGR uint8 image"""
+        height, width = img.shape[:2]
+        scale = self.size / max(height, width)
+        if scale < 1:
+            img = cv2.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))),
+                             interpolation=cv2.INTER_AREA)
+
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        histogram = np.bincount(gray.ravel(), minlength=256) / gray.size
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        leaf = cv2.inRange(hsv, (self.leaf_hue[0], 40, 40), (self.leaf_hue[1], 255, 255))
+        return {
+            'sharpness': float(cv2.Laplacian(gray, cv2.CV_32F).var()),
+            'brightness': float(np.dot(histogram, np.arange(256))),
+            'dark_fraction': float(histogram[:16].sum()),
+            'bright_fraction': float(histogram[240:].sum()),
+            'leaf_coverage': float(np.count_nonzero(leaf)) / leaf.size,
+        }
+
+    def check(self, img):
+        """Measure an image and return a QualityReport naming every failed check"""
+        start = time.perf_counter()
+        m = self.measure(img)
+        reasons = []
+        if self.min_sharpness and m['sharpness'] < self.min_sharpness:
+            reasons.append('blurry')
+        if (self.min_brightness and m['brightness'] < self.min_brightness) or \
+                (self.max_clipped and m['dark_fraction'] > self.max_clipped):
+            reasons.append('too_dark')
+        if (self.max_brightness and m['brightness'] > self.max_brightness) or \
+                (self.max_clipped and m['bright_fraction'] > self.max_clipped):
+            reasons.append('overexposed')
+        if self.min_leaf_coverage and m['leaf_coverage'] < self.min_leaf_coverage:
+            reasons.append('no_plant')
+        seconds = time.perf_counter() - start
+
+        with self._lock:
+            self.checked += 1
+            self.gate_seconds += seconds
+            if reasons:
+                self.rejected_images += 1
+                for reason in reasons:
+                    self.rejected[reason] += 1
+                self.saved_seconds += self._model_seconds or 0.0
+        measures = {k: round(v, 4) for k, v in m.items()}
+        return QualityReport(reasons, measures, seconds)
+
+    def note_model_seconds(self, seconds_per_image):
+        """Update the running estimate of model time per image (exponential moving average)"""
+        with self._lock:
+            if self._model_seconds is None:
+                self._model_seconds = seconds_per_image
+            else:
+                self._model_seconds += 0.05 * (seconds_per_image - self._model_seconds)
+
+    def retake_response(self, report):
+        """JSON response asking the user for a better photo instead of a diagnosis"""
+        return {
+            'success': False,
+            'retake': True,
+            'error': ' '.join(MESSAGES[reason] for reason in report.reasons),
+            'quality': report.describe()
+        }
+
+    def stats(self):
+        """Return check, rejection and time-saved counters"""
+        with self._lock:
+            return {
+                'checked': self.checked,
+                'rejected': self.rejected_images,
+                'rejected_by_reason': dict(self.rejected),
+                'gate_seconds': self.gate_seconds,
+                'model_seconds_per_image': self._model_seconds,
+                'saved_seconds': self.saved_seconds,
+                'thresholds': {
+                    'min_sharpness': self.min_sharpness,
+                    'min_brightness': self.min_brightness,
+                    'max_brightness': self.max_brightness,
+                    'max_clipped': self.max_clipped,
+                    'min_leaf_coverage': self.min_leaf_coverage,
+                    'leaf_hue': list(self.leaf_hue),
+                    'size': self.size
+                }
+            }
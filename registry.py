@@ -0,0 +1,358 @@
+"""Versioned model registry with hot-swap and traffic splitting.
+
+Layout of REGISTRY_DIR:
+    versions/<version>/manifest.json
+    versions/<version>/<classifier>.joblib
+    versions/<version>/mobilenetv2_feature_extractor.h5   (when published)
+    routing.json
+
+A version is published once and never modified: its files are copied into
+a temporary directory that is renamed into place. `routing.json` names the
+active version and an optional candidate that receives
+`candidate_fraction` of the traffic; it is replaced atomically, and the
+serving process swaps classifiers when it changes.
+
+The manifest is built from the model_config.json written by v4Pothos.py
+(categories, image size, n_features, accuracy, library versions) plus the
+classifier file name and its SHA-256. The version name defaults to the
+first 12 hex digits of that hash.
+
+Usage:
+    python registry.py publish ARTIFACT_DIR [--model FILE.joblib] [--version V] [--activate]
+    python registry.py list
+    python registry.py activate VERSION
+    python registry.py candidate VERSION --fraction 0.1
+    python registry.py candidate --clear
+"""
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import sys
+import threading
+import time
+
+REGISTRY_DIR = os.environ.get('REGISTRY_DIR', '')
+
+MANIFEST_FILE = 'manifest.json'
+ROUTING_FILE = 'routing.json'
+FEATURE_EXTRACTOR_FILE = 'mobilenetv2_feature_extractor.h5'
+
+# model_config.json keys copied into the manifest
+CONFIG_KEYS = ('model_type', 'categories', 'image_size', 'n_features', 'accuracy',
+               'sklearn_version', 'numpy_version', 'tensorflow_version')
+
+
+class RegistryError(ValueError):
+    """A version is missing, malformed or incompatible with the running server"""
+
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_json_atomic(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+class ModelRegistry:
+    """Published model versions and the routing between them, stored on disk"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.versions_dir = os.path.join(directory, 'versions')
+        os.makedirs(self.versions_dir, exist_ok=True)
+
+    def version_dir(self, version):
+        return os.path.join(self.versions_dir, version)
+
+    def manifest(self, version):
+        """Return the manifest of a published version"""
+        path = os.path.join(self.version_dir(version), MANIFEST_FILE)
+        if not os.path.exists(path):
+            raise RegistryError(f"Version {version} is not in the registry at {self.directory}")
+        with open(path) as f:
+            return json.load(f)
+
+    def versions(self):
+        """Return the manifests of all published versions, oldest first"""
+        manifests = []
+        for name in os.listdir(self.versions_dir):
+            if os.path.exists(os.path.join(self.version_dir(name), MANIFEST_FILE)):
+                manifests.append(self.manifest(name))
+        return sorted(manifests, key=lambda m: m['created'])
+
+    def publish(self, classifier_path, config, feature_model_path=None, version=None):
+        """Copy a trained classifier (and optionally its extractor) in as a new version.
+
+        Returns the manifest. Publishing a version that already exists with
+        the same classifier is a no-op; reusing a name for a different
+        classifier raises RegistryError.
+        """
+        sha256 = _sha256_file(classifier_path)
+        version = version or sha256[:12]
+        if os.path.exists(self.version_dir(version)):
+            manifest = self.manifest(version)
+            if manifest['classifier_sha256'] != sha256:
+                raise RegistryError(f"Version {version} already exists with a different classifier")
+            return manifest
+
+        manifest = {key: config[key] for key in CONFIG_KEYS if key in config}
+        manifest.update({
+            'version': version,
+            'created': time.time(),
+            'classifier': os.path.basename(classifier_path),
+            'classifier_sha256': sha256,
+            'classifier_bytes': os.path.getsize(classifier_path),
+            'feature_extractor': None
+        })
+
+        tmp_dir = self.version_dir(version) + f'.tmp{os.getpid()}'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        try:
+            shutil.copy2(classifier_path, os.path.join(tmp_dir, manifest['classifier']))
+            if feature_model_path and os.path.exists(feature_model_path):
+                shutil.copy2(feature_model_path, os.path.join(tmp_dir, FEATURE_EXTRACTOR_FILE))
+                manifest['feature_extractor'] = FEATURE_EXTRACTOR_FILE
+            _write_json_atomic(os.path.join(tmp_dir, MANIFEST_FILE), manifest)
+            os.rename(tmp_dir, self.version_dir(version))
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        return manifest
+
+    def publish_artifacts(self, artifact_dir, model_file=None, version=None):
+        """Publish the model_config.json, classifier and extractor saved by v4Pothos.py"""
+        config_path = os.path.join(artifact_dir, 'model_config.json')
+        if not os.path.exists(config_path):
+            raise RegistryError(f"No model_config.json in {artifact_dir}")
+        with open(config_path) as f:
+            config = json.load(f)
+
+        if model_file is None:
+            candidates = sorted(f for f in os.listdir(artifact_dir) if f.endswith('_best_model.joblib'))
+            if len(candidates) != 1:
+                raise RegistryError(f"Expected one *_best_model.joblib in {artifact_dir}, found {candidates}; "
+                                    f"pass --model")
+            model_file = candidates[0]
+        return self.publish(
+            os.path.join(artifact_dir, model_file),
+            config,
+            os.path.join(artifact_dir, FEATURE_EXTRACTOR_FILE),
+            version=version
+        )
+
+    def routing_path(self):
+        return os.path.join(self.directory, ROUTING_FILE)
+
+    def routing(self):
+        """Return {'active', 'candidate', 'candidate_fraction'}; versions are None when unset"""
+        routing = {'active': None, 'candidate': None, 'candidate_fraction': 0.0}
+        if os.path.exists(self.routing_path()):
+            with open(self.routing_path()) as f:
+                routing.update(json.load(f))
+        return routing
+
+    def routing_mtime(self):
+        try:
+            return os.stat(self.routing_path()).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def set_routing(self, **changes):
+        """Update the active version, candidate or candidate fraction atomically"""
+        routing = self.routing()
+        routing.update(changes)
+        for role in ('active', 'candidate'):
+            if routing[role] is not None:
+                self.manifest(routing[role])
+        fraction = float(routing['candidate_fraction'])
+        if not 0.0 <= fraction <= 1.0:
+            raise RegistryError(f"candidate_fraction must be between 0 and 1, got {fraction}")
+        routing['candidate_fraction'] = fraction if routing['candidate'] is not None else 0.0
+        _write_json_atomic(self.routing_path(), routing)
+        return routing
+
+
+def check_compatible(manifest, categories, image_size, n_features):
+    """Raise RegistryError if a version cannot be served by the running feature extractor"""
+    version = manifest['version']
+    if list(manifest.get('categories', categories)) != list(categories):
+        raise RegistryError(f"Version {version} has categories {manifest['categories']}, "
+                            f"the server expects {list(categories)}")
+    if list(manifest.get('image_size', image_size)) != list(image_size):
+        raise RegistryError(f"Version {version} was trained on {manifest['image_size']} images, "
+                            f"the server uses {list(image_size)}")
+    if manifest.get('n_features', n_features) != n_features:
+        raise RegistryError(f"Version {version} expects {manifest['n_features']} features, "
+                            f"the extractor produces {n_features}")
+
+
+def process_rss_bytes():
+    """Resident set size of this process, or None where /proc is not available"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def classifier_nbytes(classifier):
+    """Approximate memory held by a classifier's arrays.
+
+    FlatForest reports its array sizes (shared page cache when it is
+    memory-mapped); other estimators are measured by their pickled size,
+    which is dominated by the same NumPy buffers.
+    """
+    nbytes = getattr(classifier, 'nbytes', None)
+    if nbytes is not None:
+        return int(nbytes)
+    return len(pickle.dumps(classifier, protocol=4))
+
+
+class LoadedModel:
+    """One classifier version resident in the serving process"""
+
+    def __init__(self, version, classifier, manifest, cache_namespace, path, rss_delta=None):
+        self.version = version
+        self.classifier = classifier
+        self.manifest = manifest
+        self.cache_namespace = cache_namespace
+        self.path = path
+        self.nbytes = classifier_nbytes(classifier)
+        self.rss_delta = rss_delta
+        self.loaded_at = time.time()
+
+    def describe(self):
+        return {
+            'version': self.version,
+            'path': self.path,
+            'model_type': self.manifest.get('model_type'),
+            'accuracy': self.manifest.get('accuracy'),
+            'memory_bytes': self.nbytes,
+            'projection_dim': getattr(getattr(self.classifier, 'projection', None), 'dim', None),
+            'rss_delta_bytes': self.rss_delta,
+            'loaded_at': self.loaded_at
+        }
+
+
+class ModelRouter:
+    """Active and candidate classifiers with atomic swapping.
+
+    A request picks its LoadedModel once with `route` and keeps the
+    reference until it has its result, so `swap` never affects requests in
+    flight; a replaced classifier is freed when its last request finishes.
+    Routing is keyed on the image digest, so the same image always goes to
+    the same version and its cache entry stays valid.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.active = None
+        self.candidate = None
+        self.candidate_fraction = 0.0
+        self.swaps = 0
+
+    def swap(self, active, candidate=None, candidate_fraction=0.0):
+        with self._lock:
+            self.active = active
+            self.candidate = candidate
+            self.candidate_fraction = candidate_fraction if candidate is not None else 0.0
+            self.swaps += 1
+
+    def route(self, digest):
+        """Return (LoadedModel, role) for an image digest (hex SHA-256)"""
+        with self._lock:
+            active, candidate, fraction = self.active, self.candidate, self.candidate_fraction
+        if candidate is not None and int(digest[:8], 16) < fraction * 0x100000000:
+            return candidate, 'candidate'
+        return active, 'active'
+
+    def loaded(self):
+        """Return the resident models as {role: LoadedModel}"""
+        with self._lock:
+            models = {'active': self.active, 'candidate': self.candidate}
+        return {role: m for role, m in models.items() if m is not None}
+
+    def stats(self):
+        models = self.loaded()
+        return {
+            'active': models['active'].describe() if 'active' in models else None,
+            'candidate': models['candidate'].describe() if 'candidate' in models else None,
+            'candidate_fraction': self.candidate_fraction,
+            'resident_memory_bytes': sum(m.nbytes for m in models.values()),
+            'swaps': self.swaps
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--registry', default=REGISTRY_DIR, help='registry directory (default: $REGISTRY_DIR)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    publish = commands.add_parser('publish', help='publish the artifacts saved by v4Pothos.py')
+    publish.add_argument('artifact_dir')
+    publish.add_argument('--model', default=None, help='classifier file inside artifact_dir')
+    publish.add_argument('--version', default=None)
+    publish.add_argument('--activate', action='store_true')
+
+    commands.add_parser('list', help='list published versions and the routing')
+
+    activate = commands.add_parser('activate', help='make a version the active one')
+    activate.add_argument('version')
+
+    candidate = commands.add_parser('candidate', help='route a fraction of traffic to a version')
+    candidate.add_argument('version', nargs='?')
+    candidate.add_argument('--fraction', type=float, default=0.1)
+    candidate.add_argument('--clear', action='store_true')
+
+    args = parser.parse_args()
+    if not args.registry:
+        parser.error('set REGISTRY_DIR or pass --registry')
+    registry = ModelRegistry(args.registry)
+
+    try:
+        if args.command == 'publish':
+            manifest = registry.publish_artifacts(args.artifact_dir, args.model, args.version)
+            print(f"Published version {manifest['version']}")
+            if args.activate or registry.routing()['active'] is None:
+                registry.set_routing(active=manifest['version'])
+                print(f"Active version: {manifest['version']}")
+        elif args.command == 'list':
+            routing = registry.routing()
+            for manifest in registry.versions():
+                role = {routing['active']: 'active', routing['candidate']: 'candidate'}.get(manifest['version'], '')
+                created = time.strftime('%Y-%m-%d %H:%M', time.localtime(manifest['created']))
+                print(f"{manifest['version']:<14} {created}  {manifest.get('model_type', '?'):<18} "
+                      f"accuracy {manifest.get('accuracy', float('nan')):.4f}  {role}")
+            print(f"Candidate fraction: {routing['candidate_fraction']}")
+        elif args.command == 'activate':
+            registry.set_routing(active=args.version)
+            print(f"Active version: {args.version}")
+        elif args.command == 'candidate':
+            if args.clear:
+                registry.set_routing(candidate=None, candidate_fraction=0.0)
+                print("Candidate cleared")
+            elif args.version is None:
+                parser.error('pass a version or --clear')
+            else:
+                registry.set_routing(candidate=args.version, candidate_fraction=args.fraction)
+                print(f"Candidate {args.version} receives {args.fraction:.0%} of traffic")
+    except RegistryError as e:
+        print(f"ERROR: {e}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
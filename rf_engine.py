@@ -0,0 +1,220 @@
+"""Flattened Random Forest inference.
+
+FlatForest stores every tree of a fitted sklearn RandomForestClassifier in a
+handful of contiguous NumPy arrays and evaluates all trees for a whole batch
+in one vectorised pass. Only what inference needs is kept: split features,
+thresholds, child indices and per-leaf class probabilities.
+
+Usage:
+    python rf_engine.py MODEL.joblib [--output MODEL_forest/]
+
+converts a saved classifier and checks that FlatForest gives the same
+classes and probabilities as sklearn on the bundled sample images. A model
+saved with a feature projection (projection.ProjectedClassifier) has its
+forest flattened and its projection saved alongside.
+"""
+import argparse
+import glob
+import os
+import sys
+
+import numpy as np
+
+
+class FlatForest:
+    """Random Forest flattened into contiguous arrays.
+
+    Nodes of all trees are concatenated. `left`/`right` hold global node
+    indices; a leaf points to itself on both sides, so walking a sample
+    down `max_depth` times always ends on its leaf.
+    """
+
+    ARRAYS = ('feature', 'threshold', 'left', 'right', 'leaf_proba', 'roots', 'classes')
+
+    def __init__(self, feature, threshold, left, right, leaf_proba, roots, max_depth, classes, n_features):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.leaf_proba = leaf_proba
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.classes_ = classes
+        self.n_features_in_ = int(n_features)
+
+    @classmethod
+    def from_sklearn(cls, forest):
+        """Build a FlatForest from a fitted RandomForestClassifier"""
+        if forest.n_outputs_ != 1:
+            raise ValueError("Only single-output forests are supported")
+
+        features, thresholds, lefts, rights, probas, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            n = tree.node_count
+            nodes = np.arange(n)
+            is_leaf = tree.children_left == -1
+
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(tree.threshold)
+            lefts.append(np.where(is_leaf, nodes, tree.children_left) + offset)
+            rights.append(np.where(is_leaf, nodes, tree.children_right) + offset)
+
+            # Same normalisation as DecisionTreeClassifier.predict_proba
+            value = tree.value[:, 0, :]
+            totals = value.sum(axis=1, keepdims=True)
+            totals[totals == 0] = 1
+            probas.append(value / totals)
+
+            roots.append(offset)
+            offset += n
+            max_depth = max(max_depth, tree.max_depth)
+
+        index_dtype = np.int32 if offset < 2 ** 31 else np.int64
+        feature_dtype = np.int16 if forest.n_features_in_ < 2 ** 15 else np.int32
+        return cls(
+            feature=np.concatenate(features).astype(feature_dtype),
+            threshold=np.concatenate(thresholds).astype(np.float64),
+            left=np.concatenate(lefts).astype(index_dtype),
+            right=np.concatenate(rights).astype(index_dtype),
+            leaf_proba=np.concatenate(probas).astype(np.float64),
+            roots=np.asarray(roots, dtype=index_dtype),
+            max_depth=max_depth,
+            classes=np.asarray(forest.classes_),
+            n_features=forest.n_features_in_,
+        )
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.feature, self.threshold, self.left, self.right,
+                                      self.leaf_proba, self.roots, self.classes_))
+
+    def apply(self, X):
+        """Return the (n_samples, n_trees) global leaf index reached in every tree"""
+        # sklearn compares float32 features against float64 thresholds
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"Expected X with {self.n_features_in_} features, got shape {X.shape}")
+
+        rows = np.arange(len(X))[:, np.newaxis]
+        nodes = np.broadcast_to(self.roots, (len(X), self.n_trees)).copy()
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return nodes
+
+    def predict_proba(self, X):
+        """Mean of the per-tree leaf probabilities, as RandomForestClassifier"""
+        leaves = self.apply(X)
+        proba = np.zeros((leaves.shape[0], len(self.classes_)), dtype=np.float64)
+        for t in range(self.n_trees):
+            proba += self.leaf_proba[leaves[:, t]]
+        proba /= self.n_trees
+        return proba
+
+    def predict_with_proba(self, X):
+        """Return (classes, probabilities) from a single pass over the trees"""
+        proba = self.predict_proba(X)
+        return self.classes_[np.argmax(proba, axis=1)], proba
+
+    def predict(self, X):
+        return self.predict_with_proba(X)[0]
+
+    def save(self, directory):
+        """Save as one .npy file per array so load() can memory-map them"""
+        os.makedirs(directory, exist_ok=True)
+        arrays = dict(feature=self.feature, threshold=self.threshold, left=self.left,
+                      right=self.right, leaf_proba=self.leaf_proba, roots=self.roots,
+                      classes=self.classes_)
+        for name in self.ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), arrays[name])
+        meta = np.asarray([self.max_depth, self.n_features_in_], dtype=np.int64)
+        np.save(os.path.join(directory, "meta.npy"), meta)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """Load a saved forest; with mmap the node arrays are shared through the page cache"""
+        mode = 'r' if mmap else None
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mode)
+                  for name in cls.ARRAYS}
+        max_depth, n_features = np.load(os.path.join(directory, "meta.npy"))
+        return cls(
+            feature=arrays['feature'], threshold=arrays['threshold'],
+            left=arrays['left'], right=arrays['right'], leaf_proba=arrays['leaf_proba'],
+            roots=arrays['roots'], max_depth=max_depth, classes=np.asarray(arrays['classes']),
+            n_features=n_features,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('model_path')
+    parser.add_argument('--output', default='')
+    args = parser.parse_args()
+
+    import pickle
+    import time
+
+    import joblib
+
+    forest = joblib.load(args.model_path)
+    projection = getattr(forest, 'projection', None)
+    if projection is not None:
+        forest = forest.classifier
+    flat = FlatForest.from_sklearn(forest)
+    output = args.output or os.path.splitext(args.model_path)[0] + '_forest'
+    flat.save(output)
+    if projection is not None:
+        projection.save(output)
+        print(f"Feature projection: {projection.n_features_in_} -> {projection.dim} dimensions")
+    flat = FlatForest.load(output)
+
+    pickled = len(pickle.dumps(forest, protocol=4))
+    print(f"Trees: {flat.n_trees}, nodes: {len(flat.feature)}, max depth: {flat.max_depth}")
+    print(f"Pickled estimator: {pickled / 1e6:.2f} MB, flat arrays: {flat.nbytes / 1e6:.2f} MB")
+    print(f"Saved: {output}")
+
+    # Conformance check on the bundled sample images
+    from feature_backends import build_mobilenet_v2, KerasBackend
+    from preprocessing import preprocess_batch
+    import cv2
+
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    paths = sorted(glob.glob(os.path.join(base_dir, 'Ai Agent Project', 'pothos*.jpg')))
+    images = [img for img in (cv2.imread(p) for p in paths) if img is not None]
+    features = KerasBackend(build_mobilenet_v2()).predict(preprocess_batch(images))
+    if projection is not None:
+        features = projection.transform(features)
+
+    expected_proba = forest.predict_proba(features)
+    expected_classes = forest.predict(features)
+    classes, proba = flat.predict_with_proba(features)
+
+    start = time.perf_counter()
+    for _ in range(20):
+        forest.predict_proba(features)
+    sklearn_ms = (time.perf_counter() - start) / 20 * 1000
+    start = time.perf_counter()
+    for _ in range(20):
+        flat.predict_with_proba(features)
+    flat_ms = (time.perf_counter() - start) / 20 * 1000
+    print(f"Batch of {len(features)}: sklearn {sklearn_ms:.2f} ms, FlatForest {flat_ms:.2f} ms")
+
+    same_classes = np.array_equal(classes, expected_classes)
+    max_diff = float(np.max(np.abs(proba - expected_proba)))
+    print(f"Identical classes: {same_classes}, max probability difference: {max_diff:.3g}")
+    if not same_classes or max_diff > 1e-12:
+        print("CONFORMANCE CHECK FAILED")
+        return 1
+    print("Conformance check passed")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
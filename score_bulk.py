@@ -0,0 +1,287 @@
+"""Headless bulk scoring of image directories and archives.
+
+Usage:
+    python score_bulk.py SOURCE [SOURCE ...] --output results.csv
+                         [--batch-size 64] [--workers N] [--version V] [--restart]
+
+SOURCE may be a directory (walked recursively), a .tar/.tar.gz/.tgz or .zip
+archive, or a single image. Images are enumerated in a stable order, read
+and preprocessed by a process pool with inference.decode_image and the
+shared preprocessing, and scored in batches by the same feature extractor
+backend and classifier as app.py. The classifier is the registry version
+given by --version, else the active version in REGISTRY_DIR, else
+MODEL_PATH.
+
+Results are appended to --output after every batch: CSV, or Parquet when
+the output ends in .parquet (one part file per batch in that directory,
+requires pyarrow). A checkpoint next to the output records how many images
+are done, so rerunning the same command resumes where an interrupted run
+stopped; --restart starts over. Throughput in images per second is printed
+while running and at the end.
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import tarfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import inference
+from preprocessing import preprocess_image
+from registry import REGISTRY_DIR, ModelRegistry
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+COLUMNS = ('image', 'disease', 'class_index', 'confidence', 'model_version', 'error')
+PROGRESS_SECONDS = 10
+
+
+def iter_images(sources):
+    """Yield (image id, path, read) for every image in the sources, in a stable order.
+
+    `path` is set for plain files, which workers read themselves; archive
+    members have `read`, a callable returning their bytes. Images skipped
+    on resume are never read.
+    """
+    for source in sources:
+        if os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        path = os.path.join(root, name)
+                        yield path, path, None
+        elif zipfile.is_zipfile(source):
+            with zipfile.ZipFile(source) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                        yield f"{source}!{info.filename}", None, lambda info=info: archive.read(info)
+        elif tarfile.is_tarfile(source):
+            with tarfile.open(source) as archive:
+                for member in archive:
+                    if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS):
+                        yield (f"{source}!{member.name}", None,
+                               lambda member=member: archive.extractfile(member).read())
+        elif os.path.isfile(source):
+            yield source, source, None
+        else:
+            print(f"WARNING: {source} is not a directory, archive or file; skipping it")
+
+
+def init_worker():
+    import cv2
+    cv2.setNumThreads(1)
+
+
+def load_image(task):
+    """Worker: read, decode and preprocess one image; returns (input, error)"""
+    path, data = task
+    try:
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+        return preprocess_image(inference.decode_image(data)), None
+    except Exception as e:
+        return None, str(e) or type(e).__name__
+
+
+class CsvOutput:
+    """Appends rows to a CSV file; the position is the file size in bytes"""
+
+    def __init__(self, path, position):
+        exists = os.path.exists(path)
+        self.file = open(path, 'r+' if exists else 'w', newline='')
+        if exists:
+            # Drop rows written after the last checkpoint
+            self.file.truncate(position)
+            self.file.seek(position)
+        self.writer = csv.writer(self.file)
+        if self.file.tell() == 0:
+            self.writer.writerow(COLUMNS)
+
+    def write(self, rows):
+        self.writer.writerows([row[c] for c in COLUMNS] for row in rows)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetOutput:
+    """Writes every batch as a part file in a directory; the position is the part count"""
+
+    def __init__(self, path, position):
+        import pyarrow
+        import pyarrow.parquet
+        self.pa, self.pq = pyarrow, pyarrow.parquet
+        # Fixed types, so a batch whose column is all null still matches the other parts
+        types = dict(image=pyarrow.string(), disease=pyarrow.string(), class_index=pyarrow.int64(),
+                     confidence=pyarrow.float64(), model_version=pyarrow.string(), error=pyarrow.string())
+        self.schema = pyarrow.schema([(column, types[column]) for column in COLUMNS])
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        # Drop parts written after the last checkpoint
+        for part in sorted(glob.glob(os.path.join(path, 'part-*.parquet')))[position:]:
+            os.remove(part)
+        self.parts = position
+
+    def write(self, rows):
+        table = self.pa.Table.from_pylist(rows, schema=self.schema)
+        tmp_path = os.path.join(self.path, f"part-{self.parts:06d}.parquet.tmp")
+        self.pq.write_table(table, tmp_path)
+        os.replace(tmp_path, tmp_path[:-4])
+        self.parts += 1
+        return self.parts
+
+    def close(self):
+        pass
+
+
+def load_checkpoint(path, sources, model_version, restart):
+    """Return the checkpoint to resume from, or a fresh one"""
+    fresh = {'done': 0, 'errors': 0, 'last_image': None, 'position': 0,
+             'sources': sources, 'model_version': model_version}
+    if restart or not os.path.exists(path):
+        return fresh
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint['sources'] != sources or checkpoint['model_version'] != model_version:
+        raise SystemExit(f"ERROR: {path} belongs to a run with other sources or model version "
+                         f"({checkpoint['model_version']}); pass --restart or another --output")
+    print(f"Resuming after {checkpoint['done']} images")
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def load_models(version):
+    """Load the feature extractor and classifier; returns (feature_model, classifier, version)"""
+    if REGISTRY_DIR and not version:
+        version = ModelRegistry(REGISTRY_DIR).routing()['active']
+    if version:
+        registry = ModelRegistry(REGISTRY_DIR)
+        manifest = registry.manifest(version)
+        version_dir = registry.version_dir(version)
+        classifier = inference.load_classifier(
+            os.path.join(version_dir, manifest['classifier']), os.path.join(version_dir, 'forest')
+        )
+    else:
+        classifier = inference.load_classifier()
+        version = inference.MODEL_VERSION
+    return inference.load_feature_model(), classifier, version
+
+
+def score_batch(batch, feature_model, classifier, model_version):
+    """Score a list of (image id, input, error) and return result rows in the same order"""
+    rows = [dict(image=image_id, disease=None, class_index=None, confidence=None,
+                 model_version=model_version, error=error) for image_id, _, error in batch]
+    scored = [i for i, (_, img, _) in enumerate(batch) if img is not None]
+    if scored:
+        features = feature_model.predict(np.stack([batch[i][1] for i in scored]))
+        predictions, confidences = inference.classify(classifier, features)
+        for i, prediction, confidence in zip(scored, predictions, confidences):
+            rows[i].update(disease=inference.DISEASE_CLASSES[int(prediction)], class_index=int(prediction),
+                           confidence=round(float(confidence), 2))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sources', nargs='+')
+    parser.add_argument('--output', required=True, help='CSV file, or a directory ending in .parquet')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--version', default=None, help='registry version to score with')
+    parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and start over')
+    args = parser.parse_args()
+
+    feature_model, classifier, model_version = load_models(args.version)
+    if feature_model is None or classifier is None:
+        print("ERROR: models could not be loaded")
+        return 1
+    print(f"Scoring with model version {model_version} ({inference.FEATURE_BACKEND} backend)")
+
+    sources = [os.path.abspath(s) for s in args.sources]
+    checkpoint_path = args.output.rstrip('/\\') + '.checkpoint.json'
+    checkpoint = load_checkpoint(checkpoint_path, sources, model_version, args.restart)
+    output_class = ParquetOutput if args.output.rstrip('/\\').endswith('.parquet') else CsvOutput
+    output = output_class(args.output, checkpoint['position'])
+
+    # Skip the images a previous run already scored, checking it saw the same ones
+    images = iter_images(sources)
+    if checkpoint['done']:
+        last = None
+        for _ in range(checkpoint['done']):
+            last = next(images, None)
+            if last is None:
+                raise SystemExit("ERROR: the sources have fewer images than the checkpoint; pass --restart")
+        if last[0] != checkpoint['last_image']:
+            raise SystemExit(f"ERROR: the sources changed since the checkpoint (expected {checkpoint['last_image']}, "
+                             f"found {last[0]}); pass --restart")
+
+    start = last_report = time.perf_counter()
+    model_seconds = 0.0
+    scored = 0
+    batch = []
+    in_flight = deque()
+
+    def flush():
+        nonlocal model_seconds
+        model_start = time.perf_counter()
+        rows = score_batch(batch, feature_model, classifier, model_version)
+        model_seconds += time.perf_counter() - model_start
+        checkpoint['position'] = output.write(rows)
+        checkpoint['done'] += len(rows)
+        checkpoint['errors'] += sum(row['error'] is not None for row in rows)
+        checkpoint['last_image'] = rows[-1]['image']
+        save_checkpoint(checkpoint_path, checkpoint)
+        batch.clear()
+
+    def collect(entry):
+        nonlocal scored, last_report
+        image_id, future = entry
+        img, error = future.result()
+        batch.append((image_id, img, error))
+        scored += 1
+        if len(batch) == args.batch_size:
+            flush()
+        now = time.perf_counter()
+        if now - last_report >= PROGRESS_SECONDS:
+            print(f"{checkpoint['done'] + len(batch)} images, {scored / (now - start):.1f} images/s")
+            last_report = now
+
+    # At most a few batches are decoded ahead, so archives are never read into memory whole
+    max_in_flight = args.batch_size * 4
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as pool:
+        for image_id, path, read in images:
+            in_flight.append((image_id, pool.submit(load_image, (path, read() if read else None))))
+            if len(in_flight) >= max_in_flight:
+                collect(in_flight.popleft())
+        while in_flight:
+            collect(in_flight.popleft())
+        if batch:
+            flush()
+    output.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"\nScored {scored} images in {elapsed:.1f}s: {scored / elapsed if elapsed else 0:.1f} images/s "
+          f"({model_seconds / elapsed if elapsed else 0:.0%} of the time in the models)")
+    print(f"Total: {checkpoint['done']} images, {checkpoint['errors']} errors, results in {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,279 @@
+"""Production serving mode: async front end with a pool of inference workers.
+
+Usage:
+    SERVE_WORKERS=4 TF_INTRA_OP_THREADS=2 python serve.py
+
+The ASGI front end (Starlette on uvicorn) only does I/O: it reads request
+bodies, and JSON parsing and base64 decoding run on a small thread pool
+off the event loop. Decoding, preprocessing, MobileNetV2 and the Random
+Forest run in SERVE_WORKERS worker processes. The Random Forest is served
+as a FlatForest memory-mapped from FOREST_DIR, so every worker shares the
+same page-cache copy of the trees instead of holding its own.
+
+Worker settings:
+    SERVE_WORKERS          number of inference processes (default: CPU count)
+    TF_INTRA_OP_THREADS    TensorFlow threads inside one op (default: 1)
+    TF_INTER_OP_THREADS    TensorFlow ops run in parallel (default: 1)
+    PIN_WORKERS=1          pin each worker to its own slice of the CPUs
+    OPENCV_THREADS         OpenCV threads per worker (default: 1)
+
+Every worker loads and warms up its models in the pool initializer; the
+server is ready once each of the SERVE_WORKERS processes has answered a
+status call.
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+import inference
+from cache import PredictionCache, make_key
+from shared_cache import SharedTier
+from preprocessing import IMAGE_SIZE
+
+SERVE_HOST = os.environ.get('SERVE_HOST', '0.0.0.0')
+SERVE_PORT = int(os.environ.get('SERVE_PORT', '5000'))
+SERVE_WORKERS = int(os.environ.get('SERVE_WORKERS', '0')) or (os.cpu_count() or 1)
+IO_THREADS = int(os.environ.get('IO_THREADS', '4'))
+TF_INTRA_OP_THREADS = int(os.environ.get('TF_INTRA_OP_THREADS', '1'))
+TF_INTER_OP_THREADS = int(os.environ.get('TF_INTER_OP_THREADS', '1'))
+PIN_WORKERS = os.environ.get('PIN_WORKERS', '0') == '1'
+OPENCV_THREADS = int(os.environ.get('OPENCV_THREADS', '1'))
+
+# Configured at import so spawned worker processes log the same way
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+log = logging.getLogger('serve')
+
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', '1024'))
+CACHE_TTL_SECONDS = float(os.environ.get('CACHE_TTL_SECONDS', '3600'))
+CACHE_DISK_PATH = os.environ.get('CACHE_DISK_PATH', '')
+CACHE_SHARED_URL = os.environ.get('CACHE_SHARED_URL', '')
+CACHE_SHARED_TIMEOUT_MS = float(os.environ.get('CACHE_SHARED_TIMEOUT_MS', '50'))
+CACHE_SHARED_RETRY_SECONDS = float(os.environ.get('CACHE_SHARED_RETRY_SECONDS', '30'))
+
+# Per-process model state of an inference worker
+_worker = {}
+
+
+def _cpu_slice(index):
+    cpus = sorted(os.sched_getaffinity(0))
+    per_worker = max(1, len(cpus) // SERVE_WORKERS)
+    start = (index * per_worker) % len(cpus)
+    return cpus[start:start + per_worker]
+
+
+def init_worker(counter):
+    """Pool initializer: configure threading, load both models and warm up"""
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+
+    if PIN_WORKERS and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, _cpu_slice(index))
+
+    import cv2
+    cv2.setNumThreads(OPENCV_THREADS)
+
+    if inference.FEATURE_BACKEND == 'keras':
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(TF_INTRA_OP_THREADS)
+        tf.config.threading.set_inter_op_parallelism_threads(TF_INTER_OP_THREADS)
+
+    start = time.perf_counter()
+    _worker['classifier'] = inference.load_flat_classifier(inference.FOREST_DIR, mmap=True)
+    _worker['feature_model'] = inference.load_feature_model()
+    _worker['index'] = index
+    if _worker['feature_model'] is not None:
+        _run_models([np.zeros(IMAGE_SIZE + (3,), dtype=np.float32)])
+    log.info("Worker %d (pid %d) ready in %.1fs", index, os.getpid(), time.perf_counter() - start)
+
+
+def _run_models(inputs):
+    features = _worker['feature_model'].predict(np.stack(inputs))
+    predictions, confidences = inference.classify(_worker['classifier'], features)
+    return predictions, confidences, features
+
+
+def worker_status():
+    """Return (pid, ready) for the worker that runs this task"""
+    return os.getpid(), _worker.get('feature_model') is not None
+
+
+async def confirm_workers(pool, count, interval=0.1):
+    """Return {pid: ready} once `count` distinct worker processes have answered worker_status.
+
+    A worker answers only after its initializer has run, but one worker can
+    answer several calls of a round, so rounds are repeated until every
+    process has.
+    """
+    loop = asyncio.get_running_loop()
+    workers = {}
+    while len(workers) < count:
+        workers.update(await asyncio.gather(*[
+            loop.run_in_executor(pool, worker_status) for _ in range(count)
+        ]))
+        if len(workers) < count:
+            await asyncio.sleep(interval)
+    return workers
+
+
+def predict_images(images_bytes):
+    """Worker task: score a list of raw image bytes.
+
+    Returns one (response, features) pair per image; features is None when
+    the image could not be processed.
+    """
+    if _worker.get('feature_model') is None:
+        raise RuntimeError('Feature model not loaded')
+
+    results = [None] * len(images_bytes)
+    inputs, positions = [], []
+    for i, image_bytes in enumerate(images_bytes):
+        try:
+            inputs.append(inference.preprocess_image_bytes(image_bytes))
+            positions.append(i)
+        except Exception as e:
+            results[i] = ({'success': False, 'error': str(e)}, None)
+
+    if inputs:
+        predictions, confidences, features = _run_models(inputs)
+        for i, prediction, confidence, row in zip(positions, predictions, confidences, features):
+            results[i] = (inference.build_response(int(prediction), float(confidence)), row)
+    return results
+
+
+def decode_request(body):
+    """Parse a /predict JSON body and base64-decode its image"""
+    data = json.loads(body)
+    if 'image' not in data:
+        raise KeyError('image')
+    return inference.decode_base64_image(data['image'])
+
+
+def create_app():
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse
+    from starlette.routing import Route
+
+    state = {'ready': False, 'workers': {}, 'startup_seconds': None}
+    io_pool = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix='io')
+    worker_pool = None
+    cache = PredictionCache(
+        max_entries=CACHE_MAX_ENTRIES,
+        ttl_seconds=CACHE_TTL_SECONDS,
+        disk_path=CACHE_DISK_PATH or None,
+        shared=SharedTier(
+            CACHE_SHARED_URL, CACHE_SHARED_RETRY_SECONDS, CACHE_SHARED_TIMEOUT_MS / 1000
+        ) if CACHE_SHARED_URL else None
+    )
+
+    async def startup():
+        nonlocal worker_pool
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+
+        # Flatten the forest once so all workers can memory-map the same files
+        if not await loop.run_in_executor(io_pool, inference.save_flat_forest):
+            log.error("Random Forest could not be loaded, workers will not start")
+            return
+
+        counter = multiprocessing.Value('i', 0)
+        worker_pool = ProcessPoolExecutor(
+            max_workers=SERVE_WORKERS, initializer=init_worker, initargs=(counter,)
+        )
+        try:
+            workers = await confirm_workers(worker_pool, SERVE_WORKERS)
+        except Exception as e:
+            log.error("Inference workers failed to start: %s", e)
+            return
+        state['workers'] = workers
+        state['ready'] = all(workers.values())
+        state['startup_seconds'] = time.perf_counter() - start
+        if state['ready']:
+            log.info("%d inference workers started in %.1fs", len(workers), state['startup_seconds'])
+        else:
+            log.error("%d of %d inference workers have no feature model",
+                      sum(not ok for ok in workers.values()), len(workers))
+
+    async def shutdown():
+        if worker_pool is not None:
+            worker_pool.shutdown(cancel_futures=True)
+        io_pool.shutdown(wait=False)
+
+    async def predict(request):
+        if not state['ready']:
+            return JSONResponse({'error': 'Models are still loading', 'success': False},
+                                status_code=503, headers={'Retry-After': '5'})
+        # The body is base64 JSON, about 4/3 of the image size; refuse it unread if too large
+        content_length = int(request.headers.get('content-length', '0') or 0)
+        if content_length > inference.MAX_UPLOAD_BYTES * 4 // 3 + 1024:
+            return JSONResponse({'error': f"Image is larger than {inference.MAX_UPLOAD_BYTES} bytes",
+                                 'success': False}, status_code=413)
+        loop = asyncio.get_running_loop()
+        body = await request.body()
+        try:
+            image_bytes = await loop.run_in_executor(io_pool, decode_request, body)
+        except KeyError:
+            return JSONResponse({'error': 'No image data provided', 'success': False}, status_code=400)
+        except inference.ImageTooLarge as e:
+            return JSONResponse({'error': str(e), 'success': False}, status_code=413)
+        except Exception as e:
+            return JSONResponse({'error': str(e), 'success': False}, status_code=400)
+
+        cache_key = make_key(image_bytes, inference.CACHE_NAMESPACE)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return JSONResponse(cached.response)
+
+        try:
+            result, features = (await loop.run_in_executor(worker_pool, predict_images, [image_bytes]))[0]
+        except Exception as e:
+            return JSONResponse({'error': str(e), 'success': False}, status_code=500)
+        if features is None:
+            return JSONResponse(result, status_code=500)
+        cache.put(cache_key, features, result)
+        return JSONResponse(result)
+
+    async def liveness(request):
+        return JSONResponse({'status': 'alive'})
+
+    async def readiness(request):
+        body = {'ready': state['ready'], 'workers': len(state['workers']),
+                'startup_seconds': state['startup_seconds']}
+        return JSONResponse(body, status_code=200 if state['ready'] else 503)
+
+    async def health(request):
+        return JSONResponse({
+            'status': 'healthy' if state['ready'] else 'starting',
+            'ready': state['ready'],
+            'workers': {str(pid): ok for pid, ok in state['workers'].items()},
+            'model_path': inference.MODEL_PATH,
+            'model_version': inference.MODEL_VERSION,
+            'forest_dir': inference.FOREST_DIR,
+            'feature_backend': inference.FEATURE_BACKEND,
+            'cache': cache.stats()
+        })
+
+    return Starlette(
+        routes=[
+            Route('/predict', predict, methods=['POST']),
+            Route('/health', health, methods=['GET']),
+            Route('/health/live', liveness, methods=['GET']),
+            Route('/health/ready', readiness, methods=['GET']),
+        ],
+        on_startup=[startup],
+        on_shutdown=[shutdown],
+    )
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    log.info("Starting async server with %d inference workers", SERVE_WORKERS)
+    uvicorn.run(create_app(), host=SERVE_HOST, port=SERVE_PORT)
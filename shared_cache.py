@@ -0,0 +1,238 @@
+"""Prediction cache tier shared by every replica and worker process.
+
+The in-process PredictionCache only helps the replica that scored an image.
+A SharedTier stores the MobileNetV2 features (as float16) and the response
+of every scored image in a key-value store that all replicas can reach, so
+an image scored on one node is a cache hit on the others. Keys are the
+PredictionCache keys, which hold the model version and the image hash.
+
+The store is chosen by URL:
+
+    sqlite:///path/cache.db   one SQLite file, for worker processes on one host
+    lmdb:///path/cache-dir    an LMDB environment, same use (requires lmdb)
+    redis://host:6379/0       a Redis-compatible server, for several hosts
+                              (requires redis; rediss:// and unix:// also work)
+
+RedisStore also accepts any client object with Redis' mget and pipeline
+calls, so a local stand-in such as fakeredis can replace the server.
+
+The shared tier is an optimisation only: when the store fails, lookups
+are misses and writes are dropped, and the store is left alone for
+`retry_seconds` before it is tried again.
+"""
+import json
+import logging
+import os
+import sqlite3
+import struct
+import threading
+import time
+from urllib.parse import urlparse
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# created timestamp, response JSON length; followed by the JSON and the float16 features
+_HEADER = struct.Struct('<dI')
+
+
+def encode_entry(entry):
+    """Pack a CacheEntry into bytes, storing the features as float16"""
+    response = json.dumps(entry.response, separators=(',', ':')).encode()
+    features = np.ascontiguousarray(entry.features, dtype=np.float16).tobytes()
+    return _HEADER.pack(entry.created, len(response)) + response + features
+
+
+def decode_entry(value):
+    """Unpack bytes from encode_entry into (features as float32, response, created)"""
+    created, length = _HEADER.unpack_from(value)
+    start = _HEADER.size
+    response = json.loads(bytes(value[start:start + length]))
+    features = np.frombuffer(value, dtype=np.float16, offset=start + length).astype(np.float32)
+    return features, response, created
+
+
+class SqliteStore:
+    """Shared store in one SQLite file; safe for several processes on one host"""
+
+    name = 'sqlite'
+
+    def __init__(self, path, timeout=1.0):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        # WAL lets readers in other processes run while one process writes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS shared_predictions (key TEXT PRIMARY KEY, expires REAL, value BLOB)"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys):
+        placeholders = ','.join('?' * len(keys))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key, value FROM shared_predictions WHERE key IN ({placeholders}) AND expires > ?",
+                (*keys, time.time())
+            ).fetchall()
+        found = dict(rows)
+        return [found.get(key) for key in keys]
+
+    def set_many(self, items, ttl):
+        expires = time.time() + ttl if ttl > 0 else float('inf')
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO shared_predictions VALUES (?, ?, ?)",
+                [(key, expires, value) for key, value in items]
+            )
+            self._conn.execute("DELETE FROM shared_predictions WHERE expires <= ?", (time.time(),))
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM shared_predictions").fetchone()[0]
+
+
+class LmdbStore:
+    """Shared store in an LMDB environment; safe for several processes on one host.
+
+    LMDB has no expiry, so values keep their created time (see
+    encode_entry) and expired ones are dropped by PredictionCache on read.
+    """
+
+    name = 'lmdb'
+
+    def __init__(self, path, map_size=1 << 30):
+        import lmdb
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._env = lmdb.open(path, map_size=map_size, max_readers=512)
+
+    def get_many(self, keys):
+        with self._env.begin(buffers=False) as txn:
+            return [txn.get(key.encode()) for key in keys]
+
+    def set_many(self, items, ttl):
+        with self._env.begin(write=True) as txn:
+            for key, value in items:
+                txn.put(key.encode(), value)
+
+    def __len__(self):
+        return self._env.stat()['entries']
+
+
+class RedisStore:
+    """Shared store on a Redis-compatible server, or on any client with the same API"""
+
+    name = 'redis'
+
+    def __init__(self, url=None, client=None, timeout=0.05, prefix='plant-cache:'):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self.client = client
+        self.prefix = prefix
+
+    def get_many(self, keys):
+        return self.client.mget([self.prefix + key for key in keys])
+
+    def set_many(self, items, ttl):
+        pipeline = self.client.pipeline(transaction=False)
+        for key, value in items:
+            pipeline.set(self.prefix + key, value, ex=int(ttl) if ttl >= 1 else None)
+        pipeline.execute()
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(match=self.prefix + '*', count=1000))
+
+
+def open_store(url, timeout=0.05):
+    """Open the shared store named by a URL (see the module docstring)"""
+    parsed = urlparse(url)
+    if parsed.scheme == 'sqlite':
+        return SqliteStore(parsed.netloc + parsed.path, timeout=max(timeout, 0.001))
+    if parsed.scheme == 'lmdb':
+        return LmdbStore(parsed.netloc + parsed.path)
+    if parsed.scheme in ('redis', 'rediss', 'unix'):
+        return RedisStore(url, timeout=timeout)
+    raise ValueError(f"Unknown shared cache URL {url!r}, expected sqlite://, lmdb:// or redis://")
+
+
+class SharedTier:
+    """Encodes cache entries for a store and stops using the store while it fails.
+
+    `store` is a store object or a URL for open_store. A store that cannot
+    be opened is retried like one that fails later.
+    """
+
+    def __init__(self, store, retry_seconds=30.0, timeout=0.05):
+        self.retry_seconds = max(0.0, float(retry_seconds))
+        self.timeout = timeout
+        self.url = store if isinstance(store, str) else None
+        self.store = None if isinstance(store, str) else store
+        self._lock = threading.Lock()
+        self._down_until = 0.0
+
+        # Counters
+        self.errors = 0
+        self.skipped = 0
+
+    @property
+    def available(self):
+        return time.monotonic() >= self._down_until
+
+    def _connect(self):
+        if self.store is None:
+            self.store = open_store(self.url, self.timeout)
+            log.info("Shared cache connected: %s", self.url)
+        return self.store
+
+    def _failed(self, action, error):
+        with self._lock:
+            self.errors += 1
+            self._down_until = time.monotonic() + self.retry_seconds
+        log.warning("Shared cache %s failed, not using it for %.0fs: %s", action, self.retry_seconds, error)
+
+    def get_many(self, keys):
+        """Return [(features, response, created) or None] per key; all None if the store is down"""
+        if not keys:
+            return []
+        if not self.available:
+            with self._lock:
+                self.skipped += 1
+            return [None] * len(keys)
+        try:
+            values = self._connect().get_many(keys)
+            return [decode_entry(v) if v is not None else None for v in values]
+        except Exception as e:
+            self._failed('read', e)
+            return [None] * len(keys)
+
+    def put_many(self, items, ttl):
+        """Store (key, CacheEntry) pairs; dropped if the store is down"""
+        if not items:
+            return
+        if not self.available:
+            with self._lock:
+                self.skipped += 1
+            return
+        try:
+            self._connect().set_many([(key, encode_entry(entry)) for key, entry in items], ttl)
+        except Exception as e:
+            self._failed('write', e)
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'backend': self.store.name if self.store is not None else urlparse(self.url).scheme,
+                'available': self.available,
+                'errors': self.errors,
+                'skipped': self.skipped,
+            }
+        if self.store is not None and self.available and isinstance(self.store, (SqliteStore, LmdbStore)):
+            stats['entries'] = len(self.store)
+        return stats
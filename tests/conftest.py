@@ -0,0 +1,66 @@
+"""Shared test setup.
+
+app.py and inference.py read their settings from the environment when they
+are imported, so the tests point them at an empty artifact directory before
+anything is imported: no local model is loaded, nothing is downloaded, and
+models are loaded in the foreground. Tests that need models install small
+ones trained on synthetic features.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_artifacts = tempfile.mkdtemp(prefix='plant-tests-')
+os.environ.update({
+    'MODEL_PATH': os.path.join(_artifacts, 'missing_model.joblib'),
+    'ARTIFACT_DIR': _artifacts,
+    'OFFLINE': '1',
+    'STARTUP_BACKGROUND': '0',
+    'REGISTRY_DIR': '',
+    'CACHE_DISK_PATH': '',
+    'CACHE_SHARED_URL': '',
+    'SCORING_MODE': 'single',
+    'EMBEDDING_INDEX_DIR': '',
+    'QUALITY_GATE': 'off',
+    'CASCADE_MODEL': '',
+    'LOG_LEVEL': 'WARNING',
+})
+
+
+class FakeExtractor:
+    """Stands in for MobileNetV2: the mean of each image, repeated"""
+
+    def predict(self, batch):
+        import numpy as np
+        from feature_backends import FEATURE_DIM
+        means = batch.reshape(len(batch), -1).mean(axis=1)
+        return np.repeat(means[:, np.newaxis], FEATURE_DIM, axis=1).astype(np.float32)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """Flask test client for app.py with a small Random Forest on synthetic features"""
+    import numpy as np
+    from sklearn.ensemble import RandomForestClassifier
+
+    import app
+    from cache import PredictionCache
+    from feature_backends import FEATURE_DIM
+    from registry import LoadedModel
+
+    rng = np.random.default_rng(0)
+    X = rng.uniform(-1, 1, size=(60, FEATURE_DIM)).astype(np.float32)
+    y = np.arange(60) % 3
+    classifier = RandomForestClassifier(n_estimators=5, random_state=0).fit(X, y)
+    monkeypatch.setattr(app, 'feature_model', FakeExtractor())
+    previous = app.model_router.active
+    app.model_router.swap(LoadedModel('test-version', classifier, {}, 'test-namespace', 'test.joblib'))
+    monkeypatch.setattr(app, 'prediction_cache', PredictionCache(max_entries=64))
+    yield app.app.test_client()
+    if previous is not None:
+        app.model_router.swap(previous)
@@ -0,0 +1,157 @@
+import io
+import threading
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from admission import AdmissionController, DeadlineExceeded, Overloaded, parse_deadline
+
+
+def test_parse_deadline():
+    assert parse_deadline(None) is None
+    assert parse_deadline('') is None
+    assert parse_deadline(None, default_ms=500, now=10.0) == 10.5
+    assert parse_deadline('250', now=10.0) == 10.25
+    with pytest.raises(ValueError):
+        parse_deadline('soon')
+    with pytest.raises(ValueError):
+        parse_deadline('nan')
+
+
+def hold(controller, count):
+    """Take `count` slots and return the event that releases them"""
+    release = threading.Event()
+    taken = threading.Barrier(count + 1)
+
+    def worker():
+        with controller.slot():
+            taken.wait()
+            release.wait(5)
+
+    for _ in range(count):
+        threading.Thread(target=worker, daemon=True).start()
+    taken.wait(5)
+    return release
+
+
+def test_admits_up_to_max_in_flight():
+    controller = AdmissionController(max_in_flight=2, max_queue=0, max_wait_ms=0)
+    release = hold(controller, 2)
+    try:
+        with pytest.raises(Overloaded) as shed:
+            controller.acquire()
+        assert (shed.value.reason, shed.value.status) == ('queue_full', 429)
+        assert shed.value.retry_after >= 1
+    finally:
+        release.set()
+    stats = controller.stats()
+    assert stats['admitted'] == 2 and stats['shed'] == {'queue_full': 1, 'wait_timeout': 0}
+
+
+def test_queued_request_gets_a_freed_slot():
+    controller = AdmissionController(max_in_flight=1, max_queue=1, max_wait_ms=5000)
+    release = hold(controller, 1)
+    threading.Timer(0.05, release.set).start()
+    with controller.slot():
+        assert controller.stats()['in_flight'] == 1
+    stats = controller.stats()
+    assert (stats['admitted'], stats['max_waiting'], stats['in_flight']) == (2, 1, 0)
+
+
+def test_wait_timeout_is_503():
+    controller = AdmissionController(max_in_flight=1, max_queue=1, max_wait_ms=20)
+    release = hold(controller, 1)
+    try:
+        with pytest.raises(Overloaded) as shed:
+            controller.acquire()
+        assert (shed.value.reason, shed.value.status) == ('wait_timeout', 503)
+    finally:
+        release.set()
+
+
+def test_deadline_passing_in_the_queue_is_expired_not_shed():
+    controller = AdmissionController(max_in_flight=1, max_queue=1, max_wait_ms=5000)
+    release = hold(controller, 1)
+    try:
+        with pytest.raises(DeadlineExceeded) as expired:
+            controller.acquire(deadline=time.monotonic() + 0.02)
+        assert expired.value.stage == 'queue'
+    finally:
+        release.set()
+    stats = controller.stats()
+    assert stats['expired'] == {'queue': 1} and stats['shed']['wait_timeout'] == 0
+
+
+def test_check_and_expire():
+    controller = AdmissionController()
+    controller.check(None, 'arrival')
+    controller.check(time.monotonic() + 60, 'arrival')
+    with pytest.raises(DeadlineExceeded):
+        controller.check(time.monotonic() - 1, 'arrival')
+    assert isinstance(controller.expire('model'), TimeoutError)
+    assert controller.stats()['expired'] == {'arrival': 1, 'model': 1}
+
+
+def test_zero_max_in_flight_admits_everything():
+    controller = AdmissionController(max_in_flight=0, max_queue=0)
+    for _ in range(10):
+        controller.acquire()
+    assert controller.stats()['in_flight'] == 10
+
+
+def test_retry_after_follows_slot_time():
+    controller = AdmissionController(max_in_flight=1, max_queue=0, retry_after=1)
+    controller.acquire()
+    controller.release(4.0)
+    release = hold(controller, 1)
+    try:
+        with pytest.raises(Overloaded) as shed:
+            controller.acquire()
+        assert shed.value.retry_after == 4
+    finally:
+        release.set()
+
+
+def batch_upload(count=3):
+    files = [(io.BytesIO(cv2.imencode('.jpg', np.full((64, 64, 3), 40 * i, dtype=np.uint8))[1].tobytes()),
+              f"leaf{i}.jpg") for i in range(count)]
+    return {'data': {'images': files}, 'content_type': 'multipart/form-data'}
+
+
+def test_batch_upload_holds_one_slot_until_streamed(client, monkeypatch):
+    import app
+    controller = AdmissionController(max_in_flight=1, max_queue=0)
+    monkeypatch.setattr(app, 'admission', controller)
+
+    response = client.post('/predict/batch', **batch_upload())
+    assert response.status_code == 200
+    assert len(response.get_data(as_text=True).splitlines()) == 3
+    stats = controller.stats()
+    assert (stats['admitted'], stats['in_flight']) == (1, 0)
+
+
+def test_batch_upload_is_shed_when_slots_are_taken(client, monkeypatch):
+    import app
+    controller = AdmissionController(max_in_flight=1, max_queue=0)
+    monkeypatch.setattr(app, 'admission', controller)
+    controller.acquire()
+
+    response = client.post('/predict/batch', **batch_upload())
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    assert response.get_json()['success'] is False
+    assert controller.stats()['shed']['queue_full'] == 1
+
+
+def test_batch_upload_past_its_deadline_is_dropped(client, monkeypatch):
+    import app
+    controller = AdmissionController()
+    monkeypatch.setattr(app, 'admission', controller)
+
+    response = client.post('/predict/batch', headers={app.DEADLINE_HEADER: '0'}, **batch_upload())
+    assert response.status_code == 504
+    response = client.post('/predict/batch', headers={app.DEADLINE_HEADER: 'soon'}, **batch_upload())
+    assert response.status_code == 400
+    assert controller.stats()['admitted'] == 0
@@ -0,0 +1,173 @@
+import base64
+import io
+import json
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+import app
+from embedding_index import EmbeddingIndex
+from ensemble import SecondaryModel, SecondaryScorer
+from feature_backends import FEATURE_DIM
+from quality_gate import QualityGate
+from registry import LoadedModel
+
+
+def jpeg(value):
+    img = np.full((64, 64, 3), value, dtype=np.uint8)
+    return cv2.imencode('.jpg', img)[1].tobytes()
+
+
+def read_lines(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_batch_streams_a_prediction_per_upload(client):
+    files = [(io.BytesIO(jpeg(value)), f"leaf{i}.jpg") for i, value in enumerate((20, 90, 160, 230, 90))]
+    response = client.post('/predict/batch', data={'images': files}, content_type='multipart/form-data')
+
+    assert response.status_code == 200
+    lines = read_lines(response)
+    assert [line['index'] for line in lines] == list(range(5))
+    assert [line['filename'] for line in lines] == [f"leaf{i}.jpg" for i in range(5)]
+    for line in lines:
+        assert line['success'] is True, line
+        assert line['disease'] in app.DISEASE_CLASSES
+        assert line['model_version'] == 'test-version'
+
+
+def test_batch_reports_bad_uploads_per_line(client):
+    files = [(io.BytesIO(jpeg(50)), 'good.jpg'), (io.BytesIO(b'not an image'), 'bad.jpg')]
+    response = client.post('/predict/batch', data={'images': files}, content_type='multipart/form-data')
+
+    good, bad = read_lines(response)
+    assert good['success'] is True
+    assert bad['success'] is False and bad['error']
+
+
+def test_batch_without_files_is_rejected(client):
+    response = client.post('/predict/batch', data={}, content_type='multipart/form-data')
+    assert response.status_code == 400
+
+
+class SignallingClassifier:
+    """Wraps a classifier and sets `scored` once it has produced probabilities"""
+
+    nbytes = 0
+
+    def __init__(self, classifier, scored):
+        self.classifier = classifier
+        self.classes_ = classifier.classes_
+        self.scored = scored
+
+    def predict_proba(self, X):
+        proba = self.classifier.predict_proba(X)
+        self.scored.set()
+        return proba
+
+
+class WaitingClassifier:
+    """Answers class 1 only after `scored` is set"""
+
+    def __init__(self, scored):
+        self.classes_ = np.arange(len(app.DISEASE_CLASSES))
+        self.scored = scored
+
+    def predict_proba(self, X):
+        self.scored.wait(5)
+        proba = np.zeros((len(X), len(app.DISEASE_CLASSES)))
+        proba[:, 1] = 1.0
+        return proba
+
+
+def test_ensemble_primary_scores_while_secondaries_run(client, monkeypatch):
+    scored = threading.Event()
+    loaded = app.model_router.active
+    primary = LoadedModel('test-version', SignallingClassifier(loaded.classifier, scored), {},
+                          'test-namespace', 'test.joblib')
+    secondary = SecondaryModel('waiting', WaitingClassifier(scored), weight=100.0, budget_ms=2000)
+    monkeypatch.setattr(app, 'secondary_scorer', SecondaryScorer([secondary], mode='ensemble'))
+
+    images = [np.full(app.IMAGE_SIZE + (3,), 0.5, dtype=np.float32)] * 2
+    results = app.predict_batch([(img, primary) for img in images])
+
+    # The secondary only answers once the primary has scored, well within its budget
+    assert secondary.stats()['skipped_timeout'] == 0
+    assert [prediction for prediction, *_ in results] == [1, 1]
+
+
+class RefusingClassifier:
+    """Fails the test if the classifier is asked to score anything"""
+
+    nbytes = 0
+
+    def __init__(self, classes):
+        self.classes_ = classes
+
+    def predict_proba(self, X):
+        raise AssertionError('the classifier should have been skipped')
+
+
+@pytest.fixture
+def indexed(client, monkeypatch, tmp_path):
+    """An empty embedding index; its centroids split the fake features by sign"""
+    rng = np.random.default_rng(0)
+    centroids = np.stack([np.ones(FEATURE_DIM), -np.ones(FEATURE_DIM)])
+    index = EmbeddingIndex.create(str(tmp_path / 'index'), centroids, rng.normal(size=(FEATURE_DIM, 16)))
+    monkeypatch.setattr(app, 'embedding_index', index)
+    monkeypatch.setattr(app, 'INDEX_SUBMISSIONS', False)
+    return index
+
+
+def predict(client, value):
+    return client.post('/predict', json={'image': base64.b64encode(jpeg(value)).decode()})
+
+
+def features_of(value):
+    """The features app.feature_model extracts from jpeg(value)"""
+    return app.feature_model.predict(app.preprocess_image(app.decode_image(jpeg(value)))[np.newaxis])
+
+
+def test_near_duplicate_skips_the_classifier(indexed, client, monkeypatch):
+    indexed.add(features_of(200), [2], 'train', ['train/leaf.jpg'])
+    monkeypatch.setattr(app, 'DUPLICATE_SHORT_CIRCUIT', True)
+    loaded = app.model_router.active
+    app.model_router.swap(LoadedModel('test-version', RefusingClassifier(loaded.classifier.classes_), {},
+                                      'test-namespace', 'test.joblib'))
+
+    body = predict(client, 200).get_json()
+    assert body['success'] is True
+    assert body['disease'] == app.DISEASE_CLASSES[2]
+    assert body['near_duplicate']['ref'] == 'leaf.jpg'
+    # Answers taken from the index are not cached
+    assert app.prediction_cache.stats()['entries'] == 0
+
+
+def test_cache_hits_list_neighbours_from_the_current_index(indexed, client):
+    first = predict(client, 200).get_json()
+    assert first['similar_examples'] == []
+    cached = next(iter(app.prediction_cache._entries.values()))
+    assert 'similar_examples' not in cached.response
+
+    indexed.add(features_of(200), [2], 'train', ['train/leaf.jpg'])
+    second = predict(client, 200).get_json()
+    assert app.prediction_cache.stats()['hits'] == 1
+    assert second['disease'] == first['disease']
+    assert [example['ref'] for example in second['similar_examples']] == ['leaf.jpg']
+
+
+def test_cache_namespace_follows_the_quality_gate(client, monkeypatch):
+    loaded = app.model_router.active
+    assert app.result_namespace(loaded) == loaded.cache_namespace
+
+    monkeypatch.setattr(app, 'QUALITY_GATE', 'report')
+    monkeypatch.setattr(app, 'quality_gate', QualityGate())
+    report = app.result_namespace(loaded)
+    monkeypatch.setattr(app, 'QUALITY_GATE', 'reject')
+    reject = app.result_namespace(loaded)
+    monkeypatch.setattr(app, 'quality_gate', QualityGate(min_sharpness=50))
+    stricter = app.result_namespace(loaded)
+
+    assert len({loaded.cache_namespace, report, reject, stricter}) == 4
@@ -0,0 +1,95 @@
+import threading
+import time
+
+import pytest
+
+from batching import BatchScheduler
+
+
+def test_concurrent_items_share_a_batch():
+    release = threading.Event()
+    batches = []
+
+    def process(items):
+        batches.append(list(items))
+        release.wait(5)
+        return [item * 2 for item in items]
+
+    scheduler = BatchScheduler(process, max_batch_size=4, max_wait_ms=200)
+    futures = [scheduler.submit(i) for i in range(4)]
+    release.set()
+
+    assert [future.result(timeout=5) for future in futures] == [0, 2, 4, 6]
+    assert batches == [[0, 1, 2, 3]]
+    stats = scheduler.stats()
+    assert stats['batches'] == 1 and stats['items'] == 4
+    assert stats['batch_size_counts'] == {4: 1}
+
+
+def test_batches_are_capped_at_max_batch_size():
+    started = threading.Event()
+    release = threading.Event()
+    sizes = []
+
+    def process(items):
+        sizes.append(len(items))
+        started.set()
+        release.wait(5)
+        return items
+
+    scheduler = BatchScheduler(process, max_batch_size=3, max_wait_ms=0)
+    first = scheduler.submit('first')
+    assert started.wait(5)
+    # Queued while the first batch is still running
+    rest = [scheduler.submit(i) for i in range(5)]
+    release.set()
+
+    assert first.result(timeout=5) == 'first'
+    assert [future.result(timeout=5) for future in rest] == list(range(5))
+    assert sizes == [1, 3, 2]
+    assert scheduler.stats()['max_queue_depth'] >= 5
+
+
+def test_partial_batch_runs_after_max_wait():
+    scheduler = BatchScheduler(lambda items: items, max_batch_size=16, max_wait_ms=20)
+    start = time.monotonic()
+    assert scheduler.submit('only').result(timeout=5) == 'only'
+    assert time.monotonic() - start >= 0.02
+    assert scheduler.stats()['last_batch_size'] == 1
+
+
+def test_batch_failure_is_raised_for_every_item():
+    def process(items):
+        raise RuntimeError('model failed')
+
+    scheduler = BatchScheduler(process, max_batch_size=2, max_wait_ms=50)
+    futures = [scheduler.submit(i) for i in range(2)]
+    for future in futures:
+        with pytest.raises(RuntimeError, match='model failed'):
+            future.result(timeout=5)
+
+
+def test_wrong_result_count_is_an_error():
+    scheduler = BatchScheduler(lambda items: items[:1], max_batch_size=2, max_wait_ms=50)
+    futures = [scheduler.submit(i) for i in range(2)]
+    for future in futures:
+        with pytest.raises(RuntimeError, match='1 results for 2 items'):
+            future.result(timeout=5)
+
+
+def test_expired_items_are_dropped_before_the_batch():
+    processed = []
+
+    def process(items):
+        processed.extend(items)
+        return items
+
+    scheduler = BatchScheduler(process, max_batch_size=2, max_wait_ms=50)
+    expired = scheduler.submit('late', deadline=time.monotonic() - 1)
+    live = scheduler.submit('live', deadline=time.monotonic() + 60)
+
+    with pytest.raises(TimeoutError):
+        expired.result(timeout=5)
+    assert live.result(timeout=5) == 'live'
+    assert processed == ['live']
+    assert scheduler.stats()['expired'] == 1
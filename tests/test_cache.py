@@ -0,0 +1,106 @@
+import time
+
+import numpy as np
+import pytest
+
+from cache import PredictionCache, image_digest, make_key
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock(time.time())
+    monkeypatch.setattr(time, 'time', clock)
+    return clock
+
+
+def features(seed):
+    return np.random.default_rng(seed).normal(size=1280).astype(np.float32)
+
+
+def test_keys_depend_on_image_and_model_version():
+    key = make_key(b'image', 'v1')
+    assert key == make_key(b'image', 'v1', digest=image_digest(b'image'))
+    assert key != make_key(b'image', 'v2')
+    assert key != make_key(b'other image', 'v1')
+
+
+def test_hit_and_miss():
+    cache = PredictionCache(max_entries=4)
+    assert cache.get('a') is None
+    cache.put('a', features(0), {'disease': 'Healthy'})
+
+    entry = cache.get('a')
+    np.testing.assert_array_equal(entry.features, features(0))
+    assert entry.response == {'disease': 'Healthy'}
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['hit_rate']) == (1, 1, 0.5)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = PredictionCache(max_entries=2)
+    cache.put('a', features(0), {})
+    cache.put('b', features(1), {})
+    cache.get('a')
+    cache.put('c', features(2), {})
+
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = PredictionCache(max_entries=4, ttl_seconds=10)
+    cache.put('a', features(0), {})
+    clock.now += 9
+    assert cache.get('a') is not None
+    clock.now += 2
+    assert cache.get('a') is None
+    assert cache.stats()['expirations'] == 1
+
+
+def test_purge_expired(clock):
+    cache = PredictionCache(max_entries=4, ttl_seconds=10)
+    cache.put('old', features(0), {})
+    clock.now += 6
+    cache.put('new', features(1), {})
+    clock.now += 6
+    assert cache.purge_expired() == 1
+    assert cache.stats()['entries'] == 1
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    path = str(tmp_path / 'cache' / 'predictions.db')
+    PredictionCache(max_entries=4, disk_path=path).put('a', features(0), {'disease': 'Healthy'})
+
+    restarted = PredictionCache(max_entries=4, disk_path=path)
+    entry = restarted.get('a')
+    np.testing.assert_array_equal(entry.features, features(0))
+    assert entry.response == {'disease': 'Healthy'}
+    assert restarted.stats()['disk_hits'] == 1
+    # Promoted into memory
+    restarted.get('a')
+    assert restarted.stats()['hits'] == 1
+
+
+def test_disk_only_cache(tmp_path):
+    cache = PredictionCache(max_entries=0, disk_path=str(tmp_path / 'predictions.db'))
+    cache.put('a', features(0), {})
+    assert cache.get('a') is not None
+    stats = cache.stats()
+    assert stats['entries'] == 0 and stats['disk_entries'] == 1
+
+
+def test_expired_disk_entries_are_deleted(tmp_path, clock):
+    cache = PredictionCache(max_entries=0, ttl_seconds=10, disk_path=str(tmp_path / 'predictions.db'))
+    cache.put('a', features(0), {})
+    clock.now += 11
+    assert cache.get('a') is None
+    assert cache.stats()['disk_entries'] == 0
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from sklearn.linear_model import LogisticRegression
+
+from cascade import FEATURE_VERSION, CascadeStage, calibrate_threshold, cheap_features, tradeoff
+
+
+def photo(bgr, seed=0):
+    rng = np.random.default_rng(seed)
+    img = np.empty((120, 160, 3), dtype=np.uint8)
+    for channel, value in enumerate(bgr):
+        img[..., channel] = np.clip(rng.normal(value, 10, img.shape[:2]), 0, 255)
+    return img
+
+
+def test_cheap_features():
+    features = cheap_features(photo((40, 150, 40)))
+    assert features.dtype == np.float32
+    assert features.shape == (16 * 4 * 4 + 6,)
+    assert features[:256].sum() == pytest.approx(1.0, abs=1e-5)
+
+
+def test_calibrate_threshold():
+    probabilities = np.array([[0.95, 0.05], [0.9, 0.1], [0.8, 0.2], [0.7, 0.3], [0.6, 0.4]])
+    y_true = [0, 0, 0, 1, 1]
+    # The three most confident answers are right, the fourth is wrong
+    assert calibrate_threshold(probabilities, y_true, 1.0) == 0.8
+    assert calibrate_threshold(probabilities, y_true, 0.75) == 0.7
+    assert calibrate_threshold(probabilities, [1, 1, 1, 1, 1], 0.5) == 1.01
+
+
+def test_equal_confidences_are_accepted_together():
+    probabilities = np.array([[0.9, 0.1], [0.8, 0.2], [0.8, 0.2]])
+    assert calibrate_threshold(probabilities, [0, 0, 1], 1.0) == 0.9
+
+
+def test_tradeoff():
+    first_proba = np.array([[0.9, 0.1], [0.6, 0.4], [0.3, 0.7]])
+    rows = tradeoff(first_proba, np.array([0, 1, 1]), [0, 1, 1], 0.001, 0.1, [0.8, 1.01])
+    assert rows[0]['first_stage_share'] == pytest.approx(1 / 3)
+    assert rows[0]['first_stage_accuracy'] == 1.0
+    assert rows[0]['accuracy'] == 1.0
+    assert rows[0]['mean_latency_ms'] == pytest.approx(1 + 100 * 2 / 3)
+    assert rows[1]['first_stage_accuracy'] is None
+    assert rows[1]['mean_latency_ms'] == pytest.approx(101)
+
+
+@pytest.fixture
+def model():
+    greens = [photo((40, 150, 40), seed) for seed in range(10)]
+    browns = [photo((40, 80, 140), seed) for seed in range(10)]
+    X = np.array([cheap_features(img) for img in greens + browns])
+    classifier = LogisticRegression(max_iter=1000).fit(X, [0] * 10 + [2] * 10)
+    return {'classifier': classifier, 'threshold': 0.6, 'feature_version': FEATURE_VERSION}
+
+
+def test_stage_answers_confident_images_and_escalates_the_rest(model):
+    stage = CascadeStage(model, 'cascade-test')
+    label, confidence = stage.decide(photo((40, 150, 40), seed=99))
+    assert label == 0 and confidence >= 60
+    # Labels are the classifier's classes, not column indices
+    assert stage.decide(photo((40, 80, 140), seed=99))[0] == 2
+
+    stage.threshold = 1.01
+    assert stage.decide(photo((40, 150, 40), seed=99)) is None
+    stats = stage.stats()
+    assert (stats['first_stage'], stats['full_pipeline'], stats['first_stage_share']) == (2, 1, 2 / 3)
+
+
+def test_stage_rejects_other_feature_versions(model):
+    with pytest.raises(ValueError):
+        CascadeStage(dict(model, feature_version='hsv-8x8x8'), 'cascade-test')
+    assert CascadeStage(model, 'cascade-test', threshold=0.9).threshold == 0.9
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from embedding_index import EmbeddingIndex, normalize, train_centroids, train_projection
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((8, 64)).astype(np.float32)
+    return centers[rng.integers(0, len(centers), 400)] + 0.3 * rng.standard_normal((400, 64)).astype(np.float32)
+
+
+@pytest.fixture
+def index(tmp_path, vectors):
+    index = EmbeddingIndex.create(str(tmp_path / 'index'), train_centroids(vectors, 8),
+                                  train_projection(vectors, 16), n_probe=8, rerank=400)
+    index.add(vectors, np.arange(len(vectors)) % 3, 'train', [f"train-{i}" for i in range(len(vectors))])
+    return index
+
+
+def exact_neighbours(vectors, query, k):
+    similarities = normalize(vectors) @ normalize(query[np.newaxis])[0]
+    return np.argsort(-similarities)[:k], np.sort(similarities)[::-1][:k]
+
+
+def test_probing_every_list_finds_the_exact_neighbours(index, vectors):
+    query = vectors[17] + 0.01
+    result = index.search(query[np.newaxis], k=5)[0]
+    expected_rows, expected_similarities = exact_neighbours(vectors, query, 5)
+
+    # Entry ids are assigned in insertion order, starting at 1
+    assert [entry_id - 1 for _, entry_id in result] == list(expected_rows)
+    np.testing.assert_allclose([s for s, _ in result], expected_similarities, atol=1e-3)
+
+
+def test_each_vector_is_its_own_nearest_neighbour(tmp_path, vectors):
+    index = EmbeddingIndex.create(str(tmp_path / 'index'), train_centroids(vectors, 8),
+                                  train_projection(vectors, 16), n_probe=2, rerank=32)
+    index.add(vectors, [0] * len(vectors), 'train', [f"train-{i}" for i in range(len(vectors))])
+    results = index.search(vectors[:50], k=1)
+    assert [result[0][1] - 1 for result in results] == list(range(50))
+
+
+def test_duplicate_refs_are_skipped(index, vectors):
+    assert len(index) == len(vectors)
+    assert index.add(vectors[:10], [0] * 10, 'train', [f"train-{i}" for i in range(10)]) == 0
+    assert index.add(vectors[:1], [1], 'submission', ['upload-1']) == 1
+    assert len(index) == len(vectors) + 1
+
+
+def test_sources_are_searched_separately(index, vectors):
+    index.add(vectors[:1], [2], 'submission', ['upload-1'])
+    [(similarity, entry_id)] = index.search(vectors[:1], k=1, sources=('submission',))[0]
+    assert similarity == pytest.approx(1.0, abs=1e-3)
+    assert index.entries([entry_id]) == {entry_id: (2, 'submission', 'upload-1')}
+    with pytest.raises(ValueError):
+        index.add(vectors[:1], [0], 'unknown', ['x'])
+
+
+def test_reopened_index_keeps_its_lists(index, vectors):
+    reopened = EmbeddingIndex(index.directory, n_probe=8, rerank=400)
+    assert len(reopened) == len(vectors)
+    assert reopened.stats()['entries'] == {'train': len(vectors), 'submission': 0}
+    assert reopened.search(vectors[:1], k=1)[0][0][1] == 1
+
+
+def test_empty_index_returns_no_results(tmp_path, vectors):
+    index = EmbeddingIndex.create(str(tmp_path / 'index'), train_centroids(vectors, 4), train_projection(vectors, 16))
+    assert index.search(vectors[:2], k=3) == [[], []]
@@ -0,0 +1,82 @@
+import threading
+import time
+
+import numpy as np
+
+import ensemble
+from ensemble import SecondaryModel, SecondaryScorer, parse_model_specs
+from inference import DISEASE_CLASSES
+
+
+class FixedClassifier:
+    """Always predicts class `label`, after waiting for `release` if given"""
+
+    def __init__(self, label, release=None):
+        self.classes_ = np.arange(len(DISEASE_CLASSES))
+        self.label = label
+        self.release = release
+
+    def predict_proba(self, X):
+        if self.release is not None:
+            self.release.wait(5)
+        proba = np.zeros((len(X), len(DISEASE_CLASSES)))
+        proba[:, self.label] = 1.0
+        return proba
+
+
+def test_parse_model_specs():
+    assert parse_model_specs('models/svm.joblib, /srv/knn.pkl:0.5,lr.joblib:2:150') == [
+        ('svm', 'models/svm.joblib', 1.0, None),
+        ('knn', '/srv/knn.pkl', 0.5, None),
+        ('lr', 'lr.joblib', 2.0, 150.0),
+    ]
+    assert parse_model_specs('C:/models/svm.joblib:0.5') == [('svm', 'C:/models/svm.joblib', 0.5, None)]
+    assert parse_model_specs('') == []
+
+
+def test_budget_defaults_from_the_environment(monkeypatch):
+    monkeypatch.setattr(ensemble, 'SECONDARY_BUDGET_MS', 35.0)
+    assert SecondaryModel('svm', FixedClassifier(0)).stats()['budget_ms'] == 35.0
+    assert SecondaryModel('knn', FixedClassifier(0), budget_ms=500).stats()['budget_ms'] == 500.0
+
+
+def test_each_model_waits_for_its_own_budget():
+    release = threading.Event()
+    slow = SecondaryModel('slow', FixedClassifier(1, release), budget_ms=10)
+    patient = SecondaryModel('patient', FixedClassifier(2), budget_ms=5000)
+    scorer = SecondaryScorer([slow, patient], mode='ensemble')
+    try:
+        start = time.perf_counter()
+        results = scorer.collect(scorer.submit(np.zeros((2, 4))), start)
+    finally:
+        release.set()
+
+    assert list(results) == [patient]
+    assert (slow.skipped_timeout, patient.skipped_timeout) == (1, 0)
+    # The slow model does not hold up the patient one beyond its own budget
+    assert time.perf_counter() - start < 5
+
+
+def test_busy_model_is_skipped_without_queueing():
+    release = threading.Event()
+    slow = SecondaryModel('slow', FixedClassifier(1, release), budget_ms=0)
+    scorer = SecondaryScorer([slow], mode='ensemble')
+    try:
+        scorer.collect(scorer.submit(np.zeros((1, 4))), time.perf_counter())
+        assert scorer.submit(np.zeros((1, 4))) == [(slow, None)]
+    finally:
+        release.set()
+    assert slow.stats()['skipped_busy'] == 1
+
+
+def test_combine_weights_the_models():
+    secondary = SecondaryModel('svm', FixedClassifier(1), weight=3.0)
+    scorer = SecondaryScorer([secondary], mode='ensemble', primary_weight=1.0)
+    primary = np.zeros((1, len(DISEASE_CLASSES)))
+    primary[0, 0] = 1.0
+    secondary_proba = np.zeros((1, len(DISEASE_CLASSES)))
+    secondary_proba[0, 1] = 1.0
+
+    predictions, confidences = scorer.combine(primary, {secondary: secondary_proba})
+    assert predictions.tolist() == [1]
+    assert confidences.tolist() == [75.0]
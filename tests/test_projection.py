@@ -0,0 +1,70 @@
+import pickle
+
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from projection import ProjectedClassifier, Projection
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    # 200 samples of 64 features that vary along 8 directions
+    X = (rng.normal(size=(200, 8)) @ rng.normal(size=(8, 64)) + 3).astype(np.float32)
+    y = (X[:, 0] > np.median(X[:, 0])).astype(int)
+    return X, y
+
+
+def test_fit_and_transform(data):
+    X, _ = data
+    projection = Projection.fit(X, 8)
+    assert (projection.dim, projection.n_features_in_) == (8, 64)
+    assert projection.explained_variance == pytest.approx(1.0, abs=1e-3)
+
+    projected = projection.transform(X)
+    assert projected.dtype == np.float16 and projected.shape == (200, 8)
+    # Projected features are centred
+    np.testing.assert_allclose(projected.astype(np.float32).mean(axis=0), 0, atol=0.05)
+    with pytest.raises(ValueError):
+        projection.transform(X[:, :10])
+
+
+def test_dim_is_capped_by_the_data(data):
+    X, _ = data
+    assert Projection.fit(X[:5], 32).dim == 5
+
+
+def test_save_and_load(data, tmp_path):
+    X, _ = data
+    assert Projection.load(str(tmp_path)) is None
+    projection = Projection.fit(X, 8)
+    projection.save(str(tmp_path / 'projection'))
+
+    loaded = Projection.load(str(tmp_path / 'projection'))
+    np.testing.assert_array_equal(loaded.transform(X), projection.transform(X))
+
+
+def test_pickle_rebuilds_the_weights(data):
+    X, _ = data
+    projection = Projection.fit(X, 8)
+    assert '_weights' not in projection.__getstate__()
+    restored = pickle.loads(pickle.dumps(projection))
+    np.testing.assert_array_equal(restored.transform(X), projection.transform(X))
+
+
+def test_projected_classifier_takes_raw_features(data):
+    X, y = data
+    projection = Projection.fit(X, 8)
+    model = ProjectedClassifier(projection, RandomForestClassifier(n_estimators=10, random_state=0)).fit(X, y)
+    inner = model.classifier
+
+    np.testing.assert_array_equal(model.predict_proba(X), inner.predict_proba(projection.transform(X)))
+    np.testing.assert_array_equal(model.predict(X), inner.predict(projection.transform(X)))
+    classes, proba = model.predict_with_proba(X)
+    np.testing.assert_array_equal(classes, model.predict(X))
+    np.testing.assert_array_equal(proba, model.predict_proba(X))
+    assert list(model.classes_) == [0, 1]
+    assert model.n_features_in_ == 64
+    # RandomForestClassifier has no nbytes; the registry measures it instead
+    assert model.nbytes is None
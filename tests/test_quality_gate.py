@@ -0,0 +1,67 @@
+import cv2
+import numpy as np
+import pytest
+
+from quality_gate import QualityGate
+
+
+def textured(channel, size=300, seed=0):
+    """A sharp photo with noise in one BGR channel"""
+    rng = np.random.default_rng(seed)
+    img = np.full((size, size, 3), 40, dtype=np.uint8)
+    img[..., channel] = rng.integers(90, 200, (size, size))
+    return img
+
+
+def leaf():
+    """A sharp green photo that passes every check"""
+    return textured(1)
+
+
+def glare():
+    return np.full((300, 300, 3), 250, dtype=np.uint8) - textured(0) // 40
+
+
+@pytest.fixture
+def gate():
+    return QualityGate()
+
+
+def test_sharp_leaf_passes(gate):
+    report = gate.check(leaf())
+    assert report.ok, report.describe()
+    assert report.describe()['passed'] is True
+
+
+@pytest.mark.parametrize('make, reason', [
+    (lambda: cv2.GaussianBlur(leaf(), (0, 0), 8), 'blurry'),
+    (lambda: leaf() // 10, 'too_dark'),
+    (glare, 'overexposed'),
+    (lambda: textured(0), 'no_plant'),
+])
+def test_bad_photos_are_rejected(gate, make, reason):
+    report = gate.check(make())
+    assert reason in report.reasons, report.describe()
+    assert gate.stats()['rejected_by_reason'][reason] == 1
+
+
+def test_zero_threshold_disables_a_check():
+    gate = QualityGate(min_leaf_coverage=0)
+    assert 'no_plant' not in gate.check(textured(0)).reasons
+
+
+def test_retake_response_lists_every_reason(gate):
+    report = gate.check(np.zeros((100, 100, 3), dtype=np.uint8))
+    response = gate.retake_response(report)
+    assert response['success'] is False and response['retake'] is True
+    assert set(response['quality']['reasons']) == {'blurry', 'too_dark', 'no_plant'}
+    assert 'too dark' in response['error']
+
+
+def test_rejections_count_saved_model_time(gate):
+    gate.note_model_seconds(0.2)
+    gate.check(leaf())
+    gate.check(np.zeros((100, 100, 3), dtype=np.uint8))
+    stats = gate.stats()
+    assert (stats['checked'], stats['rejected']) == (2, 1)
+    assert stats['saved_seconds'] == pytest.approx(0.2)
@@ -0,0 +1,104 @@
+import json
+import os
+
+import joblib
+import pytest
+
+from registry import LoadedModel, ModelRegistry, ModelRouter, RegistryError, check_compatible
+
+CATEGORIES = ['Healthy', 'Bacterial_wilt', 'Manganese_Toxicity']
+CONFIG = {'model_type': 'RandomForest', 'categories': CATEGORIES, 'image_size': [224, 224],
+          'n_features': 1280, 'accuracy': 0.9}
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return ModelRegistry(str(tmp_path / 'registry'))
+
+
+def write_classifier(directory, name, payload):
+    path = os.path.join(str(directory), name)
+    joblib.dump(payload, path)
+    return path
+
+
+def test_publish_and_list(registry, tmp_path):
+    path = write_classifier(tmp_path, 'rf_best_model.joblib', {'trees': 1})
+    manifest = registry.publish(path, CONFIG)
+
+    assert len(manifest['version']) == 12
+    assert manifest['classifier'] == 'rf_best_model.joblib'
+    assert manifest['categories'] == CATEGORIES
+    assert os.path.exists(os.path.join(registry.version_dir(manifest['version']), 'rf_best_model.joblib'))
+    assert [m['version'] for m in registry.versions()] == [manifest['version']]
+    # No temporary directory is left behind
+    assert os.listdir(registry.versions_dir) == [manifest['version']]
+
+
+def test_republishing_is_a_no_op_but_names_are_not_reused(registry, tmp_path):
+    first = registry.publish(write_classifier(tmp_path, 'a.joblib', {'trees': 1}), CONFIG, version='v1')
+    assert registry.publish(os.path.join(registry.version_dir('v1'), 'a.joblib'), CONFIG, version='v1') == first
+    with pytest.raises(RegistryError):
+        registry.publish(write_classifier(tmp_path, 'b.joblib', {'trees': 2}), CONFIG, version='v1')
+
+
+def test_publish_artifacts_reads_model_config(registry, tmp_path):
+    artifacts = tmp_path / 'artifacts'
+    artifacts.mkdir()
+    (artifacts / 'model_config.json').write_text(json.dumps(CONFIG))
+    with pytest.raises(RegistryError):
+        registry.publish_artifacts(str(artifacts))
+
+    write_classifier(artifacts, 'rf_best_model.joblib', {'trees': 1})
+    manifest = registry.publish_artifacts(str(artifacts), version='v1')
+    assert manifest['model_type'] == 'RandomForest'
+    assert manifest['feature_extractor'] is None
+
+
+def test_routing(registry, tmp_path):
+    assert registry.routing() == {'active': None, 'candidate': None, 'candidate_fraction': 0.0}
+    for version in ('v1', 'v2'):
+        registry.publish(write_classifier(tmp_path, f'{version}.joblib', {'version': version}), CONFIG,
+                         version=version)
+
+    registry.set_routing(active='v1', candidate='v2', candidate_fraction=0.25)
+    assert registry.routing() == {'active': 'v1', 'candidate': 'v2', 'candidate_fraction': 0.25}
+    # Clearing the candidate clears its fraction
+    registry.set_routing(candidate=None)
+    assert registry.routing()['candidate_fraction'] == 0.0
+
+    with pytest.raises(RegistryError):
+        registry.set_routing(active='missing')
+    with pytest.raises(RegistryError):
+        registry.set_routing(candidate='v2', candidate_fraction=1.5)
+    assert registry.routing()['active'] == 'v1'
+
+
+def test_check_compatible():
+    manifest = dict(CONFIG, version='v1')
+    check_compatible(manifest, CATEGORIES, (224, 224), 1280)
+    with pytest.raises(RegistryError):
+        check_compatible(manifest, CATEGORIES[:2], (224, 224), 1280)
+    with pytest.raises(RegistryError):
+        check_compatible(manifest, CATEGORIES, (160, 160), 1280)
+    with pytest.raises(RegistryError):
+        check_compatible(manifest, CATEGORIES, (224, 224), 64)
+
+
+def test_router_splits_traffic_by_digest():
+    active = LoadedModel('v1', {'trees': 1}, {}, 'v1', 'v1.joblib')
+    candidate = LoadedModel('v2', {'trees': 2}, {}, 'v2', 'v2.joblib')
+    router = ModelRouter()
+    router.swap(active, candidate, candidate_fraction=0.5)
+
+    assert router.route('00000000' + '0' * 56) == (candidate, 'candidate')
+    assert router.route('ffffffff' + '0' * 56) == (active, 'active')
+    # The same digest always goes to the same version
+    digest = '7fffffff' + '0' * 56
+    assert len({router.route(digest)[1] for _ in range(10)}) == 1
+
+    router.swap(active)
+    assert router.route('00000000' + '0' * 56) == (active, 'active')
+    stats = router.stats()
+    assert stats['active']['version'] == 'v1' and stats['candidate'] is None
+    assert stats['swaps'] == 2
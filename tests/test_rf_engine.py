@@ -0,0 +1,104 @@
+import glob
+import json
+import os
+import pickle
+
+import numpy as np
+import pytest
+import sklearn
+from sklearn.ensemble import RandomForestClassifier
+
+import inference
+from feature_backends import load_feature_backend
+from rf_engine import FlatForest
+
+
+@pytest.fixture(scope='module')
+def data():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(300, 40)).astype(np.float32)
+    y = (X[:, 0] + X[:, 1] > 0).astype(int) + (X[:, 2] > 1).astype(int)
+    return X[:200], y[:200], X[200:]
+
+
+@pytest.fixture(scope='module')
+def forest(data):
+    X_train, y_train, _ = data
+    return RandomForestClassifier(n_estimators=25, max_depth=None, random_state=0).fit(X_train, y_train)
+
+
+def test_matches_sklearn(forest, data):
+    _, _, X_test = data
+    flat = FlatForest.from_sklearn(forest)
+
+    np.testing.assert_allclose(flat.predict_proba(X_test), forest.predict_proba(X_test), rtol=0, atol=1e-12)
+    classes, proba = flat.predict_with_proba(X_test)
+    np.testing.assert_array_equal(classes, forest.predict(X_test))
+    np.testing.assert_array_equal(flat.predict(X_test), forest.predict(X_test))
+
+
+def test_matches_sklearn_after_save_and_load(forest, data, tmp_path, monkeypatch):
+    _, _, X_test = data
+    model_path = tmp_path / 'model.pkl'
+    with open(model_path, 'wb') as f:
+        pickle.dump(forest, f, protocol=4)
+    forest_dir = tmp_path / 'model_forest'
+    monkeypatch.setattr(inference, 'MODEL_PATH', str(model_path))
+    monkeypatch.setattr(inference, 'FOREST_DIR', str(forest_dir))
+
+    assert inference.save_flat_forest()
+    for mmap in (True, False):
+        flat = inference.load_flat_classifier(str(forest_dir), mmap=mmap)
+        assert isinstance(flat, FlatForest)
+        np.testing.assert_allclose(flat.predict_proba(X_test), forest.predict_proba(X_test), rtol=0, atol=1e-12)
+
+
+def test_rejects_wrong_feature_count(forest):
+    flat = FlatForest.from_sklearn(forest)
+    with pytest.raises(ValueError):
+        flat.predict_proba(np.zeros((2, 39), dtype=np.float32))
+
+
+BUNDLED_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Ai Agent Project')
+BUNDLED_MODEL = os.path.join(BUNDLED_DIR, 'Random_Forest_best_model.joblib')
+
+
+@pytest.fixture(scope='module')
+def bundled():
+    """(classifier, features of the bundled pothos*.jpg samples) for the saved model, or skip"""
+    if not os.path.exists(BUNDLED_MODEL):
+        pytest.skip(f"No saved model at {BUNDLED_MODEL}")
+    config_path = os.path.join(BUNDLED_DIR, 'model_config.json')
+    if os.path.exists(config_path):
+        with open(config_path) as f:
+            trained_with = json.load(f).get('sklearn_version')
+        # Other sklearn versions unpickle the trees but may score them differently
+        if trained_with and trained_with != sklearn.__version__:
+            pytest.skip(f"Model was saved with sklearn {trained_with}, running {sklearn.__version__}")
+    samples = sorted(glob.glob(os.path.join(BUNDLED_DIR, 'pothos*.jpg')))
+    if not samples:
+        pytest.skip(f"No pothos*.jpg samples in {BUNDLED_DIR}")
+    try:
+        extractor = load_feature_backend('keras', artifact_dir=BUNDLED_DIR, offline=True)
+    except Exception as e:
+        pytest.skip(f"Feature extractor unavailable: {e}")
+
+    inputs = []
+    for path in samples:
+        with open(path, 'rb') as f:
+            inputs.append(inference.preprocess_image_bytes(f.read()))
+    return inference.load_pickled_classifier(BUNDLED_MODEL), extractor.predict(np.stack(inputs))
+
+
+def test_saved_model_matches_sklearn_on_bundled_samples(bundled, tmp_path, monkeypatch):
+    classifier, features = bundled
+    expected = classifier.predict_proba(features)
+    np.testing.assert_allclose(inference.flatten_classifier(classifier).predict_proba(features), expected,
+                               rtol=0, atol=1e-12)
+
+    monkeypatch.setattr(inference, 'MODEL_PATH', BUNDLED_MODEL)
+    monkeypatch.setattr(inference, 'FOREST_DIR', str(tmp_path / 'forest'))
+    assert inference.save_flat_forest()
+    flat = inference.load_flat_classifier(str(tmp_path / 'forest'), mmap=True)
+    np.testing.assert_allclose(flat.predict_proba(features), expected, rtol=0, atol=1e-12)
+    np.testing.assert_array_equal(flat.predict(features), classifier.predict(features))
@@ -0,0 +1,19 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import serve
+
+
+def test_confirm_workers_waits_for_every_process():
+    with ProcessPoolExecutor(max_workers=3) as pool:
+        workers = asyncio.run(serve.confirm_workers(pool, 3, interval=0.01))
+    assert len(workers) == 3
+    assert os.getpid() not in workers
+    # No models are loaded outside init_worker
+    assert not any(workers.values())
+
+
+def test_worker_status_reports_the_feature_model(monkeypatch):
+    monkeypatch.setitem(serve._worker, 'feature_model', object())
+    assert serve.worker_status() == (os.getpid(), True)
@@ -0,0 +1,162 @@
+import time
+
+import numpy as np
+import pytest
+
+from cache import CacheEntry, PredictionCache
+from shared_cache import RedisStore, SharedTier, SqliteStore, decode_entry, encode_entry, open_store
+
+F16_TOLERANCE = dict(rtol=1e-3, atol=1e-3)
+
+
+class FakeRedis:
+    """In-memory stand-in for the redis client calls RedisStore makes"""
+
+    def __init__(self):
+        self.data = {}
+
+    def _live(self, key):
+        value, expires = self.data.get(key, (None, None))
+        if expires is not None and time.time() >= expires:
+            del self.data[key]
+            return None
+        return value
+
+    def mget(self, keys):
+        return [self._live(key) for key in keys]
+
+    def set(self, key, value, ex=None):
+        self.data[key] = (value, time.time() + ex if ex else None)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def scan_iter(self, match='*', count=None):
+        prefix = match.rstrip('*')
+        return [key for key in list(self.data) if key.startswith(prefix) and self._live(key) is not None]
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def set(self, key, value, ex=None):
+        self.commands.append((key, value, ex))
+
+    def execute(self):
+        for command in self.commands:
+            self.client.set(*command)
+
+
+class BrokenStore:
+    name = 'broken'
+
+    def get_many(self, keys):
+        raise ConnectionError('store is down')
+
+    def set_many(self, items, ttl):
+        raise ConnectionError('store is down')
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock(time.time())
+    monkeypatch.setattr(time, 'time', clock)
+    return clock
+
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def store(request, tmp_path):
+    if request.param == 'sqlite':
+        return SqliteStore(str(tmp_path / 'shared.db'))
+    return RedisStore(client=FakeRedis())
+
+
+def entry(seed, created=None):
+    features = np.random.default_rng(seed).normal(size=1280).astype(np.float32)
+    return CacheEntry(features, {'success': True, 'disease': 'Healthy', 'seed': seed}, created)
+
+
+def test_encode_decode_round_trip():
+    original = entry(0, created=1234.5)
+    features, response, created = decode_entry(encode_entry(original))
+    assert features.dtype == np.float32
+    np.testing.assert_allclose(features, original.features, **F16_TOLERANCE)
+    assert response == original.response
+    assert created == 1234.5
+
+
+def test_put_and_get(store):
+    tier = SharedTier(store)
+    tier.put_many([('a', entry(1)), ('b', entry(2))], ttl=60)
+
+    a, missing, b = tier.get_many(['a', 'missing', 'b'])
+    assert missing is None
+    np.testing.assert_allclose(a[0], entry(1).features, **F16_TOLERANCE)
+    np.testing.assert_allclose(b[0], entry(2).features, **F16_TOLERANCE)
+    assert a[1]['seed'] == 1 and b[1]['seed'] == 2
+
+
+def test_store_expires_entries_after_ttl(store, clock):
+    tier = SharedTier(store)
+    tier.put_many([('a', entry(1))], ttl=60)
+    clock.now += 59
+    assert tier.get_many(['a'])[0] is not None
+    clock.now += 2
+    assert tier.get_many(['a'])[0] is None
+
+
+def test_replicas_share_entries(store):
+    first = PredictionCache(max_entries=16, shared=SharedTier(store))
+    second = PredictionCache(max_entries=16, shared=SharedTier(store))
+    original = entry(3)
+    first.put('key', original.features, original.response)
+
+    cached = second.get('key')
+    assert cached is not None
+    np.testing.assert_allclose(cached.features, original.features, **F16_TOLERANCE)
+    assert cached.response == original.response
+    assert second.stats()['shared_hits'] == 1
+    # Promoted into the second replica's memory tier
+    second.get('key')
+    assert second.stats()['hits'] == 1
+
+
+def test_prediction_cache_ttl_applies_to_shared_entries(tmp_path, clock):
+    store = SqliteStore(str(tmp_path / 'shared.db'))
+    writer = PredictionCache(max_entries=16, ttl_seconds=0, shared=SharedTier(store))
+    reader = PredictionCache(max_entries=16, ttl_seconds=10, shared=SharedTier(store))
+    original = entry(4)
+    writer.put('key', original.features, original.response)
+
+    clock.now += 11
+    assert reader.get('key') is None
+    assert reader.stats()['expirations'] == 1
+
+
+def test_failing_store_is_skipped_until_retry(monkeypatch):
+    monotonic = Clock(0.0)
+    monkeypatch.setattr(time, 'monotonic', monotonic)
+    tier = SharedTier(BrokenStore(), retry_seconds=30)
+
+    assert tier.get_many(['a', 'b']) == [None, None]
+    assert tier.stats()['errors'] == 1 and not tier.available
+    tier.put_many([('a', entry(1))], ttl=60)
+    assert tier.stats()['skipped'] == 1
+    monotonic.now += 31
+    assert tier.available
+
+
+def test_open_store_by_url(tmp_path):
+    assert isinstance(open_store(f"sqlite:///{tmp_path}/cache.db"), SqliteStore)
+    with pytest.raises(ValueError):
+        open_store('memcached://localhost')